@@ -0,0 +1,451 @@
+"""
+Benchmarks of the stages between profiling a statement and displaying the
+widget, which don't need a notebook:
+
+    python benchmarks/pipeline.py [--functions 1000,10000] [--depth D]
+                                  [--fan-out F] [--profile PATH]...
+                                  [--output results.json]
+                                  [--compare old_results.json]
+
+Profiles are synthetic call graphs of the given numbers of functions,
+arranged in `depth` levels with each function calling `fan-out` functions
+of the next level, whose code is written to temporary source files; a
+profile of a real workload (compiling and round tripping standard library
+code), recorded when the benchmarks start; and any saved profiles or pstats
+files given with --profile.
+
+For each profile, each stage is timed (the best of --repeat runs) and run
+once more under tracemalloc to find its peak memory use:
+
+    build      CallGraph.from_cprofile, as in IProfile.generate_cprofile_tree
+               (or loading the file, for --profile)
+    prune      prune_top_level, as in IProfile.delete_top_level
+    callers    building the reverse caller index
+    flame      the flame graph frames of the summary page
+    hot_paths  the hot paths listed on the summary page
+    highlight  highlighting and formatting the line profiles of the 50
+               slowest functions, with an empty source cache
+    export     exporting the profile for speedscope, to os.devnull
+    widget     creating an IProfile
+    table      IProfile.generate_table for the summary page and the pages
+               of the 50 slowest functions, with empty caches
+
+and the size of the comm messages sent to the front end (the function
+names, a page of the table and the flame graph) is recorded. The widget and
+table stages are skipped if ipywidgets or Bokeh can't be imported.
+
+The results are written as JSON to --output. With --compare, the times are
+compared with an earlier results file, and the exit status is nonzero if any
+stage got slower by more than --threshold.
+"""
+from __future__ import division, print_function
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from timeit import default_timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import iprofiler
+from iprofiler import export, store
+from iprofiler.callgraph import CallGraph, prune_top_level
+from iprofiler.formatter import format_lprofile
+from iprofiler.sampler import LineStats
+from iprofiler.source import source_cache
+
+try:
+    from iprofiler.iprofiler import IProfile
+except ImportError:
+    # ipywidgets or Bokeh aren't installed.
+    IProfile = None
+
+# Version of the format of the results file.
+RESULTS_VERSION = 1
+
+# Number of functions whose pages are rendered by the highlight and table
+# stages.
+N_PAGES = 50
+
+
+class Case(object):
+    """
+    A profile to benchmark: the raw cProfile stats (or None for a file
+    given with --profile, which is loaded by the build stage instead), the
+    context passed to prune_top_level, and the line timings.
+    """
+    def __init__(self, name, stats=None, path=None, lprofile=None,
+                 context="LINE_MAGIC"):
+        self.name = name
+        self.stats = stats
+        self.path = path
+        self.lprofile = lprofile
+        self.context = context
+
+
+def synthetic_case(directory, n_functions, depth, fan_out, lines,
+                   functions_per_file, rng):
+    """
+    Return a Case of a synthetic call graph of n_functions functions, whose
+    source is written to files in directory. The functions are split into
+    `depth` levels, each function calls fan_out random functions of the next
+    level, and a <module> code object calls the first level.
+    """
+    codes = []
+    for start in range(0, n_functions, functions_per_file):
+        path = os.path.join(directory, 'synthetic_{}.py'.format(start))
+        source = []
+        for i in range(start, min(start + functions_per_file, n_functions)):
+            source.append("def f_{}(x):".format(i))
+            for j in range(lines):
+                source.append("    x = x * {} + len(str(x)) % 7".format(j))
+            source.append("    return x\n")
+        with open(path, 'w') as f:
+            f.write("\n".join(source))
+        namespace = {}
+        with open(path) as f:
+            exec(compile(f.read(), path, 'exec'), namespace)
+        codes.extend(namespace['f_{}'.format(i)].__code__ for i in
+                     range(start, min(start + functions_per_file,
+                                      n_functions)))
+    module = compile("pass", os.path.join(directory, 'synthetic_0.py'),
+                     'exec')
+
+    levels = np.array_split(np.arange(n_functions), depth)
+    callcount = [rng.randint(1, 1000) for _ in range(n_functions)]
+    inlinetime = [rng.expovariate(1e3) for _ in range(n_functions)]
+    totaltime = list(inlinetime)
+    callees = [[] for _ in range(n_functions)]
+    n_callers = [0] * n_functions
+    for level, next_level in zip(levels[:-1], levels[1:]):
+        for i in level:
+            callees[i] = sorted(set(rng.choice(next_level) for _ in
+                                    range(fan_out)))
+            for j in callees[i]:
+                n_callers[j] += 1
+    # Each function's time is split between its callers.
+    for level in reversed(levels[:-1]):
+        for i in level:
+            totaltime[i] += sum(totaltime[j] / n_callers[j] for
+                                j in callees[i])
+
+    stats = [(module, 1, 0, sum(totaltime[i] for i in levels[0]), 0.,
+              [(codes[i], callcount[i], 0, totaltime[i], inlinetime[i]) for
+               i in levels[0]])]
+    for i, code in enumerate(codes):
+        calls = [(codes[j], max(1, callcount[j] // n_callers[j]), 0,
+                  totaltime[j] / n_callers[j],
+                  inlinetime[j] / n_callers[j]) for j in callees[i]]
+        stats.append((code, callcount[i], 0, totaltime[i], inlinetime[i],
+                      calls))
+
+    timings = {}
+    for i, code in enumerate(codes):
+        rows = [(code.co_firstlineno + 1 + j, callcount[i],
+                 int(inlinetime[i] * 1e6 / lines)) for j in range(lines)]
+        timings[(code.co_filename, code.co_firstlineno, code.co_name)] = (
+            rows + [code.co_filename])
+    return Case('synthetic-{}'.format(n_functions), stats,
+                lprofile=LineStats(timings, 1e-6))
+
+
+def stdlib_case():
+    """
+    Return a Case of a profile of real code: compiling and disassembling
+    standard library modules, and round tripping data through json and
+    pickle. Every function which is called is line profiled if the line
+    profiler is built.
+    """
+    import cProfile
+    import dis
+    import io
+    import pickle
+    import sysconfig
+
+    def workload():
+        stdlib = sysconfig.get_paths()['stdlib']
+        for name in ('json/decoder.py', 'json/encoder.py', 'difflib.py',
+                     'textwrap.py', 'argparse.py'):
+            with io.open(os.path.join(stdlib, name), encoding='utf-8') as f:
+                source = f.read()
+            code = compile(source, name, 'exec')
+            dis.dis(code, file=io.StringIO())
+        data = [{'key': str(i), 'values': list(range(i % 50))} for
+                i in range(2000)]
+        for _ in range(5):
+            json.loads(json.dumps(data))
+            pickle.loads(pickle.dumps(data))
+
+    lprofiler = None
+    try:
+        from iprofiler import timers
+        lprofiler = timers.line_profiler()
+    except ImportError:
+        pass
+    profiler = cProfile.Profile()
+    if lprofiler is not None:
+        lprofiler.enable()
+    profiler.enable()
+    workload()
+    profiler.disable()
+    if lprofiler is not None:
+        lprofiler.disable()
+    return Case('stdlib', profiler.getstats(),
+                lprofile=None if lprofiler is None else lprofiler.get_stats(),
+                context=None)
+
+
+def stages(case):
+    """
+    Return a list of (stage, function) pairs for case, where function()
+    runs the stage. Stages use the results of the earlier stages.
+    """
+    state = {}
+
+    def build():
+        if case.path is None:
+            state['raw'] = CallGraph.from_cprofile(case.stats)
+        elif store.is_profile(case.path):
+            state['raw'], case.lprofile = store.load_profile(case.path)
+        else:
+            state['raw'] = store.load_pstats(case.path)
+
+    def prune():
+        state['graph'] = prune_top_level(state['raw'], case.context)
+
+    def callers():
+        graph = state['graph']
+        graph._caller_index = None
+        graph.caller_index()
+
+    def flame():
+        graph = state['graph']
+        state['flame'] = graph.flame(graph.roots())
+
+    def hot_paths():
+        graph = state['graph']
+        graph.hot_paths(graph.roots())
+
+    def highlight():
+        source_cache.clear()
+        for key in top_functions(state['graph']):
+            ltimings = store.merged_ltimings(case.lprofile, key)
+            if ltimings is not None:
+                format_lprofile(key.co_firstlineno, ltimings,
+                                unit=case.lprofile.unit)
+
+    def export_speedscope():
+        graph = state['graph']
+        export.write_profile(
+            os.devnull, graph,
+            lambda key: store.merged_ltimings(case.lprofile, key),
+            store.timer_unit(case.lprofile), format='speedscope')
+
+    def widget():
+        state['widget'] = IProfile(state['graph'], case.lprofile)
+
+    def table():
+        widget = state['widget']
+        for fun in [None] + top_functions(state['graph']):
+            widget.table_cache.clear()
+            widget.time_columns_cache = {}
+            state.setdefault('tables', {})[fun] = widget.generate_table(fun)
+
+    result = [('build', build), ('prune', prune), ('callers', callers),
+              ('flame', flame), ('hot_paths', hot_paths)]
+    if case.lprofile is not None:
+        result.append(('highlight', highlight))
+    result.append(('export', export_speedscope))
+    if IProfile is not None:
+        result.extend([('widget', widget), ('table', table)])
+    return result, state
+
+
+def top_functions(graph):
+    """Return the code objects of the N_PAGES slowest functions in graph."""
+    order = np.argsort(-graph.nodes['totaltime'], kind='mergesort')
+    return [graph.keys[i] for i in order if
+            hasattr(graph.keys[i], 'co_firstlineno')][:N_PAGES]
+
+
+def payload_sizes(state):
+    """
+    Return the sizes in bytes of the comm messages sent to the front end:
+    the function names (synced as JSON), the first page of the summary
+    table and the flame graph (both sent as binary buffers).
+    """
+    graph = state['graph']
+    sizes = {'names': len(json.dumps([graph.name(i) for
+                                       i in range(len(graph))]))}
+    sizes['flame'] = sum(np.asarray(state['flame'][column]).nbytes for
+                         column in ('ids', 'depths', 'starts', 'widths'))
+    tables = state.get('tables')
+    if tables:
+        widget = state['widget']
+        sizes['table'] = sum(
+            np.asarray(tables[None][column], dtype=dtype).nbytes for
+            column, dtype in widget.table_binary_columns)
+    return sizes
+
+
+def run_case(case, repeat):
+    """Run the stages of case, returning a list of results."""
+    times = {}
+    for _ in range(repeat):
+        stage_list, state = stages(case)
+        for stage, function in stage_list:
+            gc.collect()
+            start = default_timer()
+            function()
+            times.setdefault(stage, []).append(default_timer() - start)
+    sizes = payload_sizes(state)
+
+    peaks = {}
+    stage_list, state = stages(case)
+    for stage, function in stage_list:
+        gc.collect()
+        tracemalloc.start()
+        function()
+        peaks[stage] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    graph = state['graph']
+    results = []
+    for stage, _ in stage_list:
+        results.append({'case': case.name, 'stage': stage,
+                        'n_functions': len(graph),
+                        'n_calls': len(graph.indices),
+                        'time': min(times[stage]), 'times': times[stage],
+                        'peak_memory': peaks[stage]})
+    results.append({'case': case.name, 'stage': 'payload',
+                    'n_functions': len(graph),
+                    'n_calls': len(graph.indices), 'bytes': sizes})
+    return results
+
+
+def compare(results, old_results, threshold):
+    """
+    Print the change in time of each stage since old_results, and return
+    whether any stage got slower by more than the fraction threshold.
+    """
+    old_times = {(result['case'], result['stage']): result['time'] for
+                 result in old_results['results'] if 'time' in result}
+    regressed = False
+    print("\nCompared with iprofiler {} ({}):".format(
+        old_results['iprofiler'], old_results['date']))
+    for result in results:
+        old = old_times.get((result['case'], result['stage']))
+        if old is None or 'time' not in result or not old:
+            continue
+        ratio = result['time'] / old
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  slower"
+            regressed = True
+        print("{:<20} {:<10} {:6.2f}x{}".format(result['case'],
+                                                result['stage'], ratio, flag))
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark iprofiler's capture and rendering stages.")
+    parser.add_argument('--functions', default='1000,10000',
+                        help="comma separated sizes of the synthetic "
+                             "profiles (default: 1000,10000)")
+    parser.add_argument('--depth', type=int, default=12,
+                        help="the number of levels of the synthetic call "
+                             "graphs (default: 12)")
+    parser.add_argument('--fan-out', type=int, default=4,
+                        help="the number of functions each function calls "
+                             "(default: 4)")
+    parser.add_argument('--lines', type=int, default=10,
+                        help="the number of lines of each synthetic "
+                             "function (default: 10)")
+    parser.add_argument('--functions-per-file', type=int, default=200,
+                        help="the number of synthetic functions in each "
+                             "source file (default: 200)")
+    parser.add_argument('--profile', action='append', default=[],
+                        help="a saved profile or pstats file to benchmark "
+                             "(may be repeated)")
+    parser.add_argument('--no-stdlib', action='store_true',
+                        help="skip the profile of standard library code")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="the number of timed runs of each stage "
+                             "(default: 5)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                        help="where to write the results (default: "
+                             "benchmark_results.json)")
+    parser.add_argument('--compare', metavar='RESULTS',
+                        help="an earlier results file to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="the fraction by which a stage may get slower "
+                             "before --compare fails (default: 0.2)")
+    options = parser.parse_args(argv)
+
+    rng = random.Random(options.seed)
+    directory = tempfile.mkdtemp(prefix='iprofiler_benchmark_')
+    try:
+        cases = [synthetic_case(directory, int(n), options.depth,
+                                options.fan_out, options.lines,
+                                options.functions_per_file, rng) for
+                 n in options.functions.split(',') if n]
+        if not options.no_stdlib:
+            cases.append(stdlib_case())
+        for path in options.profile:
+            lprofile = None
+            if store.is_profile(path):
+                _, lprofile = store.load_profile(path)
+            cases.append(Case(os.path.basename(path), path=path,
+                              lprofile=lprofile, context=None))
+
+        results = []
+        for case in cases:
+            case_results = run_case(case, options.repeat)
+            for result in case_results:
+                if 'time' in result:
+                    print("{:<20} {:<10} {:10.2f} ms {:10.1f} KiB".format(
+                        result['case'], result['stage'],
+                        1e3 * result['time'], result['peak_memory'] / 1024.))
+                else:
+                    print("{:<20} {:<10} {}".format(
+                        result['case'], result['stage'],
+                        ", ".join("{} {:.1f} KiB".format(name, size / 1024.)
+                                  for name, size in
+                                  sorted(result['bytes'].items()))))
+            results.extend(case_results)
+    finally:
+        shutil.rmtree(directory)
+
+    with open(options.output, 'w') as f:
+        json.dump({'version': RESULTS_VERSION,
+                   'iprofiler': iprofiler.__version__,
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'platform': platform.platform(),
+                   'date': datetime.datetime.now().isoformat(),
+                   'options': vars(options),
+                   'results': results}, f, indent=1)
+    print("Results written to {}".format(options.output))
+
+    if options.compare:
+        with open(options.compare) as f:
+            if compare(results, json.load(f), options.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
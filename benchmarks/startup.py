@@ -0,0 +1,95 @@
+"""
+Startup benchmark: time "import iprofiler" and "%load_ext iprofiler", each
+in a fresh interpreter, and check that neither imports the heavy
+dependencies, which should only be imported when %iprofile is first run.
+
+    python benchmarks/startup.py [--budget SECONDS] [--repeat N]
+
+Exits with a nonzero status if the best time of either step is over the
+budget, or if it imports any of the heavy dependencies.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Modules which neither step may import. Other modules imported by IPython
+# itself (e.g. Pygments) are allowed if IPython imported them first.
+HEAVY_MODULES = ('numpy', 'bokeh', 'ipywidgets', 'traitlets', 'pygments',
+                 'zipfile', 'iprofiler.iprofiler', 'iprofiler.callgraph')
+
+# Code run in a fresh interpreter for each step. Each prints the time the
+# step took and the modules which it imported, as JSON.
+_SETUP = {
+    'import': "",
+    'load_ext': ("from IPython.core.interactiveshell import "
+                 "InteractiveShell\n"
+                 "shell = InteractiveShell.instance()\n"),
+}
+_STEPS = {
+    'import': "import iprofiler\n",
+    'load_ext': "shell.extension_manager.load_extension('iprofiler')\n",
+}
+_TEMPLATE = """
+import json, sys
+from timeit import default_timer
+{setup}
+before = set(sys.modules)
+start = default_timer()
+{step}
+time = default_timer() - start
+print(json.dumps({{'time': time,
+                  'modules': sorted(set(sys.modules) - before)}}))
+"""
+
+
+def run_step(step):
+    """
+    Run step in a fresh interpreter, returning the time which it took and
+    the modules which it imported.
+    """
+    code = _TEMPLATE.format(setup=_SETUP[step], step=_STEPS[step])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [path for path in [env.get('PYTHONPATH')] if path])
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    return result['time'], result['modules']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check the startup time of iprofiler.")
+    parser.add_argument('--budget', type=float, default=0.05,
+                        help="the maximum time of each step in seconds "
+                             "(default: 0.05)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="the number of times to run each step, of "
+                             "which the best time is used (default: 5)")
+    options = parser.parse_args(argv)
+
+    failed = False
+    for step in ('import', 'load_ext'):
+        times = []
+        for _ in range(options.repeat):
+            time, modules = run_step(step)
+            times.append(time)
+        heavy = [module for module in modules if
+                 module.split('.')[0] in HEAVY_MODULES or
+                 module in HEAVY_MODULES]
+        status = "ok"
+        if min(times) > options.budget:
+            status = "over budget"
+        if heavy:
+            status = "imports " + ", ".join(sorted(heavy))
+        failed = failed or status != "ok"
+        print("{:<10} {:8.1f} ms  {}".format(step, 1e3 * min(times), status))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
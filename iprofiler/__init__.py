@@ -1,6 +1,44 @@
+import importlib
+import sys
+
 from ._version import version_info, __version__
 
-from .iprofiler import *
+# Functions of the continuous profiler (see live), imported on first use.
+_LIVE_FUNCTIONS = ('start', 'snapshot', 'stop')
+
+
+def load_ipython_extension(shell):
+    # Only the magics are imported here, see magics.
+    from .magics import load_ipython_extension
+    load_ipython_extension(shell)
+
+
+if sys.version_info >= (3, 7):
+    # Module __getattr__ and importlib.util.find_spec of submodules need
+    # Python 3.7+, older versions import everything up front.
+    import importlib.util
+
+    def __getattr__(name):
+        # The widgets need ipywidgets and Bokeh, and the profilers NumPy, so
+        # nothing is imported until it is first used: neither "import
+        # iprofiler" nor "%load_ext iprofiler" import them, nor does the
+        # command line interface (see __main__) import the widgets.
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in _LIVE_FUNCTIONS:
+            return getattr(importlib.import_module('.live', __name__), name)
+        if importlib.util.find_spec('.' + name, __name__) is not None:
+            # A submodule, e.g. from "from iprofiler import store".
+            return importlib.import_module('.' + name, __name__)
+        iprofiler = importlib.import_module('.iprofiler', __name__)
+        try:
+            return getattr(iprofiler, name)
+        except AttributeError:
+            raise AttributeError("module 'iprofiler' has no attribute "
+                                 "{!r}".format(name))
+else:
+    from .live import start, snapshot, stop
+    from .iprofiler import *
 
 def _jupyter_nbextension_paths():
     return [{
@@ -0,0 +1,150 @@
+"""
+Command line interface, for profiling scripts without Jupyter:
+
+    python -m iprofiler [options] script.py [args...]
+
+profiles script.py, run as __main__ with the given arguments, and writes the
+profile to a file which IProfile.load can open, to a static HTML report if
+the output path ends with .html, or for speedscope or Chrome's trace viewer
+if it ends with .speedscope.json or .trace.json. A saved profile (or pstats
+file) can also be given instead of a script, to convert it.
+
+IPython, ipywidgets and Bokeh aren't imported.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import sys
+import traceback
+
+from . import capture, export, report, store, timers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m iprofiler',
+        description="Profile a Python script, and save the profile or an "
+                    "HTML report of it.")
+    parser.add_argument('-o', '--output',
+                        help="where to write the profile, or the HTML "
+                             "report if this ends with .html, or an export "
+                             "for speedscope or Chrome's trace viewer if it "
+                             "ends with .speedscope.json or .trace.json "
+                             "(default: the script's name with .iprofile "
+                             "appended)")
+    parser.add_argument('-l', action='store_true', dest='line_profile',
+                        help="line profile every function which is called")
+    parser.add_argument('-m', action='append', dest='modules', default=[],
+                        metavar='MODULE',
+                        help="line profile every function in MODULE (may "
+                             "be repeated)")
+    parser.add_argument('--sample', action='store_true',
+                        help="sample the call stack periodically, rather "
+                             "than tracing every call")
+    parser.add_argument('-i', type=float, default=0.005, dest='interval',
+                        help="the sampling interval in seconds "
+                             "(default: 0.005)")
+    parser.add_argument('--timer', choices=[name for name, _ in
+                                            timers.TIMERS],
+                        help="time with the wall clock, or the CPU time of "
+                             "the process or thread (default: the "
+                             "profilers' own wall clock timers)")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="subtract the measured overhead of tracing "
+                             "from inline times and line timings")
+    parser.add_argument('script',
+                        help="the script to profile, or a saved profile to "
+                             "convert")
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help="arguments passed to the script")
+    options = parser.parse_args(argv)
+    if options.sample and (options.line_profile or options.modules):
+        parser.error("--sample can't be combined with the line profiling "
+                     "options.")
+    if options.sample and (options.timer or options.calibrate):
+        parser.error("--sample can't be combined with --timer or "
+                     "--calibrate.")
+    if options.timer:
+        try:
+            timers.get_timer(options.timer)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if _is_saved(options.script):
+        if store.is_profile(options.script):
+            graph, lprofile = store.load_profile(options.script)
+        else:
+            graph, lprofile = store.load_pstats(options.script), None
+        output = options.output or options.script + '.html'
+        status = 0
+    else:
+        graph, lprofile, status = profile_script(options)
+        output = options.output or options.script + '.iprofile'
+
+    if output.endswith('.html'):
+        report.write_html(output, graph, lprofile,
+                          title=os.path.basename(options.script))
+    elif export.format_for_path(output) is not None:
+        export.write_profile(output, graph,
+                             lambda key: store.merged_ltimings(lprofile, key),
+                             store.timer_unit(lprofile),
+                             name=os.path.basename(options.script))
+    else:
+        store.save_profile(output, graph,
+                           store.ltimings_by_label(graph, lprofile),
+                           store.timer_unit(lprofile))
+    print("Profile written to {}".format(output), file=sys.stderr)
+    return status
+
+
+def profile_script(options):
+    """
+    Run the script given by the command line options as __main__, under the
+    profilers which they select. Return the call graph below the script,
+    the line timings (or None) and the exit status of the script.
+    """
+    path = options.script
+    with open(path, 'rb') as f:
+        code = compile(f.read(), path, 'exec')
+    namespace = {'__name__': '__main__', '__file__': path,
+                 '__package__': None, '__builtins__': __builtins__}
+    sys.argv = [path] + options.args
+    sys.path[0] = os.path.dirname(os.path.abspath(path))
+    status = []
+
+    def run():
+        try:
+            exec(code, namespace)
+        except SystemExit as e:
+            status.append(e.code if isinstance(e.code, int) else
+                          int(e.code is not None))
+        except Exception:
+            # The profile is still written.
+            traceback.print_exc()
+            status.append(1)
+
+    lprofiler = None
+    if options.line_profile or options.modules:
+        lprofiler = timers.line_profiler(options.timer)
+        for name in options.modules:
+            __import__(name)
+            lprofiler.add_module(sys.modules[name])
+
+    if options.sample:
+        graph, lprofile = capture.profile_sampled(run, options.interval)
+    else:
+        graph, lprofile = capture.profile_traced(run, lprofiler,
+                                                 options.timer,
+                                                 options.calibrate)
+    return (capture.graph_below(graph, code), lprofile,
+            status[0] if status else 0)
+
+
+def _is_saved(path):
+    """Return whether path is a saved profile or pstats file."""
+    return store.is_profile(path) or path.endswith(('.pstats', '.prof'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Aggregation of the profiles of repeated runs.
+"""
+from __future__ import absolute_import, division
+
+import numpy as np
+
+from .callgraph import (CallGraph, STAT_COLUMNS, join_label, key_from_label)
+from .sampler import LineStats
+
+
+class RunningStats(object):
+    """
+    Streaming mean, minimum and standard deviation of the entries of a
+    sequence of arrays, computed with Welford's algorithm. Each array may be
+    longer than the previous ones, with the new entries taken to have been
+    zero in the earlier arrays.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.min = np.zeros(0)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n_new = len(values) - len(self.mean)
+        if n_new:
+            zeros = np.zeros(n_new)
+            self.mean = np.concatenate([self.mean, zeros])
+            self.m2 = np.concatenate([self.m2, zeros])
+            self.min = np.concatenate([self.min, zeros])
+        self.n += 1
+        if self.n == 1:
+            self.min = values.copy()
+        else:
+            np.minimum(self.min, values, out=self.min)
+        delta = values - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (values - self.mean)
+
+    def std(self):
+        """Return the sample standard deviation of each entry."""
+        if self.n < 2:
+            return np.zeros_like(self.mean)
+        return np.sqrt(self.m2 / (self.n - 1))
+
+
+class ProfileAggregator(object):
+    """
+    Combines the profiles of repeated runs into the mean, minimum and
+    standard deviation of the statistics of each function and line.
+
+    Runs are added one at a time with add(), and only the running statistics
+    are kept, so memory use doesn't grow with the number of runs. Functions
+    are matched between runs by join_label, and a function or line which
+    doesn't appear in a run counts as zero for that run.
+    """
+    def __init__(self):
+        self.n_runs = 0
+        # The key of each function, from the first run it appeared in.
+        self.keys = []
+        self.ids = {}
+        self.nodes = {column: RunningStats() for column in STAT_COLUMNS}
+        # Sums of the call statistics over all runs.
+        self.calls = CallGraph([], {}, np.zeros(1, dtype=np.intp),
+                               np.zeros(0, dtype=np.intp),
+                               {column: np.zeros(0) for
+                                column in STAT_COLUMNS})
+        # Per function (by join label), its label and filename from the
+        # first run, and a dict mapping line numbers to line ids.
+        self.lines = {}
+        self.n_lines = 0
+        self.nhits = RunningStats()
+        self.time = RunningStats()
+        self.unit = None
+
+    def add(self, graph, ltimings=None, unit=1e-6):
+        """
+        Add a run, given as a CallGraph and, optionally, the line timings of
+        its functions keyed by label (as for store.save_profile), in timer
+        units of `unit` seconds.
+        """
+        ids = np.empty(len(graph), dtype=np.intp)
+        for i, key in enumerate(graph.keys):
+            join = join_label(key)
+            try:
+                ids[i] = self.ids[join]
+            except KeyError:
+                ids[i] = self.ids[join] = len(self.keys)
+                self.keys.append(key)
+
+        n = len(self.keys)
+        for column, stats in self.nodes.items():
+            values = np.zeros(n)
+            np.add.at(values, ids, graph.nodes[column])
+            stats.add(values)
+
+        calls = self.calls
+        self.calls = CallGraph.from_arrays(
+            self.keys, [], {},
+            np.concatenate([calls.callers(), ids[graph.callers()]]),
+            np.concatenate([calls.indices, ids[graph.indices]]),
+            {column: np.concatenate([calls.edges[column],
+                                     graph.edges[column]]).astype(np.float64)
+             for column in STAT_COLUMNS})
+
+        line_ids = []
+        line_nhits = []
+        line_times = []
+        if ltimings:
+            if self.unit is None:
+                self.unit = unit
+            scale = unit / self.unit
+            for key_label, key_ltimings in ltimings.items():
+                join = join_label(key_from_label(key_label))
+                if join not in self.lines:
+                    self.lines[join] = (key_label, key_ltimings[-1], {})
+                linenos = self.lines[join][2]
+                for lineno, nhits, time in key_ltimings[:-1]:
+                    if lineno not in linenos:
+                        linenos[lineno] = self.n_lines
+                        self.n_lines += 1
+                    line_ids.append(linenos[lineno])
+                    line_nhits.append(nhits)
+                    line_times.append(time * scale)
+        for stats, values in ((self.nhits, line_nhits),
+                              (self.time, line_times)):
+            run_values = np.zeros(self.n_lines)
+            np.add.at(run_values, np.array(line_ids, dtype=np.intp), values)
+            stats.add(run_values)
+
+        self.n_runs += 1
+
+    def graph(self):
+        """
+        Return a CallGraph of the mean statistics of each function, with the
+        minimum and standard deviation of each statistic in the node columns
+        'min_<column>' and 'std_<column>'. Calls hold the mean statistics.
+        """
+        nodes = {}
+        for column, stats in self.nodes.items():
+            nodes[column] = stats.mean.copy()
+            nodes['min_' + column] = stats.min.copy()
+            nodes['std_' + column] = stats.std()
+        edges = {column: values / max(1, self.n_runs) for
+                 column, values in self.calls.edges.items()}
+        return CallGraph(self.keys, nodes, self.calls.indptr,
+                         self.calls.indices, edges)
+
+    def line_stats(self):
+        """
+        Return a LineStats object with the mean number of hits and time of
+        each line, rounded to integers, keyed by the label of each function
+        in the first run in which it had line timings.
+        """
+        nhits = np.rint(self.nhits.mean).astype(np.int64)
+        time = np.rint(self.time.mean).astype(np.int64)
+        timings = {}
+        for key_label, filename, linenos in self.lines.values():
+            timings[key_label] = ([(lineno, int(nhits[i]), int(time[i])) for
+                                   lineno, i in sorted(linenos.items())] +
+                                  [filename])
+        return LineStats(timings, self.unit or 1e-6)
+
+    def line_spread(self, key):
+        """
+        Return dicts mapping line numbers of the function with key `key` to
+        the minimum and standard deviation of their times.
+        """
+        try:
+            linenos = self.lines[join_label(key)][2]
+        except KeyError:
+            return {}, {}
+        std = self.time.std()
+        return ({lineno: self.time.min[i] for lineno, i in linenos.items()},
+                {lineno: std[i] for lineno, i in linenos.items()})
@@ -0,0 +1,45 @@
+"""
+Size bounded caches.
+"""
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Mapping which holds at most maxsize items, discarding the least recently
+    used item when full. If on_evict is given it is called with each
+    discarded value.
+    """
+    def __init__(self, maxsize, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        # Move to the most recently used end.
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            _, evicted = self._items.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def clear(self):
+        if self.on_evict is not None:
+            for value in self._items.values():
+                self.on_evict(value)
+        self._items.clear()
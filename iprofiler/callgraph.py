@@ -0,0 +1,676 @@
+"""
+Columnar storage for the call graph recorded by cProfile.
+"""
+from __future__ import absolute_import, division
+
+import heapq
+import re
+from collections import namedtuple
+
+import numpy as np
+
+# Per-function and per-edge statistics recorded by cProfile, in the order in
+# which they appear in the entries returned by cProfile.Profile.getstats().
+STAT_COLUMNS = ('callcount', 'reccallcount', 'totaltime', 'inlinetime')
+_STAT_DTYPES = (np.int64, np.int64, np.float64, np.float64)
+
+# Levels of a reachability search narrower than this are expanded in Python,
+# where the overhead of array operations would dominate.
+_NARROW_FRONTIER = 64
+
+# A path found by CallGraph.hot_paths: the ids of the functions along it,
+# the estimated time of the calls along it (widths[j] is the time spent in
+# ids[j] when called through ids[:j]), and the time spent inline in its last
+# function, all as fractions of the total time of the roots, and the
+# estimated number of calls along it (counts[j] calls of ids[j] are made
+# through ids[:j]).
+HotPath = namedtuple('HotPath', ['ids', 'widths', 'inline', 'counts'])
+
+# Key of the call to cProfile.Profile.disable(), which ends up in the stats
+# of a profiler which is disabled by the profiled code.
+PROFILER_DISABLE_KEY = "<method 'disable' of '_lsprof.Profiler' objects>"
+
+# The execution count in the filenames which IPython gives to cells, which
+# is ignored when matching functions between profiles.
+_IPYTHON_INPUT = re.compile(r"<ipython-input-\d+-")
+
+
+class CallGraph(object):
+    """
+    Call graph stored as flat arrays.
+
+    Every function is interned to an integer id, with keys[id] holding the
+    original cProfile key (a code object, or a string for built-in
+    functions). The statistics for each function live in the 1D arrays of
+    the dict `nodes`, indexed by id.
+
+    The edges from callers to callees are stored in compressed sparse row
+    form: the ids of the functions called by function i are
+    indices[indptr[i]:indptr[i + 1]], and the statistics of those calls are
+    the same slice of the arrays in the dict `edges`. The reverse index,
+    from callees to callers, is built when first needed (see caller_index).
+    """
+    def __init__(self, keys, nodes, indptr, indices, edges):
+        self.keys = list(keys)
+        self.ids = {key: i for i, key in enumerate(self.keys)}
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.edges = edges
+        self._caller_index = None
+
+    @classmethod
+    def from_cprofile(cls, cprofile):
+        """
+        Build a call graph from the output of cProfile.Profile.getstats().
+        """
+        keys = []
+        ids = {}
+
+        def intern(key):
+            try:
+                return ids[key]
+            except KeyError:
+                ids[key] = len(keys)
+                keys.append(key)
+                return ids[key]
+
+        entry_ids = [intern(entry[0]) for entry in cprofile]
+        node_rows = [tuple(entry[1:5]) for entry in cprofile]
+
+        src = []
+        dst = []
+        edge_rows = []
+        for entry_id, entry in zip(entry_ids, cprofile):
+            calls = entry[5]
+            if not calls:
+                continue
+            src.extend([entry_id] * len(calls))
+            dst.extend([intern(call[0]) for call in calls])
+            edge_rows.extend([tuple(call[1:5]) for call in calls])
+
+        return cls.from_edges(keys, entry_ids, node_rows, src, dst, edge_rows)
+
+    @classmethod
+    def from_edges(cls, keys, node_ids, node_rows, src, dst, edge_rows):
+        """
+        Build a call graph from flat lists. node_rows[j] holds the
+        (callcount, reccallcount, totaltime, inlinetime) of function
+        node_ids[j], and edge_rows[j] the statistics of the call from src[j]
+        to dst[j]. Repeated rows for the same function or call are summed.
+        """
+        node_data = np.asarray(node_rows, dtype=np.float64).reshape(-1, 4)
+        edge_data = np.asarray(edge_rows, dtype=np.float64).reshape(-1, 4)
+        nodes = {column: node_data[:, k].astype(dtype) for
+                 k, (column, dtype) in enumerate(zip(STAT_COLUMNS,
+                                                     _STAT_DTYPES))}
+        edges = {column: edge_data[:, k].astype(dtype) for
+                 k, (column, dtype) in enumerate(zip(STAT_COLUMNS,
+                                                     _STAT_DTYPES))}
+        return cls.from_arrays(keys, node_ids, nodes, src, dst, edges)
+
+    @classmethod
+    def from_arrays(cls, keys, node_ids, nodes, src, dst, edges):
+        """
+        Like from_edges, but with the statistics given as dicts of columns
+        rather than as lists of rows.
+        """
+        n = len(keys)
+        node_ids = np.asarray(node_ids, dtype=np.intp)
+        new_nodes = {}
+        for column, values in nodes.items():
+            new_nodes[column] = np.zeros(n, dtype=values.dtype)
+            np.add.at(new_nodes[column], node_ids, values)
+
+        # Sum repeated edges, which also sorts them by caller to give the
+        # CSR layout.
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        edge_keys, inverse = np.unique(src * n + dst, return_inverse=True)
+        new_edges = {}
+        for column, values in edges.items():
+            new_edges[column] = np.zeros(len(edge_keys), dtype=values.dtype)
+            np.add.at(new_edges[column], inverse.ravel(), values)
+
+        indptr = np.zeros(n + 1, dtype=np.intp)
+        np.cumsum(np.bincount(edge_keys // n if n else edge_keys,
+                              minlength=n), out=indptr[1:])
+        indices = (edge_keys % n if n else edge_keys).astype(np.intp)
+        return cls(keys, new_nodes, indptr, indices, new_edges)
+
+    @classmethod
+    def from_pstats(cls, stats):
+        """
+        Build a call graph from the stats dict of a pstats.Stats object (or
+        of a file written by cProfile.Profile.dump_stats). Functions are
+        keyed by CodeKey, or by name for built-in functions.
+        """
+        labels = list(stats)
+        ids = {label: i for i, label in enumerate(labels)}
+        keys = [key_from_label(label) for label in labels]
+
+        node_rows = []
+        src = []
+        dst = []
+        edge_rows = []
+        for i, label in enumerate(labels):
+            cc, nc, tt, ct, callers = stats[label]
+            node_rows.append((nc, nc - cc, ct, tt))
+            for caller, call in callers.items():
+                if caller not in ids:
+                    ids[caller] = len(keys)
+                    keys.append(key_from_label(caller))
+                if isinstance(call, tuple):
+                    call_nc, call_cc, call_tt, call_ct = call
+                else:
+                    # Written by the pure Python profile module.
+                    call_nc, call_cc, call_tt, call_ct = call, call, 0, 0
+                src.append(ids[caller])
+                dst.append(i)
+                edge_rows.append((call_nc, call_nc - call_cc, call_ct,
+                                  call_tt))
+        return cls.from_edges(keys, range(len(labels)), node_rows, src, dst,
+                              edge_rows)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def index(self, key):
+        """Return the id of the function with cProfile key `key`."""
+        return self.ids[key]
+
+    def name(self, i):
+        """Return a display name for function i."""
+        key = self.keys[i]
+        return key if type(key) == str else key.co_name
+
+    def children(self, i):
+        """Return an array with the ids of the functions called by i."""
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def callers(self):
+        """Return an array with the caller of every edge."""
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def caller_index(self):
+        """
+        Return the edges in compressed sparse column form, as a tuple
+        (indptr, callers, edge_ids): the ids of the functions which call
+        function i are callers[indptr[i]:indptr[i + 1]], and the statistics
+        of those calls are at the positions in the arrays of `edges` given
+        by the same slice of edge_ids. The index is built once, in
+        O(E log E), and then kept.
+        """
+        if self._caller_index is None:
+            n = len(self)
+            # A stable sort, so that each function's callers are in order.
+            edge_ids = np.argsort(self.indices, kind='mergesort')
+            indptr = np.zeros(n + 1, dtype=np.intp)
+            np.cumsum(np.bincount(self.indices, minlength=n), out=indptr[1:])
+            self._caller_index = (indptr, self.callers()[edge_ids],
+                                  edge_ids.astype(np.intp))
+        return self._caller_index
+
+    def parents(self, i):
+        """
+        Return an array with the ids of the functions which call i, and an
+        array with the positions of those calls in the arrays of `edges`,
+        in O(number of callers) once the caller index is built.
+        """
+        indptr, callers, edge_ids = self.caller_index()
+        start, stop = indptr[i], indptr[i + 1]
+        return callers[start:stop], edge_ids[start:stop]
+
+    def reachable(self, roots):
+        """
+        Return a boolean mask of the functions which can be reached from
+        roots, in O(V + E). This is a breadth first search in which wide
+        levels are expanded using array operations, and narrow levels (e.g.
+        along deep call chains) with a plain worklist.
+        """
+        seen = np.zeros(len(self), dtype=bool)
+        frontier = np.unique(np.asarray(roots, dtype=np.intp))
+        indptr = indices = None
+        while len(frontier):
+            seen[frontier] = True
+            if len(frontier) < _NARROW_FRONTIER:
+                if indptr is None:
+                    indptr = self.indptr.tolist()
+                    indices = self.indices.tolist()
+                worklist = frontier.tolist()
+                while worklist and len(worklist) < _NARROW_FRONTIER:
+                    i = worklist.pop()
+                    for child in indices[indptr[i]:indptr[i + 1]]:
+                        if not seen[child]:
+                            seen[child] = True
+                            worklist.append(child)
+                frontier = np.array(worklist, dtype=np.intp)
+                # Children of the remaining worklist are yet to be seen.
+                seen[frontier] = False
+                continue
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            # Positions in indices of all children of the frontier.
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            children = self.indices[offsets + np.arange(counts.sum())]
+            frontier = np.unique(children[~seen[children]])
+        return seen
+
+    def flame(self, roots, max_frames=100000, min_width=1e-4,
+              max_depth=256):
+        """
+        Return the frames of a flame graph of the calls below roots, as a
+        dict of arrays: the function id, depth, start and width of each
+        frame, with starts and widths as fractions of the total time of
+        roots, and the index of the frame's parent frame (-1 for roots).
+        Frames are ordered by depth, and the children of each frame are
+        consecutive, widest first. A child never starts before its parent.
+
+        cProfile doesn't record whole call stacks, so the time of each path
+        is estimated (as gprof does) by assuming that a function divides its
+        time between its callees in the same way whichever path it was
+        called by. Direct recursion is skipped, and frames narrower than
+        min_width are dropped.
+        """
+        totaltime = self.nodes['totaltime']
+        edge_time = self.edges['totaltime']
+        ids = np.asarray(roots, dtype=np.intp)
+        widths = np.maximum(totaltime[ids], 0).astype(np.float64)
+        if widths.sum() > 0:
+            widths /= widths.sum()
+        else:
+            widths[:] = 1 / max(1, len(ids))
+        starts = np.cumsum(widths) - widths
+        parent_frames = np.full(len(ids), -1, dtype=np.intp)
+
+        levels = []
+        n_frames = 0
+        for depth in range(max_depth):
+            if not len(ids) or n_frames >= max_frames:
+                break
+            ids = ids[:max_frames - n_frames]
+            levels.append((ids, np.full(len(ids), depth), starts[:len(ids)],
+                           widths[:len(ids)], parent_frames[:len(ids)]))
+            level_start = n_frames
+            n_frames += len(ids)
+
+            # All calls made by the functions of this level.
+            edge_starts = self.indptr[ids]
+            counts = self.indptr[ids + 1] - edge_starts
+            parents = np.repeat(np.arange(len(ids)), counts)
+            offsets = (np.repeat(edge_starts - np.cumsum(counts) + counts,
+                                 counts) + np.arange(counts.sum()))
+            children = self.indices[offsets]
+            parent_time = totaltime[ids][parents]
+            fractions = np.where(parent_time > 0,
+                                 np.maximum(edge_time[offsets], 0) /
+                                 np.where(parent_time > 0, parent_time, 1), 0)
+            fractions[children == ids[parents]] = 0
+            # Callees can't take more than all of their caller's time.
+            totals = np.bincount(parents, fractions, minlength=len(ids))
+            fractions /= np.maximum(totals, 1)[parents]
+            child_widths = widths[parents] * fractions
+
+            keep = child_widths >= min_width
+            parents = parents[keep]
+            children = children[keep]
+            child_widths = child_widths[keep]
+            # Widest first within each caller, placed left to right from the
+            # caller's start.
+            order = np.lexsort((-child_widths, parents))
+            parents = parents[order]
+            ids = children[order]
+            widths = child_widths[order]
+            # Each child's offset from its caller's start is found first, so
+            # that rounding can't place it before its caller.
+            offsets = np.cumsum(widths) - widths
+            first = np.searchsorted(parents, parents)
+            starts = starts[parents] + np.maximum(offsets - offsets[first], 0)
+            parent_frames = level_start + parents
+
+        if not levels:
+            return dict(ids=np.zeros(0, dtype=np.intp),
+                        depths=np.zeros(0, dtype=np.intp),
+                        starts=np.zeros(0), widths=np.zeros(0),
+                        parents=np.zeros(0, dtype=np.intp))
+        return dict(zip(('ids', 'depths', 'starts', 'widths', 'parents'),
+                        (np.concatenate(columns) for
+                         columns in zip(*levels))))
+
+    def hot_paths(self, roots, k=5, min_width=1e-4, max_length=64,
+                  max_steps=20000):
+        """
+        Return the (at most) k call paths from roots in which the most time
+        is spent inline in the last function, heaviest first, as HotPaths.
+
+        The time of each path is estimated as in flame. The search is best
+        first: paths are extended heaviest first, and as the time of a path
+        bounds that of the paths extending it, each path which is completed
+        is heavier than any found later. Calls which only re-enter a
+        function which is already running (whose calls are all counted in
+        reccallcount, and whose time is included in the outer call) aren't
+        followed, nor are calls back to a function on the path. Paths
+        narrower than min_width are dropped, and the search stops after
+        max_steps paths have been extended.
+
+        The calls of each function are likewise shared between the paths
+        through it, so that the calls of a callee along a path are those
+        it gets from its caller, scaled by the share of the caller's calls
+        made along the path.
+        """
+        callcount = self.nodes['callcount']
+        totaltime = self.nodes['totaltime']
+        inlinetime = self.nodes['inlinetime']
+        edge_time = self.edges['totaltime']
+        edge_count = self.edges['callcount']
+        reentrant = ((self.edges['reccallcount'] >= self.edges['callcount']) &
+                     (self.edges['callcount'] > 0))
+        indptr = self.indptr
+        indices = self.indices
+
+        roots = np.asarray(roots, dtype=np.intp)
+        root_times = np.maximum(totaltime[roots], 0)
+        total = float(root_times.sum())
+        if total <= 0:
+            return []
+
+        # Paths are linked lists of (id, width, length, parent, count) cells.
+        # Heap entries are (-width, order, complete, cell), where complete
+        # paths are weighted by the inline time of their last function.
+        heap = []
+        order = 0
+        for i, time in zip(roots.tolist(), root_times.tolist()):
+            if time / total >= min_width:
+                heap.append((-time / total, order, False,
+                             (i, time / total, 1, None, float(callcount[i]))))
+                order += 1
+        heapq.heapify(heap)
+
+        paths = []
+        steps = 0
+        while heap and len(paths) < k and steps < max_steps:
+            weight, _, complete, cell = heapq.heappop(heap)
+            if complete:
+                ids = []
+                widths = []
+                counts = []
+                while cell is not None:
+                    ids.append(cell[0])
+                    widths.append(cell[1])
+                    counts.append(cell[4])
+                    cell = cell[3]
+                paths.append(HotPath(ids[::-1], widths[::-1], -weight,
+                                     counts[::-1]))
+                continue
+            steps += 1
+            i, width, length, _, count = cell
+            time = float(totaltime[i])
+            if time > 0:
+                inline = width * min(max(inlinetime[i] / time, 0.), 1.)
+            else:
+                inline = width
+            inline = float(inline)
+            if inline >= min_width:
+                heapq.heappush(heap, (-inline, order, True, cell))
+                order += 1
+            if length >= max_length or time <= 0:
+                continue
+
+            on_path = set()
+            parent = cell
+            while parent is not None:
+                on_path.add(parent[0])
+                parent = parent[3]
+            calls = np.arange(indptr[i], indptr[i + 1])
+            calls = calls[~reentrant[calls]]
+            fractions = np.maximum(edge_time[calls], 0) / time
+            # Callees can't take more than all of their caller's time.
+            fractions /= max(1., fractions.sum())
+            share = count / callcount[i] if callcount[i] > 0 else 1.
+            for j, fraction, calls_made in zip(
+                    indices[calls].tolist(), fractions.tolist(),
+                    edge_count[calls].tolist()):
+                if j in on_path or width * fraction < min_width:
+                    continue
+                heapq.heappush(heap, (-width * fraction, order, False,
+                                      (j, width * fraction, length + 1,
+                                       cell, float(calls_made * share))))
+                order += 1
+        return paths
+
+    def roots(self):
+        """
+        Return the ids of the functions which have no callers, or if there
+        are none (e.g. if all functions are in a cycle), that with the
+        largest total time.
+        """
+        has_caller = np.zeros(len(self), dtype=bool)
+        has_caller[self.indices] = True
+        roots = np.flatnonzero(~has_caller)
+        if not len(roots) and len(self):
+            roots = np.array([np.argmax(self.nodes['totaltime'])])
+        return roots
+
+    def merge(self, ids, key):
+        """
+        Return a new CallGraph in which the functions in ids are replaced by
+        a single function with cProfile key `key`. Calls between the merged
+        functions are dropped.
+        """
+        ids = np.asarray(ids, dtype=np.intp)
+        merged = np.zeros(len(self), dtype=bool)
+        merged[ids] = True
+        kept = np.flatnonzero(~merged)
+
+        new_id = np.empty(len(self), dtype=np.intp)
+        new_id[kept] = np.arange(len(kept))
+        new_id[merged] = len(kept)
+        keys = [self.keys[i] for i in kept] + [key]
+
+        src = self.callers()
+        keep = ~(merged[src] & merged[self.indices])
+        edges = {column: values[keep] for column, values in self.edges.items()}
+        return CallGraph.from_arrays(keys, new_id, self.nodes,
+                                     new_id[src[keep]],
+                                     new_id[self.indices[keep]], edges)
+
+    def subgraph(self, ids):
+        """
+        Return a new CallGraph containing only the functions in ids, and the
+        edges between them. Functions are renumbered in the order given.
+        """
+        ids = np.asarray(ids, dtype=np.intp)
+        new_id = np.full(len(self), -1, dtype=np.intp)
+        new_id[ids] = np.arange(len(ids))
+
+        src = self.callers()
+        keep = (new_id[src] >= 0) & (new_id[self.indices] >= 0)
+        nodes = {column: values[ids] for column, values in self.nodes.items()}
+        edges = {column: values[keep] for column, values in self.edges.items()}
+        return CallGraph.from_arrays([self.keys[i] for i in ids],
+                                     np.arange(len(ids)), nodes,
+                                     new_id[src[keep]],
+                                     new_id[self.indices[keep]], edges)
+
+
+class MergedCode(namedtuple('MergedCode', ['co_filename', 'co_firstlineno',
+                                           'co_name', 'codes'])):
+    """
+    Stand-in for a code object, used as the key of a function which was
+    created by merging the code objects in `codes`.
+    """
+    __slots__ = ()
+
+
+class CodeKey(namedtuple('CodeKey', ['co_filename', 'co_firstlineno',
+                                     'co_name'])):
+    """
+    Stand-in for a code object which isn't available, for example in a
+    profile loaded from a file.
+    """
+    __slots__ = ()
+
+
+def label(key):
+    """
+    Return the (filename, firstlineno, name) label of a function key, as
+    used by pstats and the line profiler.
+    """
+    if type(key) == str:
+        return ('~', 0, key)
+    return (key.co_filename, key.co_firstlineno, key.co_name)
+
+
+def key_from_label(label):
+    """Inverse of label, returning a CodeKey or a built-in's name."""
+    filename, firstlineno, name = label
+    if filename == '~' and firstlineno == 0:
+        return name
+    return CodeKey(filename, firstlineno, name)
+
+
+def _is_module(key):
+    return type(key) != str and key.co_name == "<module>"
+
+
+def prune_top_level(graph, context=None):
+    """
+    Return the part of graph which is below the user's code, deleting the top
+    level calls made by IPython itself.
+
+    For CELL_MAGIC the code objects of the cell, which IPython compiles line
+    by line, are merged into a single root function.
+    """
+    if context == "LINE_MAGIC":
+        # The roots are the functions called by the <module> code objects,
+        # other than nested <module>s.
+        is_module = np.array([_is_module(key) for key in graph.keys],
+                             dtype=bool)
+        callers = graph.callers()
+        roots = graph.indices[is_module[callers] & ~is_module[graph.indices]]
+    elif context == "CELL_MAGIC":
+        cell = [i for i, key in enumerate(graph.keys) if
+                _is_module(key) and "<ipython-input" in key.co_filename]
+        if not cell:
+            return graph.subgraph([])
+        codes = tuple(graph.keys[i] for i in cell)
+        cell_key = MergedCode(codes[0].co_filename,
+                              min(code.co_firstlineno for code in codes),
+                              "<cell>", codes)
+        graph = graph.merge(cell, cell_key)
+        roots = [graph.index(cell_key)]
+    else:
+        return graph
+
+    return graph.subgraph(np.flatnonzero(graph.reachable(roots)))
+
+
+def diff(a, b):
+    """
+    Return the difference between two call graphs, joined by function (see
+    join_label), as a tuple (graph, a_ids, b_ids). The statistics of graph
+    are those of b minus those of a, with the original per-function
+    statistics kept in the node columns 'before_<column>' and
+    'after_<column>'. a_ids and b_ids give the id in graph of each function
+    in a and b.
+    """
+    keys, (a_ids, b_ids) = _join([a, b])
+
+    nodes = {}
+    edges = {}
+    for column in STAT_COLUMNS:
+        before, after = a.nodes[column], b.nodes[column]
+        nodes[column] = np.concatenate([-before, after])
+        nodes['before_' + column] = np.concatenate(
+            [before, np.zeros_like(after)])
+        nodes['after_' + column] = np.concatenate(
+            [np.zeros_like(before), after])
+        edges[column] = np.concatenate([-a.edges[column], b.edges[column]])
+    graph = CallGraph.from_arrays(keys, np.concatenate([a_ids, b_ids]), nodes,
+                                  np.concatenate([a_ids[a.callers()],
+                                                  b_ids[b.callers()]]),
+                                  np.concatenate([a_ids[a.indices],
+                                                  b_ids[b.indices]]),
+                                  edges)
+    return graph, a_ids, b_ids
+
+
+def combine(graphs):
+    """
+    Return the union of a list of call graphs, joined by function (see
+    join_label), with the statistics of functions and calls which appear in
+    more than one graph summed.
+    """
+    keys, ids = _join(graphs)
+    nodes = {column: np.concatenate([graph.nodes[column] for
+                                     graph in graphs])
+             for column in STAT_COLUMNS}
+    edges = {column: np.concatenate([graph.edges[column] for
+                                     graph in graphs])
+             for column in STAT_COLUMNS}
+    src = [graph_ids[graph.callers()] for graph, graph_ids in zip(graphs, ids)]
+    dst = [graph_ids[graph.indices] for graph, graph_ids in zip(graphs, ids)]
+    return CallGraph.from_arrays(keys, np.concatenate(ids), nodes,
+                                 np.concatenate(src), np.concatenate(dst),
+                                 edges)
+
+
+def add_root(graph, root_key, exclude=()):
+    """
+    Return graph with a new function with key root_key, which calls each of
+    the functions that have no callers. The functions with keys in exclude
+    are removed first. The times of the root are the totals of its callees.
+    """
+    kept = np.array([key not in exclude for key in graph.keys], dtype=bool)
+    if not kept.all():
+        graph = graph.subgraph(np.flatnonzero(kept))
+    n = len(graph)
+    roots = np.flatnonzero(np.bincount(graph.indices, minlength=n) == 0)
+
+    nodes = {}
+    edges = {}
+    for column in STAT_COLUMNS:
+        root_values = graph.nodes[column][roots]
+        total = 0 if column == 'inlinetime' else root_values.sum()
+        nodes[column] = np.append(graph.nodes[column], total)
+        edges[column] = np.concatenate([graph.edges[column], root_values])
+    return CallGraph.from_arrays(graph.keys + [root_key], np.arange(n + 1),
+                                 nodes,
+                                 np.concatenate([graph.callers(),
+                                                 np.full(len(roots), n)]),
+                                 np.concatenate([graph.indices, roots]),
+                                 edges)
+
+
+def _join(graphs):
+    """
+    Return the keys of the union of graphs, and for each graph an array of
+    the ids of its functions in the union. Functions which are in more than
+    one graph take their key from the first.
+    """
+    keys = [key for graph in graphs for key in graph.keys]
+    labels = np.array([join_label(key) for key in keys])
+    _, first, inverse = np.unique(labels, return_index=True,
+                                  return_inverse=True)
+    bounds = np.cumsum([0] + [len(graph) for graph in graphs])
+    inverse = inverse.ravel().astype(np.intp)
+    return ([keys[i] for i in first],
+            [inverse[start:stop] for start, stop in zip(bounds[:-1],
+                                                          bounds[1:])])
+
+
+def join_label(key):
+    """
+    Return the string by which key is matched between profiles: its label,
+    without the execution count in the filename of an IPython cell (so that
+    a function is matched when its cell is run again), and with all cells
+    merged as one.
+    """
+    if type(key) != str and key.co_name == "<cell>":
+        return u"<cell>"
+    filename, firstlineno, name = label(key)
+    filename = _IPYTHON_INPUT.sub(u"<ipython-input-", filename)
+    return u"\0".join(str(part) for part in (filename, firstlineno, name))
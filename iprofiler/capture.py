@@ -0,0 +1,63 @@
+"""
+Running code under the profilers, as done by both the %iprofile magic and
+the command line interface.
+"""
+from __future__ import absolute_import
+
+import numpy as np
+
+from .callgraph import CallGraph
+from .sampler import Sampler
+from . import timers
+
+
+def profile_traced(run, lprofiler=None, timer=None, calibrate=False):
+    """
+    Run run() with cProfile and, optionally, the line profiler lprofiler.
+    Return the call graph and the line timings (or None).
+
+    cProfile uses the timer called `timer` (see timers.TIMERS), or its
+    default timer if timer is None. lprofiler should use the same timer. If
+    calibrate is True then the overhead of profiling, measured once for the
+    timer, is subtracted from the inline times and line timings.
+    """
+    cprofiler = timers.cprofile(timer)
+    if lprofiler is not None:
+        lprofiler.enable()
+    cprofiler.enable()
+    try:
+        run()
+    finally:
+        cprofiler.disable()
+        if lprofiler is not None:
+            lprofiler.disable()
+    graph = CallGraph.from_cprofile(cprofiler.getstats())
+    lprofile = None if lprofiler is None else lprofiler.get_stats()
+    if calibrate:
+        timers.subtract_overhead(timers.calibrate(timer), graph, lprofile)
+    return graph, lprofile
+
+
+def profile_sampled(run, interval=0.005):
+    """
+    Run run() with the statistical profiler, sampling every `interval`
+    seconds. Return the call graph and the line timings.
+    """
+    sampler = Sampler(interval)
+    sampler.enable()
+    try:
+        run()
+    finally:
+        sampler.disable()
+    return CallGraph.from_cprofile(sampler.getstats()), sampler.get_stats()
+
+
+def graph_below(graph, code):
+    """
+    Return the part of graph below the function with code object `code`,
+    dropping the calls made around it, such as the call which disabled the
+    profiler. If code isn't in graph then graph is returned.
+    """
+    if code not in graph:
+        return graph
+    return graph.subgraph(np.flatnonzero(graph.reachable([graph.index(code)])))
@@ -0,0 +1,308 @@
+"""
+Export of profiles to the formats of other tools: speedscope
+(https://www.speedscope.app) and the Chrome trace event format (opened by
+chrome://tracing and Perfetto).
+
+cProfile only records the calls between pairs of functions, so the call
+tree is laid out as in the flame graph (see CallGraph.flame), with the
+calls below each function one after another, and exported as a timeline.
+Line timings are exported alongside it. The call tree is walked depth first
+and each event is written as it is reached, so neither the document nor the
+tree is held in memory: only the calls which are open, besides a copy of the
+calls of the call graph sorted by time.
+"""
+from __future__ import absolute_import, division
+
+import io
+import json
+
+import numpy as np
+
+from ._version import __version__
+
+FORMATS = ('speedscope', 'chrome')
+
+# The endings of the names of files in each format.
+_EXTENSIONS = (('.speedscope.json', 'speedscope'),
+               ('.trace.json', 'chrome'))
+
+
+def format_for_path(path):
+    """
+    Return the format of a file from its name, which should end with
+    .speedscope.json or .trace.json, or else None.
+    """
+    for extension, format in _EXTENSIONS:
+        if path.endswith(extension):
+            return format
+    return None
+
+
+def write_profile(path, graph, get_ltimings=None, unit=1e-6, format=None,
+                  name="Profile", max_frames=1000000, min_width=1e-6,
+                  max_depth=256):
+    """
+    Export a CallGraph to path, in the given format (see FORMATS), by
+    default the one given by the name of the file (see format_for_path).
+    get_ltimings is a function returning the line timings of a function
+    key (or None), in timer units of `unit` seconds, as IProfile.get_ltimings
+    does. Calls narrower than the fraction min_width of the total time, or
+    deeper than max_depth, are left out, as are all calls beyond the first
+    max_frames.
+    """
+    if format is None:
+        format = format_for_path(path)
+        if format is None:
+            raise ValueError("Can't tell the format of {!r} from its name, "
+                             "which should end with .speedscope.json or "
+                             ".trace.json.".format(path))
+    if format not in FORMATS:
+        raise ValueError("Unknown format {!r}, expected one of {}.".format(
+            format, ", ".join(FORMATS)))
+    total = (float(np.maximum(graph.nodes['totaltime'][graph.roots()],
+                              0).sum()) if len(graph) else 0.)
+
+    def calls():
+        return _calls(graph, total, max_frames, min_width, max_depth)
+
+    lines = _line_rows(graph, get_ltimings, unit)
+    with io.open(path, 'w', encoding='utf-8') as f:
+        if format == 'speedscope':
+            _write_speedscope(f, graph, calls, total, lines, name)
+        else:
+            _write_chrome(f, graph, calls, total, lines, name)
+
+
+def _line_rows(graph, get_ltimings, unit):
+    """
+    Return a generator function yielding, for each function of graph with
+    line timings, its id and a list of its (lineno, nhits, time in seconds)
+    rows. Timings are looked up again by each pass over them.
+    """
+    def rows():
+        if get_ltimings is None:
+            return
+        for i, key in enumerate(graph.keys):
+            if type(key) == str:
+                continue
+            ltimings = get_ltimings(key)
+            if ltimings:
+                yield i, [(lineno, nhits, time * unit) for
+                          lineno, nhits, time in ltimings[:-1]]
+    return rows
+
+
+def _sorted_calls(graph):
+    """
+    Return the callee of every call in graph, and the fraction of its
+    caller's time spent in it, with the calls of each function (which keep
+    their positions in the CSR layout) sorted by fraction, largest first.
+    Fractions are found as in CallGraph.flame: direct recursion is skipped,
+    and the calls of a function can't take more than all of its time.
+    """
+    callers = graph.callers()
+    caller_time = graph.nodes['totaltime'][callers]
+    fractions = np.where(caller_time > 0,
+                         np.maximum(graph.edges['totaltime'], 0) /
+                         np.where(caller_time > 0, caller_time, 1), 0)
+    fractions[graph.indices == callers] = 0
+    totals = np.bincount(callers, fractions, minlength=len(graph))
+    fractions /= np.maximum(totals, 1)[callers]
+    order = np.lexsort((-fractions, callers))
+    return graph.indices[order], fractions[order]
+
+
+def _calls(graph, total, max_frames, min_width, max_depth):
+    """
+    Yield ('O', id, time) and ('C', id, time) events opening and closing
+    each call of the call tree of graph, laid out as in CallGraph.flame,
+    with times in seconds, walking the tree depth first. Each call starts
+    where the previous call of its caller ended, and ends no later than its
+    caller, so calls are properly nested and times never decrease.
+    """
+    if total <= 0:
+        return
+    callees, fractions = _sorted_calls(graph)
+    indptr = graph.indptr
+    min_time = min_width * total
+
+    def open_call(i, start, end):
+        """
+        Return the state of an open call: its id, end, callees and the
+        fractions of its time spent in them, the index of the next callee,
+        the end of the previous callee and its width.
+        """
+        first, last = indptr[i], indptr[i + 1]
+        return [i, end, callees[first:last].tolist(),
+                fractions[first:last].tolist(), 0, start, end - start]
+
+    n_frames = 0
+    root_start = 0.
+    roots = graph.roots()
+    root_times = np.maximum(graph.nodes['totaltime'][roots], 0)
+    for root, root_time in zip(roots.tolist(), root_times.tolist()):
+        if root_time < min_time or root_time <= 0 or n_frames >= max_frames:
+            continue
+        start = root_start
+        root_start = start + root_time
+        yield 'O', root, start
+        n_frames += 1
+        stack = [open_call(root, start, root_start)]
+        while stack:
+            top = stack[-1]
+            i, end, children, child_fractions, k, start, width = top
+            if (k < len(children) and n_frames < max_frames and
+                    len(stack) < max_depth):
+                child_width = width * child_fractions[k]
+                # Callees are widest first, so the rest are narrower.
+                if child_width >= min_time and child_width > 0:
+                    child_end = min(start + child_width, end)
+                    top[4] = k + 1
+                    top[5] = child_end
+                    yield 'O', children[k], start
+                    n_frames += 1
+                    stack.append(open_call(children[k], start, child_end))
+                    continue
+            stack.pop()
+            yield 'C', i, end
+
+
+def _frame(graph, i):
+    key = graph.keys[i]
+    if type(key) == str:
+        return {'name': key}
+    return {'name': key.co_name, 'file': key.co_filename,
+            'line': key.co_firstlineno}
+
+
+class _ArrayWriter(object):
+    """
+    Writes the items of a JSON array one at a time, either as objects
+    (with write) or as JSON text (with write_json).
+    """
+    def __init__(self, f):
+        self.f = f
+        self.first = True
+
+    def write(self, item):
+        self.write_json(_dumps(item))
+
+    def write_json(self, text):
+        if not self.first:
+            self.f.write(u',\n')
+        self.first = False
+        self.f.write(text)
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _write_speedscope(f, graph, calls, total, lines, name):
+    """
+    Write the calls as an evented profile, and the line timings as a
+    sampled profile with a sample per line, weighted by its time and
+    stacked on its function. Function i is frame i, and lines are the
+    frames after the functions, in the order of the samples. The samples,
+    their weights and the frames of the lines are each written by a pass
+    over the line timings.
+    """
+    f.write(u'{"$schema":"https://www.speedscope.app/file-format-schema.json",'
+            u'"exporter":' + _dumps("iprofiler " + __version__) +
+            u',"name":' + _dumps(name) + u',"activeProfileIndex":0,'
+            u'"profiles":[')
+    f.write(u'{"type":"evented","name":' + _dumps(name) +
+            u',"unit":"seconds","startValue":0,"endValue":' +
+            _dumps(total) + u',"events":[\n')
+    events = _ArrayWriter(f)
+    # There are many more events than frames, so they are formatted
+    # directly. The repr of a (finite) float is valid JSON.
+    for event, i, time in calls():
+        events.write_json(u'{"type":"%s","frame":%d,"at":%r}' %
+                          (event, i, time))
+    f.write(u']}')
+
+    n_lines = 0
+    for i, rows in lines():
+        if not n_lines:
+            f.write(u',{"type":"sampled","name":' +
+                    _dumps(name + " (line timings)") +
+                    u',"unit":"seconds","startValue":0,"samples":[\n')
+            samples = _ArrayWriter(f)
+        for _ in rows:
+            samples.write_json(u'[%d,%d]' % (i, len(graph) + n_lines))
+            n_lines += 1
+    if n_lines:
+        f.write(u'],"weights":[\n')
+        weights = _ArrayWriter(f)
+        line_total = 0.
+        for _, rows in lines():
+            for _, _, time in rows:
+                weights.write_json(u'%r' % time)
+                line_total += time
+        f.write(u'],"endValue":' + _dumps(line_total) + u'}')
+
+    f.write(u'],"shared":{"frames":[\n')
+    shared = _ArrayWriter(f)
+    for i in range(len(graph)):
+        shared.write(_frame(graph, i))
+    for i, rows in lines():
+        function = _frame(graph, i)
+        for lineno, _, _ in rows:
+            shared.write({'name': u"{} line {}".format(function['name'],
+                                                       lineno),
+                          'file': function.get('file'), 'line': lineno})
+    f.write(u']}}\n')
+
+
+def _write_chrome(f, graph, calls, total, lines, name):
+    """
+    Write the calls as pairs of begin and end events on a "Calls" thread,
+    which are nested by their order (rather than by the end times of
+    complete events, which rounding could move past their caller's), and
+    the line timings of each function, one function after another, on a
+    "Lines" thread. Times are in microseconds.
+    """
+    f.write(u'{"displayTimeUnit":"ms","otherData":{"exporter":' +
+            _dumps("iprofiler " + __version__) + u',"name":' + _dumps(name) +
+            u'},"traceEvents":[\n')
+    events = _ArrayWriter(f)
+    for tid, thread_name in ((0, "Calls"), (1, "Lines")):
+        events.write({'name': 'thread_name', 'ph': 'M', 'pid': 0,
+                      'tid': tid, 'args': {'name': thread_name}})
+
+    # The name and arguments of the begin events of each function, as
+    # JSON.
+    callcount = graph.nodes['callcount']
+    fields = {}
+    for event, i, time in calls():
+        if event == 'C':
+            events.write_json(u'{"ph":"E","ts":%r,"pid":0,"tid":0}' %
+                              (time * 1e6))
+            continue
+        if i not in fields:
+            frame = _frame(graph, i)
+            args = {'calls': int(callcount[i])}
+            if 'file' in frame:
+                args.update(file=frame['file'], line=frame['line'])
+            fields[i] = (u'"name":' + _dumps(frame['name']) +
+                         u',"cat":"function","args":' + _dumps(args))
+        events.write_json(u'{%s,"ph":"B","ts":%r,"pid":0,"tid":0}' %
+                          (fields[i], time * 1e6))
+
+    time = 0.
+    for i, rows in lines():
+        frame = _frame(graph, i)
+        start = time
+        for lineno, nhits, line_time in rows:
+            events.write({'name': u"line {}".format(lineno), 'cat': 'line',
+                          'ph': 'X', 'ts': time * 1e6,
+                          'dur': line_time * 1e6, 'pid': 0, 'tid': 1,
+                          'args': {'hits': int(nhits)}})
+            time += line_time
+        events.write({'name': frame['name'], 'cat': 'function', 'ph': 'X',
+                      'ts': start * 1e6, 'dur': (time - start) * 1e6,
+                      'pid': 0, 'tid': 1,
+                      'args': {'file': frame.get('file'),
+                               'line': frame.get('line')}})
+    f.write(u']}\n')
@@ -0,0 +1,119 @@
+"""
+HTML rendering of line by line timings, next to the highlighted source.
+"""
+from __future__ import absolute_import
+
+from pygments.formatters import HtmlFormatter
+
+from .source import source_cache, source_from_cache
+
+
+def format_lprofile(firstlineno, ltimings, extra_columns=(), **kwargs):
+    """
+    Return the HTML of the source of the function starting at firstlineno,
+    with the line timings ltimings (in the form returned by the line
+    profiler, with the source filename at the end) and extra columns, see
+    LProfileFormatter, which is passed the other keyword arguments. The
+    source is shown up to the last line with a timing or an extra cell.
+    """
+    # Currently the correct filename is stored at the end of ltimings.
+    # This is a work-around to fix cProfiler giving useless filenames for
+    # zipped packages.
+    filename = ltimings[-1]
+
+    if filename.endswith(('.pyc', '.pyo')):
+        filename = source_from_cache(filename)
+
+    lastlineno = max([lineno for lineno, _, _ in ltimings[:-1]] +
+                     [lineno for _, cells in extra_columns for
+                      lineno in cells])
+    lines = source_cache.highlighted_lines(filename, firstlineno, lastlineno)
+
+    formatter = LProfileFormatter(firstlineno, ltimings, extra_columns,
+                                  noclasses=True, **kwargs)
+    return formatter.format_lines(lines)
+
+
+class LProfileFormatter(HtmlFormatter):
+
+    def __init__(self, firstlineno, ltimings, extra_columns=(), times=None,
+                 time_title="Time (s)", unit=1e-6, highlight_line=None,
+                 *args, **kwargs):
+        self.lineno = firstlineno
+        self.ltimings = ltimings
+        # Number of a line to highlight, which the front end scrolls to.
+        self.highlight_line = highlight_line
+        # The text of the time of each line in ltimings. By default the
+        # times, in timer units of `unit` seconds, are shown in seconds.
+        if times is None:
+            times = ['{:.6f}'.format(time * unit) for
+                     _, _, time in ltimings[:-1]]
+        self.times = times
+        self.time_title = time_title
+        self.time_width = max([len(time_title)] + [len(text) for
+                                                   text in times])
+        # Columns shown between the line numbers and the code, given as
+        # (title, cells) pairs, where cells maps line numbers to (text,
+        # colour) pairs. The colour may be None.
+        self.extra_columns = [
+            (title, cells,
+             max([len(title)] + [len(text) for text, _ in cells.values()]))
+            for title, cells in extra_columns]
+        super(LProfileFormatter, self).__init__(*args, **kwargs)
+
+    def wrap(self, source, outfile):
+        return super(LProfileFormatter,
+                     self).wrap(self._wrap_code(source), outfile)
+
+    def format_lines(self, lines):
+        """
+        Return the HTML for source code which has already been highlighted,
+        given as a list with the HTML of each line.
+        """
+        source = self._wrap_code((1, line) for line in lines)
+        source = self._wrap_div(self._wrap_pre(source))
+        return "".join(piece for _, piece in source)
+
+    def _wrap_code(self, source):
+        width = self.time_width
+        no_time_template = ' ' * width + ' {:7} {:>4} {}'
+        template = ('<span style=\'color: Red\'>{:>' + str(width) +
+                    '}</span> {:>7} {:>4} {}')
+        head = (' ' * (width - len(self.time_title)) +
+                '<span style=\'color: Red; font-weight: bold\'>' +
+                self.time_title + '</span>   Calls      ')
+        head += ''.join(
+            ' ' * (column_width - len(title)) + '<strong>' + title +
+            '</strong> ' for title, _, column_width in self.extra_columns)
+        yield 0, head + '<strong>Code</strong>\n'
+        # j keeps track of position within ltimings
+        j = 0
+        n_lines = len(self.ltimings) - 1
+        for i, line in source:
+            lineno = self.lineno
+            if self.extra_columns:
+                line = self._extra_cells(lineno) + line
+            if j < n_lines and lineno == self.ltimings[j][0]:
+                lcalls = self.ltimings[j][1]
+                row = template.format(self.times[j], lcalls, lineno, line)
+                j += 1
+            else:
+                row = no_time_template.format('', lineno, line)
+            if lineno == self.highlight_line:
+                row = ('<span id="lprofile-highlight" '
+                       'style="background-color: #ffff99">' + row + '</span>')
+            yield i, row
+            self.lineno += 1
+
+    def _extra_cells(self, lineno):
+        cells = []
+        for _, column, width in self.extra_columns:
+            text, colour = column.get(lineno, ('', None))
+            cell = ' ' * (width - len(text))
+            if colour is None:
+                cell += text
+            else:
+                cell += "<span style='color: {}'>{}</span>".format(colour,
+                                                                  text)
+            cells.append(cell + ' ')
+        return ''.join(cells)
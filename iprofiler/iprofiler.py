@@ -1,18 +1,13 @@
 from __future__ import absolute_import
 
-from IPython.utils import openpy
-from IPython.utils import ulinecache
-from IPython.core.magic import (Magics, magics_class, line_cell_magic)
-
 from ipywidgets import DOMWidget
-from traitlets import Unicode, Int, Bool
-
-from pygments import highlight
-from pygments.lexers import PythonLexer
-from pygments.formatters import HtmlFormatter
+from traitlets import Unicode, Int, Bool, List
 
-import zipfile
 import sys
+import threading
+from collections import namedtuple
+
+import numpy as np
 
 from bokeh.embed import notebook_div
 import bokeh.models.widgets.tables as bokeh_tables
@@ -22,6 +17,73 @@ import bokeh.util as bokeh_util
 from bokeh.io import hplot, output_notebook
 from bokeh.io import push_notebook
 
+from .aggregate import ProfileAggregator
+from .cache import LRUCache
+from .formatter import LProfileFormatter, format_lprofile
+# The magics are in their own module, so that loading the extension doesn't
+# import the widgets, but can still be imported from here.
+from .magics import IProfilerMagics, load_ipython_extension
+from . import callgraph
+from . import capture
+from . import export
+from .callgraph import (CallGraph, MergedCode, prune_top_level, label,
+                        join_label)
+from . import store
+from . import timers
+
+
+# A rendered profile page. The table is generated separately, one page of
+# rows at a time.
+Page = namedtuple('Page', ['heading', 'callers', 'lprofile'])
+
+# Columns by which the table can be sorted, and their titles. Numeric
+# columns are sorted in descending order and names in ascending order.
+TABLE_SORT_OPTIONS = (('totaltime', "Total time"),
+                      ('inlinetime', "Inline time"),
+                      ('callcount', "Calls"),
+                      ('name', "Name"))
+MEMORY_SORT_OPTIONS = (('mem_peak', "Peak memory held"),
+                       ('mem_size', "Retained memory"))
+
+# Table columns which are sent to the front end as binary buffers, and their
+# (little endian) dtypes. Names are looked up from the ids in the front end.
+TABLE_BINARY_COLUMNS = (('ids', '<i4'),
+                        ('times', '<f8'),
+                        ('inlinetimes', '<f8'),
+                        ('plot_inline_times', '<f4'),
+                        ('plot_extra_times', '<f4'))
+
+# Units in which times can be displayed, as (unit, symbol, length in
+# seconds, decimal places) tuples.
+TIME_UNITS = (('s', "s", 1., 6),
+              ('ms', "ms", 1e-3, 3),
+              ('us', u"\u00b5s", 1e-6, 1),
+              ('ns', "ns", 1e-9, 0))
+_TIME_UNITS = {unit[0]: unit for unit in TIME_UNITS}
+
+# Ways in which times can be displayed: as times, as times per call, or as
+# percentages of the total time or of the time of the displayed function.
+TIME_MODES = ('time', 'per_call', 'percent_total', 'percent_parent')
+
+# Table columns of the memory allocated by each function, shown if the
+# statement was profiled with --memory, as (column, dtype, node column,
+# title, scale) tuples. Memory sizes are shown in KiB. Peaks are of the
+# memory held when snapshots were taken (see MemoryProfiler), and blocks are
+# those retained at the end, not all the allocations made.
+MEMORY_TABLE_COLUMNS = (('mem_peaks', '<f8', 'mem_peak', "Peak held (KiB)",
+                         1 / 1024.),
+                        ('mem_sizes', '<f8', 'mem_size', "Retained (KiB)",
+                         1 / 1024.),
+                        ('mem_counts', '<i4', 'mem_count', "Blocks retained",
+                         1))
+
+# Columns of the flame graph frames, sent as binary buffers. Frames are drawn
+# on a canvas in the front end, which looks up their names from the ids.
+FLAME_BINARY_COLUMNS = (('ids', '<i4'),
+                        ('depths', '<i4'),
+                        ('starts', '<f8'),
+                        ('widths', '<f8'))
+
 
 class IProfile(DOMWidget):
     # TRAITS - Data which is synchronised with the front-end
@@ -35,115 +97,298 @@ class IProfile(DOMWidget):
     nav_home_active = Bool(False).tag(sync=True)
     nav_back_active = Bool(False).tag(sync=True)
     nav_forward_active = Bool(False).tag(sync=True)
-    # Raw HTML for the heading, Bokeh table and line-by-line profile
+    # Raw HTML for the heading, Bokeh table, table of callers and
+    # line-by-line profile
     value_heading = Unicode().tag(sync=True)
     bokeh_table_div = Unicode().tag(sync=True)
+    value_callers = Unicode().tag(sync=True)
     value_lprofile = Unicode().tag(sync=True)
-    # Number of elements in table (used by front end to generate click events)
+    # Number of functions in the table (after filtering), and the sorting,
+    # filtering and pagination of the table. Only the current page of rows
+    # is sent to the front end.
     n_table_elements = Int(0).tag(sync=True)
+    table_sort = Unicode('totaltime').tag(sync=True)
+    table_filter = Unicode('').tag(sync=True)
+    table_page = Int(0).tag(sync=True)
+    table_n_pages = Int(1).tag(sync=True)
+
+    table_page_size = 20
+    # The (column, title) pairs by which the table can be sorted.
+    table_sort_options = List().tag(sync=True)
+    # Name of every function, indexed by id. This is synced once, and table
+    # pages are then sent as binary id and time columns (see send_table).
+    function_names = List().tag(sync=True)
+    # Id of the Bokeh ColumnDataSource which the front end updates.
+    table_source_id = Unicode().tag(sync=True)
+    # Names of the profiled threads, if there are several, and the index of
+    # the thread which is displayed (-1 for all threads combined).
+    thread_names = List().tag(sync=True)
+    thread = Int(-1).tag(sync=True)
+    # How times are displayed, see TIME_UNITS and TIME_MODES.
+    time_unit = Unicode('s').tag(sync=True)
+    time_mode = Unicode('time').tag(sync=True)
+
+    # Table columns which are sent as binary buffers (see send_table).
+    table_binary_columns = TABLE_BINARY_COLUMNS
+    # Node column of the number of calls behind each time, for times per
+    # call.
+    count_column = 'callcount'
+    # Whether to show a flame graph of the calls below the displayed
+    # function.
+    show_flame = True
+    # Whether to list the hot paths (see CallGraph.hot_paths) on the summary
+    # page, and how many.
+    show_hot_paths = True
+    hot_path_count = 5
+    # Titles of the time columns of the table (to which the unit is added,
+    # see time_title), and the template of the time plot column, which is
+    # drawn from the plot_* columns.
+    table_time_titles = ("Total time", "Inline time")
+    time_plot_template = ('<svg width="100" height="10">'
+                          '<rect width="<%= plot_inline_times%>"'
+                          'height="10" style="fill:rgb(255, 0, 0);"/>'
+                          '<rect x="<%= plot_inline_times%>"'
+                          'width="<%= plot_extra_times %>"'
+                          'height="10" style="fill:rgb(255, 160, 160);"/>'
+                          '</svg>')
+
+    def __init__(self, cprofile, lprofile=None, context=None, cache_size=64,
+                 prefetch=0, threads=None, memory=None, *args, **kwargs):
+        # Rendered pages, keyed by function. If prefetch > 0 then the pages
+        # of the top `prefetch` callees of the displayed function are also
+        # rendered, ready for the user to click on them.
+        self.page_cache = LRUCache(cache_size)
+        self.prefetch = prefetch
+        # Sorted and filtered rows of the table, keyed by (function, sort,
+        # filter).
+        self.table_cache = LRUCache(cache_size)
+        # Time columns of every function in each display setting, and the
+        # total time, see table_times.
+        self.time_columns_cache = {}
 
-    def __init__(self, cprofile, lprofile=None, context=None, *args, **kwargs):
         self.generate_cprofile_tree(cprofile, context)
         self.lprofile = lprofile
+        # ThreadProfiles of the threads which can be selected, in which case
+        # cprofile is their combined call graph.
+        self.threads = threads or []
+        self.combined_tree = self.cprofile_tree
+        self.thread_names = [thread.name for thread in self.threads]
+        # A MemoryProfiler whose allocations were added to the call graph
+        # (see MemoryProfiler.add_columns), or None.
+        self.memory = memory
+        sort_options = TABLE_SORT_OPTIONS
+        if memory is not None:
+            self.table_binary_columns = (self.table_binary_columns +
+                                         tuple(column[:2] for column in
+                                               MEMORY_TABLE_COLUMNS))
+            sort_options += MEMORY_SORT_OPTIONS
+        self.table_sort_options = [list(option) for option in sort_options]
 
         # Two lists used for the back and forward buttons. Backward includes
         # the currently displayed function.
         self.backward = [None]
         self.forward = []
+        # Set once the front end can receive messages.
+        self.front_end_ready = False
+        # Held while handling messages and while updating the profile, which
+        # may be done from another thread (see update_profile).
+        self.lock = threading.RLock()
 
-        # Dictionary mapping html id's to function names
-        self.id_dict = {}
+        _load_bokeh()
         self.init_bokeh_table_data()
         self.generate_content()
-        self.on_msg(self.handle_on_msg)
+        self.on_msg(self._on_msg)
         super(IProfile, self).__init__()
 
+    @property
+    def lprofile(self):
+        return self._lprofile
+
+    @lprofile.setter
+    def lprofile(self, lprofile):
+        self._lprofile = lprofile
+        self.page_cache.clear()
+
+    def select_thread(self, thread):
+        """
+        Display the call graph of self.threads[thread], or of all threads if
+        thread is -1, starting from the summary page.
+        """
+        if thread == -1:
+            graph = self.combined_tree
+        else:
+            graph = self.threads[thread].graph
+        self.thread = thread
+        self.generate_cprofile_tree(graph)
+        # Pages and table rows are cached by function, which may be in more
+        # than one of the graphs. The history is of the previous graph.
+        self.page_cache.clear()
+        self.backward = [None]
+        self.forward = []
+        self.generate_content()
+
+    def update_profile(self, graph, lprofile=None):
+        """
+        Replace the displayed profile by graph and lprofile, keeping the
+        current page, table settings and history. The functions of the
+        current graph must be the first functions of graph, in the same
+        order (as in the snapshots of a live.LiveProfiler), so that only the
+        names of new functions and the current page need to be sent to the
+        front end.
+        """
+        with self.lock:
+            n_old = len(self.function_names)
+            names = [graph.name(i) for i in range(n_old, len(graph))]
+            self.cprofile_tree = graph
+            self.combined_tree = graph
+            graph.caller_index()
+            self.filter_names.extend(name.lower() for name in names)
+            if names and self.front_end_ready:
+                # The list is changed in place, so isn't synced in full.
+                self.function_names.extend(names)
+                self.send({'type': 'names', 'start': n_old, 'names': names})
+            elif names:
+                self.function_names = self.function_names + names
+            self.table_cache.clear()
+            self.time_columns_cache = {}
+            # Clears the page cache.
+            self.lprofile = lprofile
+
+            fun = self.backward[-1]
+            page = self.get_page(fun)
+            self.value_heading = page.heading
+            self.update_table(fun)
+            self.update_flame(fun)
+            self.value_callers = page.callers
+            self.value_lprofile = page.lprofile
+
+    def save(self, path):
+        """
+        Save the profile to path, so that it can be reopened with
+        IProfile.load. The line timings of every function in the call graph
+        are saved, with those of merged code objects combined.
+        """
+        ltimings = {}
+        for key in self.cprofile_tree.keys:
+            if type(key) == str:
+                continue
+            key_ltimings = self.get_ltimings(key)
+            if key_ltimings is not None:
+                ltimings[label(key)] = key_ltimings
+        store.save_profile(path, self.cprofile_tree, ltimings,
+                           self.line_unit())
+
+    def export(self, path, format=None, **kwargs):
+        """
+        Export the call graph and line timings to path, for speedscope or
+        for Chrome's trace viewer and Perfetto, as set by format, or else by
+        the end of path (.speedscope.json or .trace.json). See
+        export.write_profile for the other arguments.
+        """
+        export.write_profile(path, self.cprofile_tree, self.get_ltimings,
+                             self.line_unit(), format=format, **kwargs)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Open a profile saved by IProfile.save, or a pstats file written by
+        cProfile (e.g. with python -m cProfile -o path). Saved profiles are
+        memory mapped, so only the parts which are displayed are read.
+        """
+        if store.is_profile(path):
+            graph, lprofile = store.load_profile(path)
+        else:
+            graph, lprofile = store.load_pstats(path), None
+        return cls(graph, lprofile, **kwargs)
+
+    @staticmethod
+    def diff(a, b, **kwargs):
+        """
+        Return a widget comparing the profiles a and b (IProfiles, or paths
+        which IProfile.load can open), showing how b differs from a.
+        """
+        profiles = [IProfile.load(profile) if isinstance(profile, str) else
+                    profile for profile in (a, b)]
+        return IProfileDiff(*profiles, **kwargs)
+
     def init_bokeh_table_data(self):
-        table_data = dict(ids=[], names=[], times=[],
-                          inlinetimes=[],
-                          plot_inline_times=[],
-                          plot_extra_times=[])
+        table_data = {column: [] for column, _ in self.table_binary_columns}
+        table_data['names'] = []
         self.table_data = ColumnDataSource(table_data)
 
     def generate_cprofile_tree(self, cprofile, context=None):
         """
-        Generate an easy to use dict, based on the output of cProfiler.
-        """
-        self.cprofile_tree = {
-            item[0]: {'callcount': item[1],
-                      'reccallcount': item[2],
-                      'totaltime': item[3],
-                      'inlinetime': item[4],
-                      'calls': ({} if item[5] is None else
-                                {call[0]: {'callcount': call[1],
-                                           'reccallcount': call[2],
-                                           'totaltime': call[3],
-                                           'inlinetime': call[4]}
-                                 for call in item[5]})
-                      } for item in cprofile}
+        Generate a CallGraph, based on the output of cProfiler. cprofile may
+        also be a CallGraph, e.g. one loaded from disk.
+        """
+        if isinstance(cprofile, CallGraph):
+            self.cprofile_tree = cprofile
+        else:
+            self.cprofile_tree = CallGraph.from_cprofile(cprofile)
 
         self.delete_top_level(context)
+        # Built once per graph, so that the callers of any function can be
+        # listed without scanning the graph.
+        self.cprofile_tree.caller_index()
+        self.function_names = [self.cprofile_tree.name(i) for i in
+                               range(len(self.cprofile_tree))]
+        # Lower case names, used for filtering the table.
+        self.filter_names = [name.lower() for name in self.function_names]
+        self.table_cache.clear()
+        self.time_columns_cache = {}
 
     def delete_top_level(self, context=None):
         """
-        Delete the top level calls which are not part of the user's code.
-
-        TODO: If CELL_MAGIC then also merge the entries for the cell (which are
-        seperated by line into individual code objects...)
-        """
-        if context == "LINE_MAGIC":
-            # Find the root nodes that we want
-            new_roots = []
-            for function in self.cprofile_tree:
-                try:
-                    if function.co_name == "<module>":
-                        new_roots += self.cprofile_tree[function]['calls']
-                except AttributeError:
-                    pass
-
-            # Remove function from new_roots if its child is already in
-            # new_roots
-            new_roots = [r for r in new_roots if (type(r) == str or
-                                                  r.co_name != "<module>")]
-            for i in range(len(new_roots)):
-                function = new_roots[i]
-                try:
-                    if function.co_name == "<module>":
-                        del new_roots[i]
-                except AttributeError:
-                    pass
-
-        if context == "CELL_MAGIC":
-            # Find the root nodes that we want
-            new_roots = []
-            for function in self.cprofile_tree:
-                try:
-                    if "<ipython-input" in function.co_filename:
-                        new_roots += self.cprofile_tree[function]['calls']
-                except AttributeError:
-                    pass
-
-        # Populate a new tree with everything below roots in the original
-        # tree.
-        new_cprofile_tree = {}
-
-        def populate_new_tree(roots):
-            for root in roots:
-                if root not in new_cprofile_tree:
-                    new_cprofile_tree[root] = self.cprofile_tree[root]
-                    populate_new_tree(self.cprofile_tree[root]['calls'])
-
-        populate_new_tree(new_roots)
-        self.cprofile_tree = new_cprofile_tree
-
-    def generate_content(self, fun=None):
-        """Generate profile page for function fun. If fun=None then generate
-        a summary page."""
-        self.value_cache = ""
+        Delete the top level calls which are not part of the user's code. If
+        CELL_MAGIC then the entries for the cell (which are seperated by line
+        into individual code objects) are also merged into a single root.
+        """
+        self.cprofile_tree = prune_top_level(self.cprofile_tree, context)
+
+    def generate_content(self, fun=None, line=None):
+        """Display profile page for function fun. If fun=None then display
+        a summary page. Pages are rendered by generate_page, and cached. If
+        line is given then it is highlighted in the line profile."""
+        page = self.get_page(fun)
         self.generate_nav(fun)
-        self.generate_heading(fun)
-        self.generate_table(fun)
-        self.generate_lprofile(fun)
+        self.value_heading = page.heading
+        self.table_filter = ''
+        self.table_page = 0
+        self.update_table(fun)
+        self.update_flame(fun)
+        self.value_callers = page.callers
+        if line is None:
+            self.value_lprofile = page.lprofile
+        else:
+            self.value_lprofile = self.generate_lprofile(fun, line)
+
+        if self.prefetch and fun is not None:
+            children = self.cprofile_tree.children(
+                self.cprofile_tree.index(fun))
+            totaltimes = self.cprofile_tree.nodes['totaltime'][children]
+            order = np.argsort(-totaltimes, kind='mergesort')
+            for child in children[order[:self.prefetch]]:
+                self.get_page(self.cprofile_tree.keys[child])
+
+    def get_page(self, fun):
+        """Return the rendered page for fun, from the cache if possible."""
+        page = self.page_cache.get(fun)
+        if page is None:
+            page = self.generate_page(fun)
+            self.page_cache[fun] = page
+        return page
+
+    def generate_page(self, fun):
+        """
+        Render the heading, table of callers and line profile for fun. The
+        summary page also lists the hot paths, after the heading.
+        """
+        heading = self.generate_heading(fun)
+        if fun is None and self.show_hot_paths:
+            heading += self.generate_hot_paths()
+        return Page(heading=heading,
+                    callers=self.generate_callers(fun),
+                    lprofile=self.generate_lprofile(fun))
 
     def generate_nav(self, fun):
         self.nav_home_active = (fun is not None)
@@ -151,15 +396,22 @@ class IProfile(DOMWidget):
         self.nav_forward_active = (len(self.forward) > 0)
 
     def generate_heading(self, fun):
-        """Generate a heading for the top of the iprofile."""
+        """Return a heading for the top of the iprofile."""
         if fun is None:
             heading = "<h3>Summary</h3>"
+            if self.memory is not None:
+                heading += "<p>Peak memory allocated: {:.1f} KiB</p>".format(
+                    self.memory.peak / 1024.)
+            if self.threads:
+                heading += self.generate_thread_table()
         else:
             try:
+                graph = self.cprofile_tree
+                i = graph.index(fun)
                 heading = "{} (Calls: {}, Time: {})"
                 heading = heading.format(fun.co_name,
-                                         self.cprofile_tree[fun]['callcount'],
-                                         self.cprofile_tree[fun]['totaltime'])
+                                         graph.nodes['callcount'][i],
+                                         graph.nodes['totaltime'][i])
                 heading = html_escape(heading)
                 heading = "<h3>" + heading + "</h3>"
                 heading += ("<p>From file: " +
@@ -167,98 +419,428 @@ class IProfile(DOMWidget):
             except AttributeError:
                 heading = "<h3>" + html_escape(fun) + "</h3>"
 
-        self.value_heading = heading
+        return heading
 
-    def generate_table(self, fun):
+    def generate_callers(self, fun):
         """
-        Generate a table displaying the functions called by fun and their
-        respective running times. This is done using Bokeh's DataTable widget,
-        which is based on SlickGrid.
+        Return an HTML table of the functions which call fun, with the
+        number of calls each made, the time of those calls and their share
+        of the time of fun, slowest first. Clicking a caller opens its page.
         """
+        if fun is None:
+            return ""
+        graph = self.cprofile_tree
+        callers, calls = graph.parents(graph.index(fun))
+        if not len(callers):
+            return ""
+        times = graph.edges['totaltime'][calls]
+        counts = graph.edges['callcount'][calls]
+        order = np.argsort(-times, kind='mergesort')
+        callers, times, counts = callers[order], times[order], counts[order]
+        parent_time = self.function_time(fun)
+        shares = (times / parent_time if parent_time else
+                  np.zeros_like(times))
+        texts = self.format_times(self.display_times(times, counts,
+                                                     parent_time))
+
+        rows = ["<tr><th>Called by</th><th>Calls</th><th>{}</th>"
+                "<th>Share</th></tr>".format(
+                    html_escape(self.time_title("Time")))]
+        for caller, count, text, share in zip(callers, counts, texts, shares):
+            rows.append('<tr><td><a id="function{}" style="cursor:pointer">'
+                        '{}</a></td><td>{:g}</td><td>{}</td>'
+                        '<td>{:.1%}</td></tr>'.format(
+                            caller, html_escape(graph.name(caller)), count,
+                            text, share))
+        return "<table>" + "".join(rows) + "</table>"
+
+    def generate_hot_paths(self):
+        """
+        Return an HTML list of the call paths in which the most time is
+        spent inline, see CallGraph.hot_paths. Each path expands to a table
+        of the functions along it, with the estimated time of the calls
+        along the path. Clicking a function opens its page, and clicking the
+        line at the end of a path opens the page of its last function at
+        its slowest line. Times per call are per estimated call along the
+        path.
+        """
+        graph = self.cprofile_tree
+        if not len(graph):
+            return ""
+        paths = graph.hot_paths(graph.roots(), self.hot_path_count)
+        if not paths:
+            return ""
+        total = self.total_time()
+        link = '<a id="function{}" style="cursor:pointer">{}</a>'
+        title = html_escape(self.time_title("Time"))
+        items = []
+        for path in paths:
+            times = np.array(path.widths + [path.inline]) * total
+            texts = self.format_times(self.display_times(
+                times, np.array(path.counts + path.counts[-1:])))
+            rows = ["<tr><th>Function</th><th>{}</th><th>Share</th>"
+                    "</tr>".format(title)]
+            for depth, (i, text, width) in enumerate(zip(path.ids, texts,
+                                                         path.widths)):
+                rows.append('<tr><td>{}{}</td><td>{}</td><td>{:.1%}</td>'
+                            '</tr>'.format('&nbsp;' * 2 * depth,
+                                           link.format(
+                                               i, html_escape(graph.name(i))),
+                                           text, width))
+            leaf = path.ids[-1]
+            line = self.slowest_line(graph.keys[leaf])
+            if line is None:
+                inline = "(inline)"
+            else:
+                inline = link.format('{}:{}'.format(leaf, line),
+                                     "line {}".format(line))
+            rows.append('<tr><td>{}{}</td><td>{}</td><td>{:.1%}</td>'
+                        '</tr>'.format('&nbsp;' * 2 * len(path.ids), inline,
+                                       texts[-1], path.inline))
+
+            names = [graph.name(i) for i in path.ids]
+            if len(names) > 4:
+                names = names[:1] + [u"\u2026"] + names[-2:]
+            summary = u"{:.1%} {}".format(path.inline,
+                                          u" \u2192 ".join(names))
+            # The heaviest path is expanded.
+            items.append(u"<details{}><summary>{}</summary><table>{}</table>"
+                         u"</details>".format(" open" if not items else "",
+                                              html_escape(summary),
+                                              "".join(rows)))
+        return "<h4>Hot paths</h4>" + "".join(items)
+
+    def slowest_line(self, fun):
+        """
+        Return the number of the line of fun with the largest time, or None
+        if it has no line timings.
+        """
+        if type(fun) == str:
+            return None
+        ltimings = self.get_ltimings(fun)
+        if not ltimings or len(ltimings) < 2:
+            return None
+        return max(ltimings[:-1], key=lambda row: row[2])[0]
+
+    def generate_thread_table(self):
+        """
+        Return an HTML table of the wall and CPU time of each thread. A
+        thread whose CPU time is well below its wall time spent that time
+        waiting, e.g. for I/O or for the GIL.
+        """
+        rows = ["<tr><th>Thread</th><th>Wall time (s)</th>"
+                "<th>CPU time (s)</th><th>CPU / wall</th></tr>"]
+        for thread in self.threads:
+            if thread.cpu_time is None:
+                cpu_time = ratio = "-"
+            else:
+                cpu_time = "{:.6f}".format(thread.cpu_time)
+                ratio = ("{:.0%}".format(thread.cpu_time / thread.wall_time)
+                         if thread.wall_time > 0 else "-")
+            rows.append("<tr><td>{}</td><td>{:.6f}</td><td>{}</td>"
+                        "<td>{}</td></tr>".format(html_escape(thread.name),
+                                                  thread.wall_time, cpu_time,
+                                                  ratio))
+        return "<table>" + "".join(rows) + "</table>"
+
+    def get_table_rows(self, fun):
+        """
+        Return the ids of the functions in the table for fun (the functions
+        called by fun, or all functions if fun=None), filtered by name and
+        sorted by the current settings.
+        """
+        key = (fun, self.table_sort, self.table_filter)
+        rows = self.table_cache.get(key)
+        if rows is not None:
+            return rows
+
+        graph = self.cprofile_tree
         if fun is None:
             # Generate summary page
-            calls = self.cprofile_tree.keys()
+            calls = np.arange(len(graph))
         else:
-            calls = [function for function in self.cprofile_tree[fun]['calls']]
-
-        self.n_table_elements = len(calls)
-
-        names = [call if type(call) == str else call.co_name for call in calls]
-
-        # List of tuples containing:
-        # (id number, name, totaltime, inlinetime, cprofile_key)
-        calls = list(zip(range(len(calls)), names,
-                         (self.cprofile_tree[x]['totaltime'] for x in calls),
-                         (self.cprofile_tree[x]['inlinetime'] for x in calls),
-                         calls))
-
-        self.id_dict = {"function" + str(id): cprofile_key for
-                        (id, name, time, inlinetime, cprofile_key) in calls}
+            calls = graph.children(graph.index(fun))
+
+        if self.table_filter:
+            needle = self.table_filter.lower()
+            names = self.filter_names
+            calls = calls[np.array([needle in names[call] for call in calls],
+                                   dtype=bool)]
+
+        if self.table_sort == 'name':
+            names = np.array([graph.name(call) for call in calls],
+                             dtype=object)
+            order = np.argsort(names, kind='mergesort')
+        else:
+            order = np.argsort(-self.sort_values(self.table_sort, calls),
+                               kind='mergesort')
+        rows = calls[order]
+        self.table_cache[key] = rows
+        return rows
 
-        # Sort by total time (descending)
-        calls.sort(key=lambda x: x[2])
-        calls.reverse()
+    def sort_values(self, column, calls):
+        """
+        Return the values of column for the functions in calls, by which the
+        table is sorted in descending order.
+        """
+        return self.cprofile_tree.nodes[column][calls]
 
-        # Generate bokeh table
-        try:
-            ids, names, times, inlinetimes = list(zip(*calls))[:-1]
-        except ValueError:
-            return
+    def generate_table(self, fun):
+        """
+        Return the data for the current page of a table displaying the
+        functions called by fun and their respective running times.
+        """
+        graph = self.cprofile_tree
+        rows = self.get_table_rows(fun)
+        self.n_table_elements = len(rows)
+        self.table_n_pages = max(1, -(-len(rows) // self.table_page_size))
+        self.table_page = max(0, min(self.table_page,
+                                     self.table_n_pages - 1))
+        start = self.table_page * self.table_page_size
+        calls = rows[start:start + self.table_page_size]
+
+        times, inlinetimes = self.table_times(fun, calls)
+        table_data = dict(ids=calls,
+                          names=[graph.name(call) for call in calls],
+                          times=times,
+                          inlinetimes=inlinetimes)
+        table_data.update(self.time_plots(rows, calls))
+        if self.memory is not None:
+            for column, _, node_column, _, scale in MEMORY_TABLE_COLUMNS:
+                table_data[column] = graph.nodes[node_column][calls] * scale
+        return table_data
+
+    def table_times(self, fun, calls):
+        """
+        Return the total and inline times of the functions in calls, in the
+        table for fun, in the current display mode and unit. The times of
+        every function are transformed at once, and cached until the profile
+        or the display settings change.
+        """
+        key = (self.time_mode, self.time_unit)
+        columns = self.time_columns_cache.get(key)
+        if columns is None:
+            nodes = self.cprofile_tree.nodes
+            counts = nodes[self.count_column]
+            columns = [self.display_times(nodes[column], counts) for
+                       column in ('totaltime', 'inlinetime')]
+            self.time_columns_cache[key] = columns
+        times = [column[calls] for column in columns]
+        if self.time_mode == 'percent_parent' and fun is not None:
+            # The cached columns are percentages of the total time.
+            parent_time = self.function_time(fun)
+            scale = self.total_time() / parent_time if parent_time else 0.
+            times = [column * scale for column in times]
+        return times
+
+    def total_time(self):
+        """
+        Return the total time of the profile, the sum of the total times of
+        its root functions.
+        """
+        total = self.time_columns_cache.get('total')
+        if total is None:
+            graph = self.cprofile_tree
+            total = (graph.nodes['totaltime'][graph.roots()].sum() if
+                     len(graph) else 0.)
+            self.time_columns_cache['total'] = total
+        return total
+
+    def function_time(self, fun):
+        """
+        Return the total time of fun, of which the times below it are shown
+        as percentages in the percent_parent mode.
+        """
+        return self.cprofile_tree.nodes['totaltime'][
+            self.cprofile_tree.index(fun)]
 
-        time_plot_multiplier = 100 / max(times)
-        plot_inline_times = [time_plot_multiplier * time for time in
-                             inlinetimes]
-        plot_extra_times = [time_plot_multiplier * (totaltime - inlinetime)
-                            for totaltime, inlinetime in zip(times,
-                                                             inlinetimes)]
+    def display_times(self, times, counts, parent_time=None):
+        """
+        Return times, an array of times in seconds, in the current display
+        mode and unit. counts holds the number of calls (or hits) behind
+        each time, for the per_call mode, and parent_time the time of the
+        displayed function, for the percent_parent mode (which is otherwise
+        the same as percent_total).
+        """
+        times = np.asarray(times, dtype=np.float64)
+        mode = self.time_mode
+        if mode in ('percent_total', 'percent_parent'):
+            total = self.total_time()
+            if mode == 'percent_parent' and parent_time is not None:
+                total = parent_time
+            return times * (100. / total) if total else np.zeros_like(times)
+        if mode == 'per_call':
+            times = times / np.maximum(counts, 1)
+        return times / _TIME_UNITS[self.time_unit][2]
+
+    def format_times(self, times, signed=False):
+        """
+        Return a list of strings of times, as returned by display_times.
+        """
+        if self.time_mode in ('percent_total', 'percent_parent'):
+            decimals = 2
+        else:
+            decimals = _TIME_UNITS[self.time_unit][3]
+        template = '%{}.{}f'.format('+' if signed else '', decimals)
+        return list(np.char.mod(template, np.asarray(times)))
+
+    def time_title(self, title):
+        """Return title with the current display mode and unit."""
+        mode = self.time_mode
+        if mode == 'percent_total':
+            return title + " (% of total)"
+        if mode == 'percent_parent':
+            return title + " (% of parent)"
+        if mode == 'per_call':
+            title += " per call"
+        return title + " (" + _TIME_UNITS[self.time_unit][1] + ")"
+
+    def set_time_display(self, unit=None, mode=None):
+        """
+        Change the unit and mode in which times are displayed, see
+        TIME_UNITS and TIME_MODES, and redisplay the current page.
+        """
+        if unit is not None:
+            self.time_unit = unit
+        if mode is not None:
+            self.time_mode = mode
+        if self.bokeh_table_div:
+            decimals = (2 if self.time_mode.startswith('percent') else
+                        _TIME_UNITS[self.time_unit][3])
+            self.time_format.format = '0,0' + ('.' + '0' * decimals if
+                                               decimals else '')
+            for column, title in zip(self.bokeh_table.columns[1:3],
+                                     self.table_time_titles):
+                column.title = self.time_title(title)
+        self.page_cache.clear()
+        fun = self.backward[-1]
+        page = self.get_page(fun)
+        self.value_heading = page.heading
+        self.update_table(fun)
+        self.value_callers = page.callers
+        self.value_lprofile = page.lprofile
+        if self.bokeh_table_div and self.front_end_ready:
+            push_notebook()
 
-        self.table_data.data = dict(ids=ids, names=names, times=times,
-                                    inlinetimes=inlinetimes,
-                                    plot_inline_times=plot_inline_times,
-                                    plot_extra_times=plot_extra_times)
+    def time_plots(self, rows, calls):
+        """
+        Return a dict with the plot_* columns of the table, for the functions
+        in calls, the current page of rows.
+        """
+        # Scale the time plots by the largest time on any page.
+        totaltimes = self.cprofile_tree.nodes['totaltime']
+        inlinetimes = self.cprofile_tree.nodes['inlinetime']
+        max_time = totaltimes[rows].max() if len(rows) else 0
+        time_plot_multiplier = 100 / max_time if max_time > 0 else 0
+        return dict(plot_inline_times=(time_plot_multiplier *
+                                       inlinetimes[calls]),
+                    plot_extra_times=(time_plot_multiplier *
+                                      (totaltimes[calls] -
+                                       inlinetimes[calls])))
+
+    def update_table(self, fun):
+        """
+        Display the current page of the table for fun. This is done using
+        Bokeh's DataTable widget, which is based on SlickGrid.
+        """
+        table_data = self.generate_table(fun)
+        self.table_page_data = table_data
 
         if self.bokeh_table_div == "":
-            # First run
+            # First run, the data is embedded in the table's html.
+            self.table_data.data = table_data
             self.init_bokeh_table()
+        elif self.front_end_ready:
+            self.send_table_page(fun)
+        # Otherwise the page is sent once the front end is ready, see
+        # handle_on_msg.
+
+    def send_table_page(self, fun):
+        """
+        Send the current page of the table for fun to the front end, and fit
+        the height of the table to it.
+        """
+        table_data = self.table_page_data
+        self.send_table(table_data)
+        if fun is None:
+            height = 27 + 25 * self.table_page_size
         else:
-            if fun is None:
-                self.bokeh_table.height = 27 + 25 * 20
-            else:
-                self.bokeh_table.height = 27 + 25 * min(10, len(calls))
+            height = 27 + 25 * max(1, len(table_data['ids']))
+        if height != self.bokeh_table.height:
+            self.bokeh_table.height = height
             push_notebook()
 
+    def send_table(self, table_data):
+        """
+        Send table data to the front end, which puts it into the Bokeh
+        ColumnDataSource. The numeric columns are sent as typed binary
+        buffers rather than as JSON.
+        """
+        self.send_columns('table', table_data, self.table_binary_columns)
+
+    def send_columns(self, message_type, data, binary_columns):
+        """
+        Send the columns of data given by binary_columns, a sequence of
+        (column, dtype) pairs, to the front end as binary buffers.
+        """
+        columns, dtypes = zip(*binary_columns)
+        buffers = [memoryview(np.ascontiguousarray(data[column], dtype=dtype))
+                   for column, dtype in binary_columns]
+        self.send({'type': message_type, 'columns': list(columns),
+                   'dtypes': list(dtypes)},
+                  buffers=buffers)
+
+    def update_flame(self, fun):
+        """
+        Send the frames of a flame graph of the calls below fun (or below
+        all root functions if fun=None) to the front end, which draws it on
+        a canvas. Clicking a frame opens the page of its function.
+        """
+        if not (self.show_flame and self.front_end_ready):
+            return
+        graph = self.cprofile_tree
+        roots = graph.roots() if fun is None else [graph.index(fun)]
+        self.send_columns('flame', graph.flame(roots), FLAME_BINARY_COLUMNS)
+
     def init_bokeh_table(self):
-        time_format = bokeh_tables.NumberFormatter(format='0,0.00000')
+        time_format = bokeh_tables.NumberFormatter(format='0,0.000000')
+        self.time_format = time_format
 
         name_template = ('<a id="function<%= ids %>", style="cursor:pointer">'
                          '<%- names %></a>')
         name_format = (bokeh_tables.
                        HTMLTemplateFormatter(template=name_template))
 
-        time_plot_template = ('<svg width="100" height="10">'
-                              '<rect width="<%= plot_inline_times%>"'
-                              'height="10" style="fill:rgb(255, 0, 0);"/>'
-                              '<rect x="<%= plot_inline_times%>"'
-                              'width="<%= plot_extra_times %>"'
-                              'height="10" style="fill:rgb(255, 160, 160);"/>'
-                              '</svg>')
         time_plot_format = (bokeh_tables.
-                            HTMLTemplateFormatter(template=time_plot_template))
+                            HTMLTemplateFormatter(
+                                template=self.time_plot_template))
 
+        # Sorting is done in the kernel, see get_table_rows.
         columns = [bokeh_tables.TableColumn(title="Function",
                                             field="names",
-                                            formatter=name_format),
-                   bokeh_tables.TableColumn(title="Total time (s)",
+                                            formatter=name_format,
+                                            sortable=False),
+                   bokeh_tables.TableColumn(title=self.time_title(
+                                                self.table_time_titles[0]),
                                             field="times",
                                             formatter=time_format,
-                                            default_sort="descending"),
-                   bokeh_tables.TableColumn(title="Inline time (s)",
+                                            sortable=False),
+                   bokeh_tables.TableColumn(title=self.time_title(
+                                                self.table_time_titles[1]),
                                             field="inlinetimes",
                                             formatter=time_format,
-                                            default_sort="descending"),
+                                            sortable=False),
                    bokeh_tables.TableColumn(title="Time plot",
                                             sortable=False,
                                             formatter=time_plot_format)]
+        width = 620
+        if self.memory is not None:
+            memory_format = bokeh_tables.NumberFormatter(format='0,0.0')
+            for column, _, _, title, _ in MEMORY_TABLE_COLUMNS:
+                columns.append(bokeh_tables.TableColumn(
+                    title=title, field=column, formatter=memory_format,
+                    sortable=False))
+            width += 100 * len(MEMORY_TABLE_COLUMNS)
 
         bokeh_table = bokeh_tables.DataTable(source=self.table_data,
                                              columns=columns,
@@ -266,61 +848,112 @@ class IProfile(DOMWidget):
                                              # be automatic but this appears
                                              # to be broken in firefox and
                                              # chrome.
-                                             width=620,
+                                             width=width,
                                              height=27 + 15 * 25,
                                              selectable=False,
                                              row_headers=False)
 
         self.bokeh_table = bokeh_table
+        self.table_source_id = self.table_data.ref['id']
 
         comms_target = bokeh_util.serialization.make_id()
         self.bokeh_comms_target = comms_target
         self.bokeh_table_div = notebook_div(hplot(bokeh_table), comms_target)
 
-    def generate_lprofile(self, fun):
+    def generate_lprofile(self, fun, highlight_line=None):
         """
-        Generate div containing profiled source code with timings of each line,
-        taken from iline_profiler.
+        Return div containing profiled source code with timings of each line,
+        taken from iline_profiler, and the memory allocated by each line if
+        the statement was memory profiled. The line highlight_line, if
+        given, is highlighted.
         """
-        self.value_lprofile = ""
         try:
-            filename = fun.co_filename
             firstlineno = fun.co_firstlineno
-            name = fun.co_name
         except AttributeError:
-            return
-
-        ltimings_key = (filename, firstlineno, name)
-
-        try:
-            ltimings = self.lprofile.timings[ltimings_key]
-        except KeyError:
-            return
-
-        # Currently the correct filename is stored at the end of ltimings.
-        # This is a work-around to fix cProfiler giving useless filenames for
-        # zipped packages.
-        filename = ltimings[-1]
+            return ""
+
+        ltimings = self.get_ltimings(fun)
+        memory_lines = self.get_memory_lines(fun)
+        if ltimings is None:
+            if not memory_lines:
+                return ""
+            # Lines are still shown, without timings.
+            ltimings = [fun.co_filename]
+
+        rows = ltimings[:-1]
+        times = self.display_times(
+            np.array([time for _, _, time in rows],
+                     dtype=np.float64) * self.line_unit(),
+            np.array([nhits for _, nhits, _ in rows], dtype=np.float64),
+            self.function_time(fun))
+
+        extra_columns = self.get_extra_line_columns(fun)
+        if memory_lines:
+            peaks = {lineno: ('{:,}'.format(peak), None) for
+                     lineno, (peak, _, _) in memory_lines.items()}
+            extra_columns = extra_columns + [('Peak held (B)', peaks)]
+        return format_lprofile(firstlineno, ltimings, extra_columns,
+                               times=self.format_times(times),
+                               time_title=self.time_title("Time"),
+                               highlight_line=highlight_line)
+
+    def get_ltimings(self, fun):
+        """
+        Return the line timings recorded for fun, or None if there are none.
+        The timings of merged code objects are combined.
+        """
+        return store.merged_ltimings(self.lprofile, fun)
 
-        if filename.endswith(('.pyc', '.pyo')):
-            filename = openpy.source_from_cache(filename)
-        if ".egg/" in filename:
-            add_zipped_file_to_linecache(filename)
+    def line_unit(self):
+        """Return the timer unit of the line timings, in seconds."""
+        return store.timer_unit(self.lprofile)
 
-        raw_code = ""
-        linenos = range(firstlineno, ltimings[-2][0] + 1)
+    def get_extra_line_columns(self, fun):
+        """
+        Return a list of extra columns to display next to the line timings
+        of fun, see LProfileFormatter.
+        """
+        return []
 
-        for lineno in linenos:
-            raw_code += ulinecache.getline(filename, lineno)
+    def get_memory_lines(self, fun):
+        """
+        Return a dict mapping the line numbers of fun to the (peak size,
+        size, count) of the memory they allocated, which is empty if the
+        statement wasn't memory profiled.
+        """
+        if self.memory is None or type(fun) == str:
+            return {}
+        return self.memory.functions.get(label(fun), {})
 
-        formatter = LProfileFormatter(firstlineno, ltimings, noclasses=True)
-        self.value_lprofile = highlight(raw_code, PythonLexer(), formatter)
+    def _on_msg(self, widget, content, buffers):
+        with self.lock:
+            self.handle_on_msg(widget, content, buffers)
 
     def handle_on_msg(self, _, content, buffers):
         """
         Handler for click (and potentially other) events from the user.
         """
-        if content == "home":
+        if isinstance(content, dict) and 'thread' in content:
+            self.select_thread(int(content['thread']))
+        elif isinstance(content, dict) and ('unit' in content or
+                                            'mode' in content):
+            unit = content.get('unit')
+            mode = content.get('mode')
+            self.set_time_display(unit if unit in _TIME_UNITS else None,
+                                  mode if mode in TIME_MODES else None)
+        elif isinstance(content, dict):
+            # Changes to the table settings.
+            if content.get('sort') in [column for column, _ in
+                                       self.table_sort_options]:
+                self.table_sort = content['sort']
+                self.table_page = 0
+            if 'filter' in content:
+                self.table_filter = content['filter']
+                self.table_page = 0
+            if 'page' in content:
+                self.table_page = int(content['page'])
+            self.update_table(self.backward[-1])
+        elif content == "home":
             self.backward.append(None)
             self.forward = []
             self.generate_content()
@@ -341,130 +974,351 @@ class IProfile(DOMWidget):
                                                     bokeh_io.curstate().
                                                     document.to_json()))
             bokeh_io._state.last_comms_handle = self.bokeh_table_handle
-        else:
-            clicked_fun = self.id_dict[content]
+            self.front_end_ready = True
+            # The page may have changed (in update_profile, say) since the
+            # table was embedded.
+            self.send_table_page(self.backward[-1])
+            self.update_flame(self.backward[-1])
+        elif content.startswith("function"):
+            # "function<id>", or "function<id>:<line>" to open the page of
+            # the function at the given line.
+            fun_id, _, line = content[8:].partition(':')
+            clicked_fun = self.cprofile_tree.keys[int(fun_id)]
             self.backward.append(clicked_fun)
             self.forward = []
-            self.generate_content(clicked_fun)
-
-
-def add_zipped_file_to_linecache(filename):
-    (zipped_filename, extension, inner) = filename.partition('.egg/')
-    zipped_filename += extension[:-1]
-    assert zipfile.is_zipfile(zipped_filename)
-    zipped_file = zipfile.ZipFile(zipped_filename)
-    ulinecache.linecache.cache[filename] = (None, None,
-                                            zipped_file.open(inner, 'r').
-                                            readlines())
-    zipped_file.close()
-
-
-class LProfileFormatter(HtmlFormatter):
-
-    def __init__(self, firstlineno, ltimings, *args, **kwargs):
-        self.lineno = firstlineno
-        self.ltimings = ltimings
-        super(LProfileFormatter, self).__init__(*args, **kwargs)
-
-    def wrap(self, source, outfile):
-        return super(LProfileFormatter,
-                     self).wrap(self._wrap_code(source), outfile)
-
-    def _wrap_code(self, source):
-        head_template = '{} {} {}'
-        no_time_template = '{:6} {:7} {:>4} {}'
-        template = '<span style=\'color: Red\'>{:06.2f}</span> {:>7} {:>4} {}'
-        time = '<span style=\'color: Red; font-weight: bold\'>Time</span>   '
-        yield 0, head_template.format(time, ' Calls',
-                                      ' <strong>Code</strong>\n')
-        # j keeps track of position within ltimings
-        j = 0
-        for i, line in source:
-            lineno = self.lineno
-            if j < len(self.ltimings) and lineno == self.ltimings[j][0]:
-                lcalls = self.ltimings[j][1]
-                ltime = self.ltimings[j][2] * 1e-6
-                yield i, template.format(ltime, lcalls, lineno, line)
-                j += 1
-            else:
-                yield i, no_time_template.format('', '', lineno, line)
-            self.lineno += 1
+            self.generate_content(clicked_fun, int(line) if line else None)
+
+
+class IProfileDiff(IProfile):
+    """
+    Widget comparing two profiles, created by IProfile.diff. Functions are
+    matched by (filename, firstlineno, name). Times in the table are the
+    change from the first profile to the second, and the line profile shows
+    the timings of the second profile next to the change for each line.
+    """
+    table_time_titles = (u"\u0394 Total time", u"\u0394 Inline time")
+    # Changes in time don't nest, so can't be shown as a flame graph, or
+    # followed along hot paths.
+    show_flame = False
+    show_hot_paths = False
+    # Bars extend right of the centre for functions which got slower, and
+    # left for those which got faster.
+    time_plot_template = ('<svg width="100" height="10">'
+                          '<rect x="<%= 50 + Math.min(0, plot_extra_times) %>"'
+                          'width="<%= Math.abs(plot_extra_times) %>"'
+                          'height="10" style="fill:<%= plot_extra_times > 0 ?'
+                          ' "rgb(255, 160, 160)" : "rgb(160, 220, 160)" %>;"/>'
+                          '<rect x="<%= 50 + '
+                          'Math.min(0, plot_inline_times) %>"'
+                          'width="<%= Math.abs(plot_inline_times) %>"'
+                          'height="10" style="fill:<%= plot_inline_times > 0 ?'
+                          ' "rgb(255, 0, 0)" : "rgb(0, 160, 0)" %>;"/>'
+                          '<line x1="50" x2="50" y1="0" y2="10"'
+                          'style="stroke:rgb(0, 0, 0);"/>'
+                          '</svg>')
+
+    # Times per call are per call in the second profile.
+    count_column = 'after_callcount'
+
+    def __init__(self, a, b, **kwargs):
+        self.profiles = (a, b)
+        graph, a_ids, b_ids = callgraph.diff(a.cprofile_tree, b.cprofile_tree)
+        # The id in a and in b of each function in graph, or -1.
+        self.profile_ids = []
+        for ids in (a_ids, b_ids):
+            profile_ids = np.full(len(graph), -1, dtype=np.intp)
+            profile_ids[ids] = np.arange(len(ids))
+            self.profile_ids.append(profile_ids)
+        super(IProfileDiff, self).__init__(graph, **kwargs)
+
+    def generate_heading(self, fun):
+        if fun is None:
+            return "<h3>Comparison</h3>"
+        graph = self.cprofile_tree
+        i = graph.index(fun)
+        heading = (u"{} (Calls: {} \u2192 {}, "
+                   u"Time: {:.6f} \u2192 {:.6f} ({:+.6f}))")
+        heading = heading.format(graph.name(i),
+                                 graph.nodes['before_callcount'][i],
+                                 graph.nodes['after_callcount'][i],
+                                 graph.nodes['before_totaltime'][i],
+                                 graph.nodes['after_totaltime'][i],
+                                 graph.nodes['totaltime'][i])
+        heading = "<h3>" + html_escape(heading) + "</h3>"
+        if type(fun) != str:
+            heading += ("<p>From file: " +
+                        html_escape(fun.co_filename) + "</p>")
+        return heading
+
+    def sort_values(self, column, calls):
+        # Largest changes first, whether faster or slower.
+        return np.abs(self.cprofile_tree.nodes[column][calls])
+
+    def total_time(self):
+        # Changes are shown as percentages of the second profile's times.
+        return self.profiles[1].total_time()
+
+    def function_time(self, fun):
+        return self.cprofile_tree.nodes['after_totaltime'][
+            self.cprofile_tree.index(fun)]
+
+    def line_unit(self):
+        for profile in reversed(self.profiles):
+            if profile.lprofile is not None:
+                return profile.lprofile.unit
+        return 1e-6
+
+    def time_plots(self, rows, calls):
+        totaltimes = self.cprofile_tree.nodes['totaltime']
+        inlinetimes = self.cprofile_tree.nodes['inlinetime']
+        max_time = np.abs(totaltimes[rows]).max() if len(rows) else 0
+        time_plot_multiplier = 50 / max_time if max_time > 0 else 0
+        return dict(plot_inline_times=(time_plot_multiplier *
+                                       inlinetimes[calls]),
+                    plot_extra_times=(time_plot_multiplier *
+                                      totaltimes[calls]))
+
+    def profile_ltimings(self, fun):
+        """
+        Return the line timings of fun in each of the two profiles, as dicts
+        mapping line numbers to (nhits, time) in the timer unit line_unit(),
+        and the source filename.
+        """
+        i = self.cprofile_tree.index(fun)
+        unit = self.line_unit()
+        filename = None
+        result = []
+        for profile, ids in reversed(list(zip(self.profiles,
+                                              self.profile_ids))):
+            lines = {}
+            if ids[i] >= 0:
+                ltimings = profile.get_ltimings(
+                    profile.cprofile_tree.keys[ids[i]])
+                if ltimings is not None:
+                    scale = profile.lprofile.unit / unit
+                    lines = {lineno: (nhits, time * scale) for
+                             lineno, nhits, time in ltimings[:-1]}
+                    filename = filename or ltimings[-1]
+            result.insert(0, lines)
+        return result[0], result[1], filename
+
+    def get_ltimings(self, fun):
+        before, after, filename = self.profile_ltimings(fun)
+        if filename is None:
+            return None
+        return ([(lineno,) + after.get(lineno, (0, 0)) for
+                 lineno in sorted(set(before) | set(after))] + [filename])
+
+    def get_extra_line_columns(self, fun):
+        before, after, _ = self.profile_ltimings(fun)
+        linenos = sorted(set(before) | set(after))
+        nhits_before, times_before = (np.array(
+            [before.get(lineno, (0, 0)) for lineno in linenos],
+            dtype=np.float64).reshape(-1, 2).T)
+        nhits_after, times_after = (np.array(
+            [after.get(lineno, (0, 0)) for lineno in linenos],
+            dtype=np.float64).reshape(-1, 2).T)
+        dtimes = times_after - times_before
+        texts = self.format_times(
+            self.display_times(dtimes * self.line_unit(), nhits_after,
+                               self.function_time(fun)), signed=True)
+        dtime_cells = {}
+        dcall_cells = {}
+        for lineno, dtime, text, dcalls in zip(linenos, dtimes, texts,
+                                               nhits_after - nhits_before):
+            if dtime:
+                # Slower lines are red and faster lines green.
+                dtime_cells[lineno] = (text, 'Red' if dtime > 0 else 'Green')
+            if dcalls:
+                dcall_cells[lineno] = ('{:+}'.format(int(dcalls)), None)
+        return [(u'\u0394Time', dtime_cells), (u'\u0394Calls', dcall_cells)]
+
+
+class IProfileAggregate(IProfile):
+    """
+    Widget showing the combined profile of repeated runs, created from a
+    ProfileAggregator. Times are means over the runs, and the time plot has
+    error bars of one standard deviation of the total time.
+    """
+    table_binary_columns = TABLE_BINARY_COLUMNS + (('plot_error_lows', '<f4'),
+                                                   ('plot_error_highs', '<f4'))
+    time_plot_template = (IProfile.time_plot_template[:-len('</svg>')] +
+                          '<line x1="<%= plot_error_lows %>"'
+                          'x2="<%= plot_error_highs %>" y1="5" y2="5"'
+                          'style="stroke:rgb(0, 0, 0);"/>'
+                          '<line x1="<%= plot_error_highs %>"'
+                          'x2="<%= plot_error_highs %>" y1="2" y2="8"'
+                          'style="stroke:rgb(0, 0, 0);"/>'
+                          '</svg>')
+
+    def __init__(self, aggregator, **kwargs):
+        self.aggregator = aggregator
+        super(IProfileAggregate, self).__init__(aggregator.graph(),
+                                                aggregator.line_stats(),
+                                                **kwargs)
+
+    def generate_heading(self, fun):
+        if fun is None:
+            return "<h3>Summary of {} runs</h3>".format(
+                self.aggregator.n_runs)
+        graph = self.cprofile_tree
+        i = graph.index(fun)
+        heading = u"{} (Calls: {:g}, Time: {:.6f} \u00b1 {:.6f}, min {:.6f})"
+        heading = heading.format(graph.name(i),
+                                 graph.nodes['callcount'][i],
+                                 graph.nodes['totaltime'][i],
+                                 graph.nodes['std_totaltime'][i],
+                                 graph.nodes['min_totaltime'][i])
+        heading = "<h3>" + html_escape(heading) + "</h3>"
+        if type(fun) != str:
+            heading += ("<p>From file: " +
+                        html_escape(fun.co_filename) + "</p>")
+        return heading
+
+    def time_plots(self, rows, calls):
+        nodes = self.cprofile_tree.nodes
+        totaltimes = nodes['totaltime']
+        inlinetimes = nodes['inlinetime']
+        stds = nodes['std_totaltime']
+        max_time = (totaltimes[rows] + stds[rows]).max() if len(rows) else 0
+        time_plot_multiplier = 100 / max_time if max_time > 0 else 0
+        return dict(plot_inline_times=(time_plot_multiplier *
+                                       inlinetimes[calls]),
+                    plot_extra_times=(time_plot_multiplier *
+                                      (totaltimes[calls] -
+                                       inlinetimes[calls])),
+                    plot_error_lows=(time_plot_multiplier *
+                                     np.maximum(0, totaltimes[calls] -
+                                                stds[calls])),
+                    plot_error_highs=(time_plot_multiplier *
+                                      (totaltimes[calls] + stds[calls])))
+
+    def get_ltimings(self, fun):
+        try:
+            key_label = self.aggregator.lines[join_label(fun)][0]
+        except KeyError:
+            return None
+        return self.lprofile.timings.get(key_label)
+
+    def get_extra_line_columns(self, fun):
+        mins, stds = self.aggregator.line_spread(fun)
+        ltimings = self.get_ltimings(fun) or [None]
+        nhits = {lineno: nhits for lineno, nhits, _ in ltimings[:-1]}
+        linenos = sorted(mins)
+        counts = np.array([nhits.get(lineno, 0) for lineno in linenos],
+                          dtype=np.float64)
+        columns = []
+        for title, times in (('Min', mins), ('Std', stds)):
+            texts = self.format_times(self.display_times(
+                np.array([times[lineno] for lineno in linenos],
+                         dtype=np.float64) * self.line_unit(),
+                counts, self.function_time(fun)))
+            columns.append((title, {lineno: (text, None) for
+                                    lineno, text in zip(linenos, texts)}))
+        return columns
+
+
+class IProfileTasks(IProfile):
+    """
+    Widget showing the task graph of asyncio code, from
+    tasks.TaskProfiler. Each coroutine is called by the coroutine of the
+    task which created its tasks, and its time is split into the time spent
+    running on the CPU and the time spent awaiting.
+    """
+    table_time_titles = ("Total time", "On-CPU time")
+
+    def generate_heading(self, fun):
+        if fun is None:
+            return "<h3>Tasks</h3>"
+        graph = self.cprofile_tree
+        i = graph.index(fun)
+        totaltime = graph.nodes['totaltime'][i]
+        cputime = graph.nodes['inlinetime'][i]
+        heading = ("{} (Tasks: {}, Time: {:.6f}, On-CPU: {:.6f}, "
+                   "Awaiting: {:.6f})")
+        heading = heading.format(graph.name(i), graph.nodes['callcount'][i],
+                                 totaltime, cputime, totaltime - cputime)
+        heading = "<h3>" + html_escape(heading) + "</h3>"
+        if type(fun) != str:
+            heading += ("<p>From file: " +
+                        html_escape(fun.co_filename) + "</p>")
+        return heading
+
+
+class IProfileLive(IProfile):
+    """
+    Widget showing a snapshot of the samples of a live.LiveProfiler, created
+    by live.snapshot(). refresh() updates it with a new snapshot.
+    """
+    def __init__(self, profiler, n_windows=None, **kwargs):
+        self.profiler = profiler
+        self.n_windows = n_windows
+        graph, lprofile, self.duration = profiler.snapshot(n_windows)
+        self.n_samples = profiler.n_samples
+        super(IProfileLive, self).__init__(graph, lprofile, **kwargs)
+
+    def refresh(self):
+        """Update the widget with the samples taken since it was updated."""
+        if self.profiler.n_samples == self.n_samples:
+            return
+        self.n_samples = self.profiler.n_samples
+        graph, lprofile, self.duration = self.profiler.snapshot(
+            self.n_windows)
+        self.update_profile(graph, lprofile)
+
+    def generate_heading(self, fun):
+        if fun is None:
+            return "<h3>Live profile of the last {:.0f} s</h3>".format(
+                self.duration)
+        return super(IProfileLive, self).generate_heading(fun)
+
 
 # Python 2/3 compatibility utils
 # ===========================================================
-PY3 = sys.version_info[0] == 3
-
-# exec (from https://bitbucket.org/gutworth/six/):
-if PY3:
-    import builtins
-    exec_ = getattr(builtins, "exec")
-    del builtins
+if sys.version_info[0] == 3:
     from html import escape as html_escape
 else:
-    def exec_(_code_, _globs_=None, _locs_=None):
-        """Execute code in a namespace."""
-        if _globs_ is None:
-            frame = sys._getframe(1)
-            _globs_ = frame.f_globals
-            if _locs_ is None:
-                _locs_ = frame.f_locals
-            del frame
-        elif _locs_ is None:
-            _locs_ = _globs_
-        exec("""exec _code_ in _globs_, _locs_""")
     from cgi import escape as html_escape
 
 # ============================================================
 
 
-@magics_class
-class IProfilerMagics(Magics):
-    @line_cell_magic
-    def iprofile(self, line, cell=None):
-        import iprofiler._line_profiler as _line_profiler
-        import cProfile
-        cprofiler = cProfile.Profile()
-        lprofiler = _line_profiler.LineProfiler()
-
-        if cell is None:
-            # LINE MAGIC
-            global_ns = self.shell.user_global_ns
-            local_ns = self.shell.user_ns
-
-            lprofiler.enable()
-            cprofiler.enable()
-            exec_(line, global_ns, local_ns)
-            cprofiler.disable()
-            lprofiler.disable()
-
-            lprofile = lprofiler.get_stats()
-            cprofile = cprofiler.getstats()
-
-            iprofile = IProfile(cprofile, lprofile, context="LINE_MAGIC")
-
-            # Note this name *could* clash with a user defined name...
-            # Should find a better solution
-            self.shell.user_ns['_IPROFILE'] = iprofile
-            self.shell.run_cell('_IPROFILE')
-        else:
-            lprofiler.enable()
-            cprofiler.enable()
-            self.shell.run_cell(cell)
-            cprofiler.disable()
-            lprofiler.disable()
-
-            lprofile = lprofiler.get_stats()
-            cprofile = cprofiler.getstats()
-
-            iprofile = IProfile(cprofile, lprofile, context='CELL_MAGIC')
-
-            # Note this name *could* clash with a user defined name...
-            # Should find a better solution
-            self.shell.user_ns['_IPROFILE'] = iprofile
-            self.shell.run_cell('_IPROFILE')
-
-
-def load_ipython_extension(shell):
-    # Initiate bokeh
-    output_notebook(hide_banner=True)
-    shell.register_magics(IProfilerMagics)
+# Whether BokehJS has been loaded into the notebook, see _load_bokeh.
+_bokeh_loaded = False
+
+
+def _load_bokeh():
+    """
+    Load BokehJS into the notebook, once. This is done when the first widget
+    is created, rather than when the extension is loaded, so that loading
+    the extension doesn't inject BokehJS into notebooks which don't use it.
+    """
+    global _bokeh_loaded
+    if not _bokeh_loaded:
+        output_notebook(hide_banner=True)
+        _bokeh_loaded = True
+
+
+def profile_runs(func, params=None, n=1, line_profile=False, timer=None,
+                 calibrate=False, **kwargs):
+    """
+    Profile repeated calls of func, returning an IProfileAggregate widget
+    showing the mean, minimum and standard deviation of the timings. func
+    is called n times, or, for a parameter sweep, n times with each tuple of
+    arguments in params. If line_profile is True then every line is also
+    line profiled. timer and calibrate are as for capture.profile_traced.
+    """
+    aggregator = ProfileAggregator()
+    for args in ([()] if params is None else params):
+        for _ in range(n):
+            lprofiler = None
+            if line_profile:
+                lprofiler = timers.line_profiler(timer)
+            graph, lprofile = capture.profile_traced(lambda: func(*args),
+                                                     lprofiler, timer,
+                                                     calibrate)
+            graph = capture.graph_below(graph,
+                                        getattr(func, '__code__', None))
+            aggregator.add(graph, store.ltimings_by_label(graph, lprofile),
+                           store.timer_unit(lprofile))
+    return IProfileAggregate(aggregator, **kwargs)
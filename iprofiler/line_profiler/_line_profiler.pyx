@@ -1,5 +1,7 @@
 from python25 cimport PyFrameObject, PyObject, PyStringObject
 
+from types import CodeType
+
 
 cdef extern from "frameobject.h":
     ctypedef int (*Py_tracefunc)(object self, PyFrameObject *py_frame, int what, PyObject *arg)
@@ -91,21 +93,36 @@ class LineStats(object):
 
 cdef class LineProfiler:
     """ Time the execution of lines of Python code.
+
+    If no functions are added then every function which is called while the
+    profiler is enabled is profiled. Otherwise only the added functions are.
+
+    By default lines are timed with the high resolution wall clock timer of
+    timers.c. Alternatively timer can be a function returning the time as an
+    integer number of units of timer_unit seconds, such as
+    time.process_time_ns with a timer_unit of 1e-9.
     """
     cdef public list functions
     cdef public dict code_map
     cdef public dict file_map
     cdef public dict last_time
+    cdef public object timer
     cdef public double timer_unit
     cdef public long enable_count
+    cdef public bint trace_all
 
-    def __init__(self, *functions):
+    def __init__(self, *functions, timer=None, timer_unit=None):
         self.functions = []
         self.code_map = {}
         self.file_map = {}
         self.last_time = {}
-        self.timer_unit = hpTimerUnit()
+        self.timer = timer
+        if timer is None:
+            self.timer_unit = hpTimerUnit()
+        else:
+            self.timer_unit = timer_unit
         self.enable_count = 0
+        self.trace_all = True
         for func in functions:
             self.add_function(func)
 
@@ -121,18 +138,41 @@ cdef class LineProfiler:
             return (code.co_filename, code.co_firstlineno, code.co_name)
 
     def add_function(self, func):
-        """ Record line profiling information for the given Python function.
+        """ Record line profiling information for the given Python function,
+        or code object.
         """
-        try:
-            code = func.__code__
-        except AttributeError:
-            import warnings
-            warnings.warn("Could not extract a code object for the object %r" % (func,))
-            return
+        if isinstance(func, CodeType):
+            code = func
+        else:
+            try:
+                code = func.__code__
+            except AttributeError:
+                import warnings
+                warnings.warn("Could not extract a code object for the object %r" % (func,))
+                return
+        self.trace_all = False
         if code not in self.code_map:
             self.code_map[code] = {}
             self.functions.append(func)
 
+    def add_module(self, mod):
+        """ Add all the functions in a module and its classes.
+        """
+        from inspect import isclass, isfunction
+
+        nfuncsadded = 0
+        for item in mod.__dict__.values():
+            if isclass(item):
+                for k, v in item.__dict__.items():
+                    if isfunction(v):
+                        self.add_function(v)
+                        nfuncsadded += 1
+            elif isfunction(item):
+                self.add_function(item)
+                nfuncsadded += 1
+
+        return nfuncsadded
+
     def enable_by_count(self):
         """ Enable the profiler if it hasn't been enabled before.
         """
@@ -167,8 +207,11 @@ cdef class LineProfiler:
         """
         stats = {}
         for code in self.code_map:
-            filename = self.file_map[code]
             entries = self.code_map[code].values()
+            if not entries:
+                # Added, but never called.
+                continue
+            filename = self.file_map[code]
             key = self.label(code)
             stats[key] = [e.astuple() for e in entries]
             stats[key].sort()
@@ -187,6 +230,14 @@ cdef class LastTime:
         self.time = time
 
 
+cdef inline PY_LONG_LONG get_time(LineProfiler self):
+    """ Return the time, in units of self.timer_unit.
+    """
+    if self.timer is None:
+        return hpTimer()
+    return self.timer()
+
+
 cdef int python_trace_callback(object self_, PyFrameObject *py_frame, int what,
     PyObject *arg):
     """ The PyEval_SetTrace() callback.
@@ -201,22 +252,24 @@ cdef int python_trace_callback(object self_, PyFrameObject *py_frame, int what,
     self = <LineProfiler>self_
     last_time = self.last_time
 
-    if what == PyTrace_CALL and <object>py_frame.f_code not in self.code_map:
-        # Set filename to more useful one
-        f_globals = <object>py_frame.f_globals
-        better_fname = <object>f_globals.get('__file__', None)
+    if what == PyTrace_CALL and <object>py_frame.f_code not in self.file_map:
         code = <object>py_frame.f_code
+        if self.trace_all or code in self.code_map:
+            # Set filename to more useful one
+            f_globals = <object>py_frame.f_globals
+            better_fname = <object>f_globals.get('__file__', None)
 
-        if better_fname is None:
-            better_fname = code.co_filename
+            if better_fname is None:
+                better_fname = code.co_filename
 
-        self.code_map[code] = {}
-        self.file_map[code] = better_fname
+            if code not in self.code_map:
+                self.code_map[code] = {}
+            self.file_map[code] = better_fname
 
     if what == PyTrace_LINE or what == PyTrace_RETURN:
         code = <object>py_frame.f_code
         if code in self.code_map:
-            time = hpTimer()
+            time = get_time(self)
             if code in last_time:
                 old = last_time[code]
                 line_entries = self.code_map[code]
@@ -230,7 +283,7 @@ cdef int python_trace_callback(object self_, PyFrameObject *py_frame, int what,
             if what == PyTrace_LINE:
                 # Get the time again. This way, we don't record much time wasted
                 # in this function.
-                last_time[code] = LastTime(py_frame.f_lineno, hpTimer())
+                last_time[code] = LastTime(py_frame.f_lineno, get_time(self))
             else:
                 # We are returning from a function, not executing a line. Delete
                 # the last_time record. It may have already been deleted if we
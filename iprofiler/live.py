@@ -0,0 +1,230 @@
+"""
+Continuous profiling of long running code, such as a training or serving
+loop, with widgets which update while it runs.
+"""
+from __future__ import absolute_import, division
+
+import sys
+import threading
+import traceback
+from collections import deque, namedtuple
+from timeit import default_timer
+
+from .callgraph import CallGraph
+from .sampler import Sampler, line_stats
+
+# The samples of a window of time, as the functions, calls and lines dicts of
+# a Sampler.
+_Window = namedtuple('_Window', ['start', 'end', 'functions', 'calls',
+                                 'lines'])
+
+# The profiler started by start(), and the thread which refreshes the live
+# widgets returned by snapshot().
+_profiler = None
+_refresher = None
+
+
+class LiveProfiler(Sampler):
+    """
+    Statistical profiler which runs until it is stopped. The samples are
+    collected into windows of `window` seconds, of which only the last
+    `n_windows` are kept, so memory use doesn't grow with the time spent
+    profiling.
+
+    Unlike Sampler, the whole call stack of the profiled thread is recorded,
+    so code which is started after the profiler is profiled too.
+    snapshot() can be called from any thread while the profiler runs.
+    """
+    def __init__(self, interval=0.005, window=10., n_windows=30):
+        super(LiveProfiler, self).__init__(interval)
+        self.window = window
+        self.windows = deque(maxlen=n_windows)
+        # Every function sampled so far, in the order in which they were
+        # first seen, so that function ids are the same in every snapshot.
+        self.keys = []
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self.n_samples = 0
+
+    def start(self, thread=None):
+        """Start sampling thread, by default the calling thread."""
+        thread = thread or threading.current_thread()
+        self._window_start = default_timer()
+        self._start(thread.ident, None)
+
+    def stop(self):
+        self.disable()
+        self._rotate(default_timer())
+
+    def _run(self):
+        last_time = default_timer()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            time = default_timer()
+            if frame is not None:
+                self._sample(frame, time - last_time)
+            last_time = time
+            del frame
+            if time - self._window_start >= self.window:
+                self._rotate(time)
+
+    def _sample(self, frame, dt):
+        with self._lock:
+            self.n_samples += 1
+            super(LiveProfiler, self)._sample(frame, dt)
+
+    def _rotate(self, time):
+        """Start a new window at time."""
+        with self._lock:
+            self.windows.append(_Window(self._window_start, time,
+                                        self.functions, self.calls,
+                                        self.lines))
+            self.functions = {}
+            self.calls = {}
+            self.lines = {}
+            self._window_start = time
+
+    def snapshot(self, n_windows=None):
+        """
+        Return the call graph and line timings (as a LineStats object) of
+        the last n_windows windows, by default all those kept, and of the
+        current window, and the time in seconds which they cover. The call
+        graph has every function sampled so far, in a fixed order, so that
+        each snapshot extends the previous one.
+        """
+        with self._lock:
+            windows = list(self.windows)
+            if n_windows is not None:
+                windows = windows[max(0, len(windows) - n_windows):]
+            now = default_timer()
+            # Copy the current window, as the sampler changes it.
+            windows.append(_Window(
+                self._window_start, now,
+                {code: list(stats) for code, stats in self.functions.items()},
+                {call: list(stats) for call, stats in self.calls.items()},
+                {line: list(stats) for line, stats in self.lines.items()}))
+            file_map = dict(self.file_map)
+
+        with self._snapshot_lock:
+            node_ids = []
+            node_rows = []
+            src = []
+            dst = []
+            edge_rows = []
+            lines = {}
+            for window in windows:
+                for code, stats in window.functions.items():
+                    node_ids.append(self._intern(code))
+                    node_rows.append(stats)
+                for (caller, callee), stats in window.calls.items():
+                    src.append(self._intern(caller))
+                    dst.append(self._intern(callee))
+                    edge_rows.append(stats)
+                for line, (nhits, time) in window.lines.items():
+                    total = lines.setdefault(line, [0, 0.])
+                    total[0] += nhits
+                    total[1] += time
+            graph = CallGraph.from_edges(list(self.keys), node_ids, node_rows,
+                                         src, dst, edge_rows)
+        return (graph, line_stats(lines, file_map, self.unit),
+                now - windows[0].start)
+
+    def _intern(self, code):
+        try:
+            return self._ids[code]
+        except KeyError:
+            self._ids[code] = len(self.keys)
+            self.keys.append(code)
+            return self._ids[code]
+
+
+class _Refresher(object):
+    """
+    Background thread which refreshes live widgets every `refresh` seconds,
+    backing off so that refreshing takes at most `max_overhead` of the time.
+    A widget whose refresh fails is no longer refreshed, and the error is
+    written to stderr (which the notebook shows), so that neither the thread
+    nor the other widgets stop.
+    """
+    def __init__(self, refresh, max_overhead):
+        self.refresh = refresh
+        self.max_overhead = max_overhead
+        self.widgets = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        delay = self.refresh
+        while not self._stop.wait(delay):
+            start = default_timer()
+            for widget in list(self.widgets):
+                if widget.comm is None:
+                    # The widget has been closed.
+                    self.widgets.remove(widget)
+                    continue
+                try:
+                    widget.refresh()
+                except Exception:
+                    self.widgets.remove(widget)
+                    sys.stderr.write("Stopped refreshing a live profile "
+                                     "widget, which failed with:\n" +
+                                     traceback.format_exc())
+            cost = default_timer() - start
+            delay = max(self.refresh, cost / self.max_overhead - cost)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def start(interval=0.005, window=10., n_windows=30, thread=None,
+          refresh=1., max_overhead=0.02):
+    """
+    Start profiling thread (by default the calling thread) in the
+    background, until stop() is called. Samples are taken every `interval`
+    seconds, and only those of the last n_windows windows of `window`
+    seconds are kept.
+
+    Live widgets returned by snapshot() are refreshed every `refresh`
+    seconds, or less often if refreshing would otherwise take more than the
+    fraction `max_overhead` of the time.
+
+    Returns the LiveProfiler.
+    """
+    global _profiler, _refresher
+    if _profiler is not None:
+        raise RuntimeError("Profiling has already been started.")
+    _profiler = LiveProfiler(interval, window, n_windows)
+    _profiler.start(thread)
+    _refresher = _Refresher(refresh, max_overhead)
+    return _profiler
+
+
+def snapshot(n_windows=None, live=True):
+    """
+    Return a widget showing the profile of the last n_windows windows (by
+    default all those kept) since start(). If live is True then the widget
+    is refreshed until stop() is called.
+    """
+    from .iprofiler import IProfileLive
+
+    if _profiler is None:
+        raise RuntimeError("Profiling hasn't been started, see start().")
+    widget = IProfileLive(_profiler, n_windows)
+    if live:
+        _refresher.widgets.append(widget)
+    return widget
+
+
+def stop():
+    """Stop the profiling started by start(), and refreshing widgets."""
+    global _profiler, _refresher
+    if _refresher is not None:
+        _refresher.stop()
+        _refresher = None
+    if _profiler is not None:
+        _profiler.stop()
+        _profiler = None
@@ -0,0 +1,439 @@
+"""
+The %iprofile magic. This module only needs IPython, which is already
+imported when the extension is loaded, so that "%load_ext iprofiler" is
+fast: the profilers, the widgets, ipywidgets and Bokeh are imported when
+%iprofile is first run.
+"""
+from __future__ import absolute_import
+
+import ast
+import inspect
+import sys
+import types
+
+from IPython.core.magic import (Magics, magics_class, line_cell_magic)
+from IPython.core.error import UsageError
+
+# Python 2/3 compatibility utils
+# ===========================================================
+PY3 = sys.version_info[0] == 3
+
+# exec (from https://bitbucket.org/gutworth/six/):
+if PY3:
+    import builtins
+    exec_ = getattr(builtins, "exec")
+    del builtins
+else:
+    def exec_(_code_, _globs_=None, _locs_=None):
+        """Execute code in a namespace."""
+        if _globs_ is None:
+            frame = sys._getframe(1)
+            _globs_ = frame.f_globals
+            if _locs_ is None:
+                _locs_ = frame.f_locals
+            del frame
+        elif _locs_ is None:
+            _locs_ = _globs_
+        exec("""exec _code_ in _globs_, _locs_""")
+
+# ============================================================
+
+
+def _compile_async(source):
+    """
+    Return source compiled as a coroutine if it uses top-level await (which
+    needs Python 3.8+), or else None.
+    """
+    flag = getattr(ast, 'PyCF_ALLOW_TOP_LEVEL_AWAIT', None)
+    if flag is None:
+        return None
+    try:
+        code = compile(source, '<iprofile>', 'exec', flag)
+    except SyntaxError:
+        return None
+    return code if code.co_flags & inspect.CO_COROUTINE else None
+
+
+def _top_code_objects(graph, n):
+    """
+    Return the code objects of the (at most) n functions in graph with the
+    largest total time, skipping built-ins and merged code objects.
+    """
+    import numpy as np
+
+    order = np.argsort(-graph.nodes['totaltime'], kind='mergesort')
+    codes = [graph.keys[i] for i in order if
+             isinstance(graph.keys[i], types.CodeType)]
+    return codes[:n]
+
+
+@magics_class
+class IProfilerMagics(Magics):
+    @line_cell_magic
+    def iprofile(self, line, cell=None):
+        """
+        Profile a statement, or a cell, and display the results in an
+        interactive widget.
+
+        Usage, in line mode:
+          %iprofile [options] statement
+
+        Usage, in cell mode:
+          %%iprofile [options]
+          code...
+
+        By default only cProfile is used. Line by line timings, which add
+        tracing overhead to every line that is profiled, can be recorded with
+        the options:
+
+        -l: line profile every function which is called.
+
+        -f <function>: line profile the given function. May be repeated.
+
+        -m <module>: line profile every function in the given module. May be
+        repeated.
+
+        -t <N>: after profiling, run the statement a second time, line
+        profiling only the N functions with the largest total time.
+
+        Alternatively, for long running code, a statistical profiler with a
+        much lower overhead can be used instead of cProfile:
+
+        --sample: sample the call stack periodically, rather than tracing
+        every call. Line timings are recorded for every function.
+
+        -i <interval>: the sampling interval in seconds (default 0.005).
+
+        To choose what is timed, and correct for the overhead of tracing:
+
+        --timer=<timer>: time functions and lines, including those of the
+        threads profiled with --threads, with the given timer: wall (the
+        wall clock time), process (the CPU time of the process) or thread
+        (the CPU time of the thread). By default the profilers' own wall
+        clock timers are used. Needs Python 3.7+.
+
+        --calibrate: measure the overhead which tracing adds to each call
+        and line (once per timer), and subtract it from the inline times of
+        functions and from the line timings. Total times aren't changed.
+
+        To reduce noise:
+
+        -n <N>: run the statement N times, and show the mean of the timings,
+        with error bars of one standard deviation. The minimum and standard
+        deviation of each line's time are shown next to the line timings.
+
+        To profile the worker processes of multiprocessing pools and
+        concurrent.futures process pool executors:
+
+        --processes: profile each task run by a worker process (with
+        cProfile). Each worker is shown as a root function, calling the
+        tasks it ran, and the times of functions are totals over all
+        processes.
+
+        --threads: profile each thread started by the statement (with
+        cProfile), and record the wall and CPU time of each thread. The
+        threads can be viewed separately or combined. Threads are only
+        included once they have finished. From Python 3.12, which allows
+        only one active cProfile profiler, the calls of threads are recorded
+        in the profile of the main thread, and only their times separately.
+
+        To see where memory is allocated:
+
+        --memory: trace memory allocations with tracemalloc, which slows
+        down the statement. The table shows the peak memory held by each
+        function's lines, and the memory and number of blocks they still
+        held at the end, and the peak memory held by each line is shown
+        next to the line timings. Peaks are sampled every 0.1 seconds, so
+        memory which is allocated and freed in between isn't counted.
+
+        To see what changed since an earlier run:
+
+        --compare=<profile>: compare with the given profile, an expression
+        evaluating to an IProfile (e.g. a saved copy of _IPROFILE) or to the
+        path of a saved profile. The new profile itself is
+        _IPROFILE.profiles[1].
+
+        To open the profile in other tools:
+
+        --export=<path>: write the call graph and line timings to path,
+        instead of displaying them, for speedscope if path ends with
+        .speedscope.json, or for Chrome's trace viewer and Perfetto if it
+        ends with .trace.json. No widget is created.
+        """
+        opts, line = self.parse_options(line, 'lf:m:t:i:n:', 'sample',
+                                        'processes', 'threads', 'memory',
+                                        'timer=', 'calibrate', 'compare=',
+                                        'export=', list_all=True,
+                                        posix=False)
+        from . import export
+
+        global_ns = self.shell.user_global_ns
+        local_ns = self.shell.user_ns
+
+        if cell is None:
+            # LINE MAGIC
+            context = "LINE_MAGIC"
+
+            def run():
+                exec_(line, global_ns, local_ns)
+        else:
+            context = "CELL_MAGIC"
+
+            def run():
+                self.shell.run_cell(cell)
+
+        export_path = opts.get('export', [None])[-1]
+        if export_path is not None:
+            if export.format_for_path(export_path) is None:
+                raise UsageError("--export expects a path ending with "
+                                 ".speedscope.json or .trace.json, got {!r}."
+                                 .format(export_path))
+            if 'compare' in opts:
+                raise UsageError("--export can't be combined with "
+                                 "--compare.")
+
+        reference = None
+        if 'compare' in opts:
+            from .iprofiler import IProfile
+
+            name = opts['compare'][-1]
+            try:
+                reference = eval(name, global_ns, local_ns)
+            except Exception as e:
+                raise UsageError("Could not find profile {!r}.\n{}: {}"
+                                 .format(name, e.__class__.__name__, e))
+            if not isinstance(reference, (IProfile, str)):
+                raise UsageError("--compare expects an IProfile or a path, "
+                                 "got {!r}.".format(reference))
+
+        if cell is None:
+            async_code = _compile_async(line)
+        else:
+            async_code = _compile_async(self.shell.transform_cell(cell))
+        if async_code is not None:
+            iprofile = self._profile_tasks(async_code, opts)
+        else:
+            iprofile = self._profile(run, opts, context, export_path)
+        if iprofile is None:
+            print("Profile exported to {}".format(export_path))
+            return
+        if reference is not None:
+            iprofile = IProfile.diff(reference, iprofile)
+
+        # Note this name *could* clash with a user defined name...
+        # Should find a better solution
+        self.shell.user_ns['_IPROFILE'] = iprofile
+        self.shell.run_cell('_IPROFILE')
+
+    def _profile(self, run, opts, context, export_path=None):
+        """
+        Profile run() as set by the options, returning an IProfile, or else
+        writing the profile to export_path (see export.write_profile) and
+        returning None, in which case the widgets aren't imported.
+        """
+        from .aggregate import ProfileAggregator
+        from .parallel import ProcessProfiler
+        from .threads import ThreadProfiler, combine_threads
+        from . import export, store, timers
+
+        n_runs = 1
+        if 'n' in opts:
+            try:
+                n_runs = int(opts['n'][-1])
+            except ValueError:
+                raise UsageError("-n expects an integer, got {!r}."
+                                 .format(opts['n'][-1]))
+            if n_runs < 1:
+                raise UsageError("-n expects a positive integer.")
+        if n_runs > 1 and 'memory' in opts:
+            raise UsageError("--memory can't be combined with -n.")
+        timer = opts.get('timer', [None])[-1]
+        if timer is not None:
+            try:
+                timers.get_timer(timer)
+            except ValueError as e:
+                raise UsageError(str(e))
+        if 'sample' in opts and ('timer' in opts or 'calibrate' in opts):
+            raise UsageError("--sample can't be combined with --timer or "
+                             "--calibrate.")
+
+        # Profilers of the other threads and processes used by the
+        # statement, which are enabled while it runs.
+        process_profiler = None
+        if 'processes' in opts:
+            process_profiler = ProcessProfiler()
+        thread_profiler = None
+        if 'threads' in opts:
+            thread_profiler = ThreadProfiler(
+                timer, timers.calibrate(timer) if 'calibrate' in opts else
+                None)
+        memory_profiler = None
+        if 'memory' in opts:
+            try:
+                from .memory import MemoryProfiler
+            except ImportError:
+                raise UsageError("--memory needs tracemalloc (Python 3.4+).")
+            memory_profiler = MemoryProfiler()
+        # The memory profiler is enabled first, so that its own thread isn't
+        # profiled. The second pass of -t runs the bare statement, so that
+        # their results from the first pass are kept.
+        statement = run
+        other_profilers = [profiler for profiler in
+                           (memory_profiler, process_profiler,
+                            thread_profiler) if
+                           profiler is not None]
+        if other_profilers:
+            run_statement = run
+
+            def run():
+                for profiler in other_profilers:
+                    profiler.enable()
+                try:
+                    run_statement()
+                finally:
+                    for profiler in reversed(other_profilers):
+                        profiler.disable()
+
+        def profile():
+            """Return the call graph, line timings and threads of a run."""
+            if 'sample' in opts:
+                graph, lprofile = self._profile_sampled(run, opts, context)
+            else:
+                graph, lprofile = self._profile_traced(run, opts, context,
+                                                       statement)
+            threads = None
+            if thread_profiler is not None:
+                threads = thread_profiler.threads(graph)
+                graph = combine_threads(threads)
+            if process_profiler is not None:
+                graph = process_profiler.add_workers(graph)
+            if memory_profiler is not None:
+                for thread in threads or []:
+                    memory_profiler.add_columns(thread.graph)
+                memory_profiler.add_columns(graph)
+            return graph, lprofile, threads
+
+        if n_runs == 1:
+            graph, lprofile, threads = profile()
+        else:
+            # Only the running statistics of the runs are kept.
+            aggregator = ProfileAggregator()
+            for _ in range(n_runs):
+                graph, lprofile, _ = profile()
+                aggregator.add(graph, store.ltimings_by_label(graph, lprofile),
+                               store.timer_unit(lprofile))
+
+        if export_path is not None:
+            if n_runs > 1:
+                graph, lprofile = aggregator.graph(), aggregator.line_stats()
+            export.write_profile(
+                export_path, graph,
+                lambda key: store.merged_ltimings(lprofile, key),
+                store.timer_unit(lprofile))
+            return None
+
+        from .iprofiler import IProfile, IProfileAggregate
+
+        if n_runs == 1:
+            return IProfile(graph, lprofile, threads=threads,
+                            memory=memory_profiler)
+        return IProfileAggregate(aggregator)
+
+    def _profile_tasks(self, code, opts):
+        """
+        Profile code, compiled from a statement with top-level await, at
+        the level of asyncio tasks, returning an IProfileTasks.
+        """
+        if set(opts) - {'compare'}:
+            raise UsageError("Statements using await can only be combined "
+                             "with the --compare option.")
+        from .iprofiler import IProfileTasks
+        from .tasks import profile_coroutine
+
+        coro = eval(code, self.shell.user_global_ns, self.shell.user_ns)
+        return IProfileTasks(profile_coroutine(coro))
+
+    def _profile_sampled(self, run, opts, context):
+        """
+        Profile run() using the statistical profiler, returning the call
+        graph and line timings.
+        """
+        from .callgraph import prune_top_level
+        from . import capture
+
+        if 'l' in opts or 'f' in opts or 'm' in opts or 't' in opts:
+            raise UsageError("--sample can't be combined with the line "
+                             "profiling options.")
+        try:
+            interval = float(opts.get('i', [0.005])[-1])
+        except ValueError:
+            raise UsageError("-i expects a number of seconds, got {!r}."
+                             .format(opts['i'][-1]))
+        graph, lprofile = capture.profile_sampled(run, interval)
+        return prune_top_level(graph, context), lprofile
+
+    def _profile_traced(self, run, opts, context, rerun=None):
+        """
+        Profile run() using cProfile and, optionally, the line profiler,
+        returning the call graph and line timings. The second pass of -t
+        calls rerun(), by default run().
+        """
+        from .callgraph import prune_top_level
+        from . import capture, timers
+
+        global_ns = self.shell.user_global_ns
+        local_ns = self.shell.user_ns
+        timer = opts.get('timer', [None])[-1]
+        calibrate = 'calibrate' in opts
+
+        n_top = None
+        if 't' in opts:
+            try:
+                n_top = int(opts['t'][-1])
+            except ValueError:
+                raise UsageError("-t expects an integer, got {!r}."
+                                 .format(opts['t'][-1]))
+            if n_top < 1:
+                raise UsageError("-t expects a positive integer.")
+
+        lprofiler = None
+        if 'l' in opts or 'f' in opts or 'm' in opts:
+            lprofiler = timers.line_profiler(timer)
+        for name in opts.get('f', []):
+            try:
+                lprofiler.add_function(eval(name, global_ns, local_ns))
+            except Exception as e:
+                raise UsageError("Could not find function {!r}.\n{}: {}"
+                                 .format(name, e.__class__.__name__, e))
+        for name in opts.get('m', []):
+            try:
+                __import__(name)
+                lprofiler.add_module(sys.modules[name])
+            except Exception as e:
+                raise UsageError("Could not find module {!r}.\n{}: {}"
+                                 .format(name, e.__class__.__name__, e))
+
+        graph, lprofile = capture.profile_traced(run, lprofiler, timer,
+                                                 calibrate)
+        graph = prune_top_level(graph, context)
+
+        if n_top is not None:
+            # Second pass, line profiling only the hottest functions. Note
+            # that functions are matched by code object, so functions which
+            # are redefined by the statement itself won't be line profiled.
+            codes = _top_code_objects(graph, n_top)
+            if codes:
+                lprofiler = timers.line_profiler(timer, codes)
+                lprofiler.enable()
+                (rerun or run)()
+                lprofiler.disable()
+                lprofile = lprofiler.get_stats()
+                if calibrate:
+                    timers.subtract_overhead(timers.calibrate(timer),
+                                             lprofile=lprofile)
+
+        return graph, lprofile
+
+
+def load_ipython_extension(shell):
+    shell.register_magics(IProfilerMagics)
@@ -0,0 +1,156 @@
+"""
+Memory allocation profiling with tracemalloc.
+"""
+from __future__ import absolute_import
+
+import dis
+import threading
+import tracemalloc
+import types
+
+import numpy as np
+
+from .callgraph import MergedCode, label
+
+# Node columns added to call graphs by MemoryProfiler.add_columns.
+MEMORY_COLUMNS = ('mem_peak', 'mem_size', 'mem_count')
+
+
+class MemoryProfiler(object):
+    """
+    Between calls to enable() and disable(), memory allocations are traced
+    with tracemalloc. A background thread takes a snapshot every `interval`
+    seconds, recording the peak memory held by each line at the times of
+    the snapshots, and the memory (and number of blocks) still held by each
+    line when the profiler is disabled.
+
+    Per line peaks are only as good as the sampling: memory which is
+    allocated and freed between two snapshots isn't seen, however large.
+    The overall peak (self.peak) is tracemalloc's own, which is exact.
+    Counts are of the blocks retained, not of all the allocations made.
+
+    Memory which was allocated before enable() is ignored. Only the line
+    which directly made each allocation is recorded.
+    """
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        # Per (filename, lineno), [peak size held at a snapshot, size and
+        # count of blocks retained at the end], in bytes and blocks.
+        self.lines = {}
+        # The lines of each function, keyed by label, see add_columns.
+        self.functions = {}
+        # Peak of the total memory allocated, in bytes.
+        self.peak = 0
+        self._thread = None
+
+    def enable(self):
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        self._baseline = self._take_snapshot()
+        self._baseline_size = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.lines = {}
+        self.functions = {}
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        # The peak is read before the snapshot, which itself takes memory.
+        self.peak = max(self.peak,
+                        tracemalloc.get_traced_memory()[1] -
+                        self._baseline_size)
+        self._record(final=True)
+        self._baseline = None
+        if self._started:
+            tracemalloc.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._record()
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, threading.__file__)])
+
+    def _record(self, final=False):
+        snapshot = self._take_snapshot()
+        total = 0
+        for stat in snapshot.compare_to(self._baseline, 'lineno'):
+            frame = stat.traceback[0]
+            line = self.lines.setdefault((frame.filename, frame.lineno),
+                                         [0, 0, 0])
+            line[0] = max(line[0], stat.size_diff)
+            if final:
+                line[1] = stat.size_diff
+                line[2] = stat.count_diff
+            total += stat.size_diff
+        self.peak = max(self.peak, total)
+
+    def add_columns(self, graph):
+        """
+        Add the node columns in MEMORY_COLUMNS to graph, with the totals of
+        the lines of each function: the sum of the peak memory held by each
+        line at the snapshots (an upper bound on the sampled peak of the
+        function), and the memory and number of blocks still held at the
+        end. The lines of each function are recorded in self.functions,
+        which maps its label to a dict of (peak size, size, count) by line
+        number.
+
+        Allocations aren't recorded per thread, so if graph is the profile
+        of one of several threads which ran the same function, the function
+        gets the allocations of all of them.
+        """
+        line_keys = _line_keys(graph)
+        ids = []
+        values = []
+        for line, stats in self.lines.items():
+            i = line_keys.get(line)
+            if i is None:
+                continue
+            ids.append(i)
+            values.append(stats)
+            lines = self.functions.setdefault(label(graph.keys[i]), {})
+            lines[line[1]] = tuple(stats)
+        ids = np.array(ids, dtype=np.intp)
+        values = np.array(values, dtype=np.int64).reshape(-1, 3)
+        for k, column in enumerate(MEMORY_COLUMNS):
+            graph.nodes[column] = np.zeros(len(graph), dtype=np.int64)
+            np.add.at(graph.nodes[column], ids, values[:, k])
+
+
+def _line_keys(graph):
+    """
+    Return a dict mapping the (filename, lineno) of each line of the
+    functions in graph to the function's id. Functions without code objects
+    (built-ins, and functions of loaded profiles) have no lines. A line
+    which is in several functions, such as a line with a comprehension, is
+    given to the function spanning the fewest lines, which is the innermost.
+    """
+    line_keys = {}
+    spans = {}
+    for i, key in enumerate(graph.keys):
+        codes = key.codes if isinstance(key, MergedCode) else [key]
+        for code in codes:
+            if not isinstance(code, types.CodeType):
+                continue
+            linenos = [lineno for _, lineno in dis.findlinestarts(code) if
+                       lineno is not None]
+            if not linenos:
+                continue
+            span = max(linenos) - min(linenos)
+            for lineno in linenos:
+                line = (code.co_filename, lineno)
+                if span < spans.get(line, span + 1):
+                    line_keys[line] = i
+                    spans[line] = span
+    return line_keys
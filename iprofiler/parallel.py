@@ -0,0 +1,158 @@
+"""
+Profiling of tasks run in the worker processes of multiprocessing pools and
+concurrent.futures process pool executors.
+"""
+from __future__ import absolute_import
+
+import cProfile
+import functools
+import glob
+import marshal
+import multiprocessing
+import multiprocessing.pool
+import os
+import pstats
+import shutil
+import tempfile
+
+try:
+    import concurrent.futures
+except ImportError:
+    # Python 2
+    concurrent = None
+
+from .callgraph import CallGraph, PROFILER_DISABLE_KEY, add_root, combine
+
+class _ProfiledCall(object):
+    """
+    Picklable wrapper of a task function, which profiles it in the worker
+    process. The stats of each task are appended to a file of the worker in
+    `directory` as soon as the task ends, so that they are on disk when the
+    profiled statement ends, even if the pool outlives it or terminates its
+    workers. Only the task's own stats are written, so the cost of writing
+    them is in proportion to the task. Once the directory has been removed,
+    by ProcessProfiler.disable, tasks are no longer recorded.
+    """
+    def __init__(self, func, directory):
+        self.func = func
+        self.directory = directory
+
+    def __call__(self, *args, **kwargs):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _append_stats(self.directory, profiler)
+
+
+def _append_stats(directory, profiler):
+    if not os.path.isdir(directory):
+        return
+    profiler.create_stats()
+    path = os.path.join(directory, "{}-{}.pstats".format(
+        multiprocessing.current_process().name, os.getpid()))
+    try:
+        with open(path, 'ab') as f:
+            marshal.dump(profiler.stats, f)
+    except (IOError, OSError):
+        # The directory was removed meanwhile.
+        pass
+
+
+def _load_stats(path):
+    """
+    Return the sum of the stats of the tasks appended to path by
+    _append_stats, as a pstats stats dict.
+    """
+    stats = {}
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                task_stats = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                # The end of the file, or of the stats which were being
+                # written when it was read.
+                break
+            for func, func_stats in task_stats.items():
+                if func in stats:
+                    func_stats = pstats.add_func_stats(stats[func],
+                                                       func_stats)
+                stats[func] = func_stats
+    return stats
+
+
+class ProcessProfiler(object):
+    """
+    Between calls to enable() and disable(), tasks submitted to
+    multiprocessing pools (other than thread pools) and to process pool
+    executors are profiled in the worker processes. This works by wrapping
+    the task functions, so they must be picklable (or the pool must fork).
+
+    After disable(), add_workers() adds the profiles of the workers to a call
+    graph.
+    """
+    def __init__(self):
+        self.directory = None
+        self.worker_graphs = []
+        self._originals = []
+
+    def enable(self):
+        self.directory = tempfile.mkdtemp(prefix='iprofiler-')
+        for cls, name in _task_methods():
+            method = cls.__dict__[name]
+            self._originals.append((cls, name, method))
+            setattr(cls, name, _profiled_method(method, self.directory))
+
+    def disable(self):
+        for cls, name, method in reversed(self._originals):
+            setattr(cls, name, method)
+        self._originals = []
+        self.worker_graphs = []
+        for path in sorted(glob.glob(os.path.join(self.directory,
+                                                  '*.pstats'))):
+            worker = os.path.basename(path)[:-len('.pstats')]
+            self.worker_graphs.append(
+                (worker, CallGraph.from_pstats(_load_stats(path))))
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
+
+    def add_workers(self, graph):
+        """
+        Return graph combined with the profiles of the workers. Each worker
+        gets a root function, named after the worker process, whose callees
+        are the tasks run by that worker. Functions which were called by the
+        workers (or in graph) are merged, so their times are totals over all
+        processes.
+        """
+        return combine([graph] + [add_root(worker_graph,
+                                           "<worker {}>".format(worker),
+                                           exclude=[PROFILER_DISABLE_KEY])
+                                  for worker, worker_graph in
+                                  self.worker_graphs])
+
+
+def _task_methods():
+    """
+    Return the (class, method name) pairs of the methods through which tasks
+    are submitted to process pools. The first argument of each is the task
+    function.
+    """
+    # Pool.map, starmap and their async versions go through _map_async, and
+    # Pool.apply through apply_async. Executor.map goes through submit.
+    methods = [(multiprocessing.pool.Pool, name) for
+               name in ('apply_async', '_map_async', 'imap', 'imap_unordered')]
+    if concurrent is not None:
+        methods.append((concurrent.futures.ProcessPoolExecutor, 'submit'))
+    return methods
+
+
+def _profiled_method(method, directory):
+    @functools.wraps(method)
+    def wrapper(self, func, *args, **kwargs):
+        if isinstance(self, multiprocessing.pool.ThreadPool):
+            # The tasks run in this process, and are already profiled.
+            return method(self, func, *args, **kwargs)
+        return method(self, _ProfiledCall(func, directory), *args, **kwargs)
+    return wrapper
@@ -0,0 +1,214 @@
+"""
+Self-contained static HTML reports of profiles, which can be viewed in any
+browser, without Jupyter.
+"""
+from __future__ import absolute_import
+
+import io
+import json
+
+from .formatter import format_lprofile
+from .store import merged_ltimings
+
+
+def write_html(path, graph, lprofile=None, title="Profile"):
+    """
+    Write an HTML report of a CallGraph, and optionally line timings, to
+    path. Like the widget, the report has a summary page and a page for each
+    function, with a table of the functions it calls and its line profile,
+    and navigation between them. The data and the rendered line profiles are
+    embedded in the page.
+    """
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(render_html(graph, lprofile, title))
+
+
+def render_html(graph, lprofile=None, title="Profile"):
+    """Return the HTML of the report written by write_html."""
+    nodes = graph.nodes
+    unit = 1e-6 if lprofile is None else lprofile.unit
+    lines = {}
+    for i, key in enumerate(graph.keys):
+        if type(key) == str:
+            continue
+        ltimings = merged_ltimings(lprofile, key)
+        if ltimings is not None:
+            lines[i] = format_lprofile(key.co_firstlineno, ltimings,
+                                       unit=unit)
+    data = {
+        'names': [graph.name(i) for i in range(len(graph))],
+        'files': [getattr(key, 'co_filename', '') for key in graph.keys],
+        'callcounts': nodes['callcount'].tolist(),
+        'totaltimes': nodes['totaltime'].tolist(),
+        'inlinetimes': nodes['inlinetime'].tolist(),
+        'children': [graph.children(i).tolist() for i in range(len(graph))],
+        'lines': lines,
+    }
+    # Stop the data from closing the script element.
+    data = json.dumps(data).replace('</', '<\\/')
+    return (_TEMPLATE.replace('__TITLE__', _escape(title))
+            .replace('__DATA__', data))
+
+
+def _escape(text):
+    return (text.replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;'))
+
+
+_TEMPLATE = u"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { font-family: sans-serif; font-size: 13px; margin: 1em; }
+#nav a { cursor: pointer; margin-right: 1em; color: #1a5fb4; }
+#nav a.inactive { cursor: default; color: #999; }
+table { border-collapse: collapse; margin: 1em 0; }
+th { cursor: pointer; text-align: left; border-bottom: 1px solid #999; }
+th, td { padding: 2px 10px; }
+td.number { text-align: right; font-family: monospace; }
+td a { cursor: pointer; color: #1a5fb4; }
+.plot { display: inline-block; height: 10px; }
+pre { font-size: 12px; }
+</style>
+</head>
+<body>
+<div id="nav">
+<a id="home">Home</a><a id="back">Back</a><a id="forward">Forward</a>
+</div>
+<div id="heading"></div>
+<table id="table"></table>
+<div id="lprofile"></div>
+<script>
+var data = __DATA__;
+var backward = [null];
+var forward = [];
+var sort = 'totaltimes';
+
+function node(tag, text, attributes) {
+  var element = document.createElement(tag);
+  if (text !== undefined) {
+    element.textContent = text;
+  }
+  for (var name in attributes || {}) {
+    element.setAttribute(name, attributes[name]);
+  }
+  return element;
+}
+
+function show() {
+  var fun = backward[backward.length - 1];
+  var heading = document.getElementById('heading');
+  heading.innerHTML = '';
+  if (fun === null) {
+    heading.appendChild(node('h3', 'Summary'));
+  } else {
+    heading.appendChild(node('h3', data.names[fun] + ' (Calls: ' +
+                                   data.callcounts[fun] + ', Time: ' +
+                                   data.totaltimes[fun].toFixed(6) + ')'));
+    if (data.files[fun]) {
+      heading.appendChild(node('p', 'From file: ' + data.files[fun]));
+    }
+  }
+  show_table(fun);
+  document.getElementById('lprofile').innerHTML =
+    fun === null ? '' : (data.lines[fun] || '');
+  document.getElementById('home').className = fun === null ? 'inactive' : '';
+  document.getElementById('back').className =
+    backward.length > 1 ? '' : 'inactive';
+  document.getElementById('forward').className =
+    forward.length ? '' : 'inactive';
+}
+
+function show_table(fun) {
+  var rows = [];
+  if (fun === null) {
+    for (var i = 0; i < data.names.length; i++) {
+      rows.push(i);
+    }
+  } else {
+    rows = data.children[fun].slice();
+  }
+  if (sort === 'names') {
+    rows.sort(function(a, b) {
+      var first = data.names[a], second = data.names[b];
+      return first < second ? -1 : first > second ? 1 : 0;
+    });
+  } else {
+    rows.sort(function(a, b) { return data[sort][b] - data[sort][a]; });
+  }
+  var max_time = 0;
+  rows.forEach(function(i) {
+    max_time = Math.max(max_time, data.totaltimes[i]);
+  });
+
+  var table = document.getElementById('table');
+  table.innerHTML = '';
+  var header = node('tr');
+  [['names', 'Function'], ['callcounts', 'Calls'],
+   ['totaltimes', 'Total time (s)'], ['inlinetimes', 'Inline time (s)'],
+   [null, 'Time plot']].forEach(function(column) {
+    var th = node('th', column[1]);
+    if (column[0] !== null) {
+      th.onclick = function() { sort = column[0]; show(); };
+    }
+    header.appendChild(th);
+  });
+  table.appendChild(header);
+  rows.forEach(function(i) {
+    var row = node('tr');
+    var name = node('td');
+    var link = node('a', data.names[i]);
+    link.onclick = function() {
+      backward.push(i);
+      forward = [];
+      show();
+    };
+    name.appendChild(link);
+    row.appendChild(name);
+    row.appendChild(node('td', String(data.callcounts[i]),
+                         {'class': 'number'}));
+    row.appendChild(node('td', data.totaltimes[i].toFixed(6),
+                         {'class': 'number'}));
+    row.appendChild(node('td', data.inlinetimes[i].toFixed(6),
+                         {'class': 'number'}));
+    var plot = node('td');
+    var scale = max_time > 0 ? 100 / max_time : 0;
+    plot.appendChild(node('span', undefined, {
+      'class': 'plot',
+      'style': 'background: rgb(255, 0, 0); width: ' +
+               scale * data.inlinetimes[i] + 'px'}));
+    plot.appendChild(node('span', undefined, {
+      'class': 'plot',
+      'style': 'background: rgb(255, 160, 160); width: ' +
+               scale * (data.totaltimes[i] - data.inlinetimes[i]) + 'px'}));
+    row.appendChild(plot);
+    table.appendChild(row);
+  });
+}
+
+document.getElementById('home').onclick = function() {
+  if (backward[backward.length - 1] !== null) {
+    backward.push(null);
+    forward = [];
+    show();
+  }
+};
+document.getElementById('back').onclick = function() {
+  if (backward.length > 1) {
+    forward.push(backward.pop());
+    show();
+  }
+};
+document.getElementById('forward').onclick = function() {
+  if (forward.length) {
+    backward.push(forward.pop());
+    show();
+  }
+};
+show();
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,199 @@
+"""
+Low overhead statistical profiler, which periodically samples the call stack
+of the profiled thread instead of tracing every call and line.
+"""
+from __future__ import absolute_import, division
+
+import sys
+import threading
+from timeit import default_timer
+
+
+# Note: this mirrors _line_profiler.LineStats, so that sampled line timings
+# can be used wherever line profiler results are.
+class LineStats(object):
+    """
+    Line timings, in the same form as returned by
+    _line_profiler.LineProfiler.get_stats().
+    """
+    def __init__(self, timings, unit):
+        self.timings = timings
+        self.unit = unit
+
+
+class Sampler(object):
+    """
+    Statistical profiler. Between calls to enable() and disable() a
+    background thread records the call stack of the thread which called
+    enable() every `interval` seconds.
+
+    The results are returned by getstats(), in the same form as
+    cProfile.Profile.getstats(), and get_stats(), in the same form as
+    _line_profiler.LineProfiler.get_stats(). Times are estimated from the
+    time between samples, and call counts from the number of new frames seen
+    on the stack, so calls shorter than the interval may be missed.
+
+    The default interval matches the interpreter's default thread switch
+    interval; sampling more often mostly adds contention for the GIL.
+    """
+    # Timer units used for line timings, as for the line profiler.
+    unit = 1e-6
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        # Per function [callcount, reccallcount, totaltime, inlinetime]
+        self.functions = {}
+        # Per (caller, callee) [callcount, reccallcount, totaltime,
+        # inlinetime]
+        self.calls = {}
+        # Per (code, lineno) [nhits, time]
+        self.lines = {}
+        # Filename of each code object, see _line_profiler.
+        self.file_map = {}
+        self._thread = None
+
+    def enable(self):
+        # Only frames above the caller of enable() are recorded.
+        self._start(threading.current_thread().ident, sys._getframe(1))
+
+    def _start(self, thread_id, base_frame):
+        """
+        Start sampling the thread with id thread_id, recording the frames
+        above base_frame, or the whole stack if base_frame is None.
+        """
+        self._thread_id = thread_id
+        self._base_frame = base_frame
+        self._last_stack = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._base_frame = None
+        self._last_stack = []
+
+    def _run(self):
+        last_time = default_timer()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            time = default_timer()
+            self._sample(frame, time - last_time)
+            last_time = time
+            del frame
+
+    def _sample(self, frame, dt):
+        stack = []
+        while frame is not None and frame is not self._base_frame:
+            stack.append(frame)
+            frame = frame.f_back
+        if (frame is not self._base_frame or not stack or
+                stack[-1].f_code in _SAMPLER_CODES):
+            # Not inside the profiled code.
+            return
+        stack.reverse()
+
+        # Frames which were on the stack at the previous sample belong to
+        # calls which have already been counted.
+        last_stack = self._last_stack
+        n_old = 0
+        while (n_old < min(len(stack), len(last_stack)) and
+               stack[n_old] is last_stack[n_old]):
+            n_old += 1
+        self._last_stack = stack
+
+        functions = self.functions
+        calls = self.calls
+        lines = self.lines
+        seen_functions = set()
+        seen_calls = set()
+        seen_lines = set()
+        caller = None
+        leaf = len(stack) - 1
+        for depth, frame in enumerate(stack):
+            code = frame.f_code
+            recursive = code in seen_functions
+            new = depth >= n_old
+
+            try:
+                stats = functions[code]
+            except KeyError:
+                stats = functions[code] = [0, 0, 0., 0.]
+                self.file_map[code] = frame.f_globals.get('__file__',
+                                                          code.co_filename)
+            if new:
+                stats[0] += 1
+                stats[1] += recursive
+            if not recursive:
+                stats[2] += dt
+                seen_functions.add(code)
+            if depth == leaf:
+                stats[3] += dt
+
+            if caller is not None:
+                call = (caller, code)
+                try:
+                    stats = calls[call]
+                except KeyError:
+                    stats = calls[call] = [0, 0, 0., 0.]
+                if new:
+                    stats[0] += 1
+                    stats[1] += recursive
+                if call not in seen_calls:
+                    stats[2] += dt
+                    seen_calls.add(call)
+                if depth == leaf:
+                    stats[3] += dt
+
+            line = (code, frame.f_lineno)
+            if line not in seen_lines:
+                try:
+                    stats = lines[line]
+                except KeyError:
+                    stats = lines[line] = [0, 0.]
+                stats[0] += 1
+                stats[1] += dt
+                seen_lines.add(line)
+            caller = code
+
+    def getstats(self):
+        """
+        Return a list of (code, callcount, reccallcount, totaltime,
+        inlinetime, calls) entries, as cProfile.Profile.getstats() does.
+        """
+        callees = {}
+        for (caller, callee), stats in self.calls.items():
+            callees.setdefault(caller, []).append((callee,) + tuple(stats))
+        return [(code,) + tuple(stats) + (callees.get(code),) for
+                code, stats in self.functions.items()]
+
+    def get_stats(self):
+        """
+        Return a LineStats object containing the sampled line timings.
+        """
+        return line_stats(self.lines, self.file_map, self.unit)
+
+
+def line_stats(lines, file_map, unit):
+    """
+    Return a LineStats object of the line timings in lines, a dict mapping
+    (code, lineno) to [nhits, time], with times in seconds converted to
+    units of `unit`. file_map maps code objects to their filenames.
+    """
+    timings = {}
+    filenames = {}
+    for (code, lineno), (nhits, time) in lines.items():
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        timings.setdefault(key, []).append(
+            (lineno, nhits, int(round(time / unit))))
+        filenames[key] = file_map[code]
+    for key, ltimings in timings.items():
+        ltimings.sort()
+        ltimings.append(filenames[key])
+    return LineStats(timings, unit)
+
+
+_SAMPLER_CODES = (Sampler.enable.__code__, Sampler.disable.__code__)
@@ -0,0 +1,107 @@
+"""
+Cache of the syntax highlighted source of functions.
+"""
+from __future__ import absolute_import
+
+import io
+import os
+import sys
+
+if sys.version_info[0] >= 3:
+    import linecache
+    import tokenize
+    from importlib.util import source_from_cache
+else:
+    # Python 2's linecache doesn't decode the source.
+    from IPython.utils import openpy
+    from IPython.utils import ulinecache as linecache
+    source_from_cache = openpy.source_from_cache
+
+from pygments import highlight
+from pygments.lexers import PythonLexer
+from pygments.formatters import HtmlFormatter
+
+from .cache import LRUCache
+
+
+class SourceCache(object):
+    """
+    The highlighted lines of each function shown are kept, so that its code
+    isn't highlighted again when it is shown again. Only the lines of the
+    function are highlighted, as highlighting whole files takes longer than
+    the rest of showing a page.
+
+    Source files inside zipped eggs are read through a pool of at most
+    max_open_zips open ZipFiles.
+    """
+    def __init__(self, maxsize=256, max_open_zips=8):
+        self._spans = LRUCache(maxsize)
+        self._zips = LRUCache(max_open_zips,
+                              on_evict=lambda zipped_file: zipped_file.close())
+        self._formatter = HtmlFormatter(nowrap=True, noclasses=True)
+
+    def highlighted_lines(self, filename, firstlineno=1, lastlineno=None):
+        """
+        Return a list with the highlighted HTML of each line of filename from
+        firstlineno to lastlineno (by default the end of the file). The
+        lines should start at a statement, such as a def or a decorator,
+        rather than inside a string.
+        """
+        try:
+            # Highlight files again if they change.
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            mtime = None
+        key = (filename, mtime, firstlineno, lastlineno)
+
+        lines = self._spans.get(key)
+        if lines is None:
+            source = "".join(self.getlines(filename)[firstlineno - 1:
+                                                     lastlineno])
+            # With nowrap=True the formatter closes any open tags at the end
+            # of each line, so the output can be split into lines.
+            html = highlight(source, PythonLexer(stripnl=False),
+                             self._formatter)
+            lines = [line + "\n" for line in html.split("\n")]
+            if source.endswith("\n") or not source:
+                lines.pop()
+            self._spans[key] = lines
+        return lines
+
+    def getlines(self, filename):
+        """Return the lines of the source file filename."""
+        if ".egg/" in filename:
+            return self.get_zipped_lines(filename)
+        # linecache keeps the lines of files until they are checked.
+        linecache.checkcache(filename)
+        return linecache.getlines(filename)
+
+    def get_zipped_lines(self, filename):
+        """Return the lines of a source file inside a zipped egg."""
+        (zipped_filename, extension, inner) = filename.partition('.egg/')
+        zipped_filename += extension[:-1]
+
+        zipped_file = self._zips.get(zipped_filename)
+        if zipped_file is None:
+            import zipfile
+            assert zipfile.is_zipfile(zipped_filename)
+            zipped_file = zipfile.ZipFile(zipped_filename)
+            self._zips[zipped_filename] = zipped_file
+        source = _source_to_unicode(zipped_file.read(inner))
+        return io.StringIO(source).readlines()
+
+    def clear(self):
+        self._spans.clear()
+        self._zips.clear()
+
+
+def _source_to_unicode(source):
+    """Decode source code, using the encoding declared in it."""
+    if sys.version_info[0] < 3:
+        return openpy.source_to_unicode(source)
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(source).readline)
+    return source.decode(encoding)
+
+
+# Shared by all IProfile widgets.
+source_cache = SourceCache()
@@ -0,0 +1,230 @@
+"""
+Saving and loading profiles.
+
+Profiles are stored in a columnar binary format: an 8 byte magic string, the
+length of a JSON header as a little endian uint64, the header, and then the
+raw data of each array, aligned to ALIGNMENT bytes. The header holds the
+function labels and the dtype, shape and offset of each array, so that the
+arrays can be memory mapped when the profile is loaded, and are only read
+from disk as they are used.
+"""
+from __future__ import absolute_import
+
+import json
+import marshal
+import struct
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
+
+from .callgraph import CallGraph, MergedCode, label, key_from_label
+from .sampler import LineStats
+
+MAGIC = b'IPROFILE'
+VERSION = 1
+ALIGNMENT = 64
+
+
+def save_profile(path, graph, ltimings=None, unit=1e-6):
+    """
+    Save a CallGraph, and optionally line timings, to path. ltimings is a
+    dict mapping (filename, firstlineno, name) labels to lists of (lineno,
+    nhits, time) tuples followed by the source filename, as in the timings
+    of the line profiler.
+    """
+    arrays = [('indptr', graph.indptr), ('indices', graph.indices)]
+    arrays += [('node_' + column, values) for
+               column, values in sorted(graph.nodes.items())]
+    arrays += [('edge_' + column, values) for
+               column, values in sorted(graph.edges.items())]
+
+    line_keys = []
+    line_filenames = []
+    line_indptr = [0]
+    lines = []
+    for key, timings in sorted((ltimings or {}).items()):
+        line_keys.append(list(key))
+        line_filenames.append(timings[-1])
+        lines.extend(timings[:-1])
+        line_indptr.append(len(lines))
+    lines = np.array(lines, dtype=np.int64).reshape(-1, 3)
+    arrays += [('line_indptr', np.array(line_indptr, dtype=np.int64)),
+               ('line_lineno', lines[:, 0]),
+               ('line_nhits', lines[:, 1]),
+               ('line_time', lines[:, 2])]
+
+    header = {'version': VERSION,
+              'keys': [list(label(key)) for key in graph.keys],
+              'line_keys': line_keys,
+              'line_filenames': line_filenames,
+              'unit': unit,
+              'arrays': {}}
+
+    # Offsets are relative to the start of the data, which is the end of the
+    # header rounded up to ALIGNMENT.
+    offset = 0
+    for name, values in arrays:
+        offset = _align(offset)
+        header['arrays'][name] = {'dtype': values.dtype.str,
+                                  'shape': list(values.shape),
+                                  'offset': offset}
+        offset += values.nbytes
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _data_start(len(header_bytes))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, values in arrays:
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(np.ascontiguousarray(values).tobytes())
+
+
+def load_profile(path):
+    """
+    Load a profile saved by save_profile, returning a CallGraph and a
+    LineStats object. The arrays are memory mapped.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an iprofiler profile.".format(path))
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    if header['version'] > VERSION:
+        raise ValueError("{} was saved by a newer version of iprofiler."
+                         .format(path))
+
+    data_start = _data_start(header_length)
+    arrays = {name: _map_array(path, info['dtype'], info['shape'],
+                               data_start + info['offset'])
+              for name, info in header['arrays'].items()}
+    nodes = {name[5:]: values for name, values in arrays.items() if
+             name.startswith('node_')}
+    edges = {name[5:]: values for name, values in arrays.items() if
+             name.startswith('edge_')}
+    keys = [key_from_label(tuple(key)) for key in header['keys']]
+    graph = CallGraph(keys, nodes, arrays['indptr'], arrays['indices'],
+                      edges)
+
+    timings = MappedLineTimings([tuple(key) for key in header['line_keys']],
+                                header['line_filenames'],
+                                arrays['line_indptr'], arrays['line_lineno'],
+                                arrays['line_nhits'], arrays['line_time'])
+    return graph, LineStats(timings, header['unit'])
+
+
+def is_profile(path):
+    """Return whether path was written by save_profile."""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_pstats(path):
+    """
+    Load a file written by cProfile.Profile.dump_stats (or python -m
+    cProfile -o), returning a CallGraph.
+    """
+    with open(path, 'rb') as f:
+        stats = marshal.load(f)
+    return CallGraph.from_pstats(stats)
+
+
+def timer_unit(lprofile):
+    """Return the timer unit of lprofile, in seconds."""
+    return 1e-6 if lprofile is None else lprofile.unit
+
+
+def merged_ltimings(lprofile, key):
+    """
+    Return the line timings in lprofile of the function with key `key`, or
+    None if there are none. The timings of merged code objects are combined.
+    """
+    if lprofile is None:
+        return None
+    if isinstance(key, MergedCode):
+        codes = key.codes
+    else:
+        codes = [key]
+
+    lines = {}
+    filename = None
+    for code in codes:
+        try:
+            ltimings = lprofile.timings[label(code)]
+        except KeyError:
+            continue
+        filename = ltimings[-1]
+        for lineno, nhits, time in ltimings[:-1]:
+            old_nhits, old_time = lines.get(lineno, (0, 0))
+            lines[lineno] = (old_nhits + nhits, old_time + time)
+
+    if not lines:
+        return None
+    return ([(lineno,) + lines[lineno] for lineno in sorted(lines)] +
+            [filename])
+
+
+def ltimings_by_label(graph, lprofile):
+    """
+    Return a dict of the line timings in lprofile of each function in graph,
+    keyed by label, as expected by save_profile.
+    """
+    ltimings = {}
+    for key in graph.keys:
+        if type(key) == str:
+            continue
+        key_ltimings = merged_ltimings(lprofile, key)
+        if key_ltimings is not None:
+            ltimings[label(key)] = key_ltimings
+    return ltimings
+
+
+class MappedLineTimings(Mapping):
+    """
+    Read only dict of line timings, in the same form as the timings of the
+    line profiler, which builds the list for a function from the (memory
+    mapped) line arrays when it is looked up.
+    """
+    def __init__(self, keys, filenames, indptr, lineno, nhits, time):
+        self._index = {key: i for i, key in enumerate(keys)}
+        self._keys = keys
+        self._filenames = filenames
+        self._indptr = indptr
+        self._lineno = lineno
+        self._nhits = nhits
+        self._time = time
+
+    def __getitem__(self, key):
+        i = self._index[key]
+        start, stop = self._indptr[i], self._indptr[i + 1]
+        return (list(zip(self._lineno[start:stop].tolist(),
+                         self._nhits[start:stop].tolist(),
+                         self._time[start:stop].tolist())) +
+                [self._filenames[i]])
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _data_start(header_length):
+    return _align(len(MAGIC) + 8 + header_length)
+
+
+def _map_array(path, dtype, shape, offset):
+    if np.prod(shape) == 0:
+        # Empty arrays can't be memory mapped.
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                     shape=tuple(shape))
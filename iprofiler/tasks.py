@@ -0,0 +1,174 @@
+"""
+Task level profiling of asyncio code.
+
+cProfile attributes the time a coroutine spends awaiting to whichever frame
+resumes it, so instead the coroutine of every asyncio task is wrapped, and
+the time spent in each step of the coroutine (on the CPU) is recorded,
+along with the time from the creation of the task to its completion.
+"""
+from __future__ import absolute_import
+
+import asyncio
+import threading
+from collections.abc import Coroutine
+from timeit import default_timer
+
+from .callgraph import CallGraph
+
+
+class _TaskRecord(object):
+    __slots__ = ('key', 'parent', 'start', 'end', 'cpu_time')
+
+    def __init__(self, key, parent):
+        self.key = key
+        self.parent = parent
+        self.start = default_timer()
+        self.end = None
+        self.cpu_time = 0.
+
+
+class _TimedCoroutine(Coroutine):
+    """
+    Proxy of a coroutine which adds the time spent in each of its steps to
+    record.cpu_time.
+    """
+    def __init__(self, coro, record):
+        self._coro = coro
+        self._record = record
+
+    def send(self, value):
+        start = default_timer()
+        try:
+            return self._coro.send(value)
+        finally:
+            self._record.cpu_time += default_timer() - start
+
+    def throw(self, *args):
+        start = default_timer()
+        try:
+            return self._coro.throw(*args)
+        finally:
+            self._record.cpu_time += default_timer() - start
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def __getattr__(self, name):
+        # cr_code, __qualname__ etc., used to describe the task.
+        return getattr(self._coro, name)
+
+
+class TaskProfiler(object):
+    """
+    Between calls to enable() and disable(), every task created on `loop`
+    is timed, using a task factory. getstats() returns the results as a
+    call graph of tasks, in which each task is a child of the task which
+    created it, the callcount of a coroutine is the number of tasks which
+    ran it, the totaltime is their total time from creation to completion,
+    and the inlinetime is the part of that which was spent running on the
+    CPU, rather than awaiting.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.records = []
+        self._tasks = {}
+        self._factory = None
+
+    def enable(self):
+        self._factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._create_task)
+
+    def disable(self):
+        self.loop.set_task_factory(self._factory)
+        self._factory = None
+        self._tasks = {}
+
+    def _create_task(self, loop, coro, **kwargs):
+        parent = self._tasks.get(asyncio.current_task(loop))
+        record = _TaskRecord(_coroutine_key(coro), parent)
+        self.records.append(record)
+        coro = _TimedCoroutine(coro, record)
+        if self._factory is None:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        else:
+            task = self._factory(loop, coro, **kwargs)
+        self._tasks[task] = record
+        task.add_done_callback(lambda _: setattr(record, 'end',
+                                                 default_timer()))
+        return task
+
+    def getstats(self):
+        """
+        Return the task graph as a CallGraph. Tasks which haven't finished
+        are timed up to now.
+        """
+        now = default_timer()
+        keys = []
+        ids = {}
+        for record in self.records:
+            if record.key not in ids:
+                ids[record.key] = len(keys)
+                keys.append(record.key)
+
+        node_ids = []
+        node_rows = []
+        src = []
+        dst = []
+        edge_rows = []
+        for record in self.records:
+            end = now if record.end is None else record.end
+            row = (1, 0, end - record.start, record.cpu_time)
+            node_ids.append(ids[record.key])
+            node_rows.append(row)
+            if record.parent is not None:
+                src.append(ids[record.parent.key])
+                dst.append(ids[record.key])
+                edge_rows.append(row)
+        return CallGraph.from_edges(keys, node_ids, node_rows, src, dst,
+                                    edge_rows)
+
+
+def _coroutine_key(coro):
+    """Return the code object of coro, or its type's name."""
+    code = getattr(coro, 'cr_code', None) or getattr(coro, 'gi_code', None)
+    return code if code is not None else type(coro).__name__
+
+
+def profile_coroutine(coro):
+    """
+    Run coro on a new event loop with a TaskProfiler, and return its task
+    graph. If an event loop is already running in this thread (as in the
+    Jupyter kernel), the new loop is run in another thread.
+    """
+    def run():
+        loop = asyncio.new_event_loop()
+        profiler = TaskProfiler(loop)
+        profiler.enable()
+        try:
+            loop.run_until_complete(coro)
+        finally:
+            profiler.disable()
+            loop.close()
+        return profiler.getstats()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return run()
+
+    result = {}
+
+    def run_in_thread():
+        try:
+            result['graph'] = run()
+        except BaseException as e:
+            result['error'] = e
+    thread = threading.Thread(target=run_in_thread)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['graph']
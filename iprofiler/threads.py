@@ -0,0 +1,123 @@
+"""
+Profiling of the threads started by the profiled code.
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+from collections import namedtuple
+from timeit import default_timer
+
+from .callgraph import (CallGraph, PROFILER_DISABLE_KEY, add_root, combine)
+from . import timers
+
+# Time spent running on the CPU by the calling thread (Python 3.7+).
+_thread_time = getattr(time, 'thread_time', None)
+
+# The profile of a thread. wall_time is the time from the start to the end
+# of the thread, and cpu_time the time it spent running (or None if this
+# can't be measured), so that a thread waiting for the GIL, or for I/O, has
+# a cpu_time well below its wall_time.
+ThreadProfile = namedtuple('ThreadProfile', ['name', 'graph', 'wall_time',
+                                             'cpu_time'])
+
+
+class ThreadProfiler(object):
+    """
+    Between calls to enable() and disable(), every thread which is started
+    (with threading.Thread.start) is profiled with its own cProfile
+    profiler, and its wall and CPU time are recorded. Threads which were
+    started before enable() aren't profiled, and threads are never line
+    profiled.
+
+    enable() and disable() should be called from the thread which runs the
+    profiled code, whose wall and CPU time are also recorded.
+
+    From Python 3.12, only one cProfile profiler can be active at a time, in
+    all threads, so while the main thread is profiled with cProfile (as by
+    %iprofile), the threads it starts only get their wall and CPU times
+    recorded, and their calls are found in the profile of the main thread.
+
+    Threads are profiled with the timer called `timer` (see timers.TIMERS),
+    and if calibration (a timers.Calibration) is given then the overhead of
+    profiling is subtracted from their inline times.
+    """
+    def __init__(self, timer=None, calibration=None):
+        self.timer = timer
+        self.calibration = calibration
+        self.profiles = []
+        self._lock = threading.Lock()
+        self._original_start = None
+
+    def enable(self):
+        self.profiles = []
+        self._wall_start = default_timer()
+        self._cpu_start = _thread_time() if _thread_time else None
+        self._original_start = threading.Thread.start
+        profiler = self
+
+        def start(thread):
+            profiler._wrap_run(thread)
+            return profiler._original_start(thread)
+        threading.Thread.start = start
+
+    def disable(self):
+        threading.Thread.start = self._original_start
+        self._original_start = None
+        self.wall_time = default_timer() - self._wall_start
+        self.cpu_time = (_thread_time() - self._cpu_start if _thread_time
+                         else None)
+
+    def _wrap_run(self, thread):
+        run = thread.run
+
+        def profiled_run():
+            profile = timers.cprofile(self.timer)
+            wall_start = default_timer()
+            cpu_start = _thread_time() if _thread_time else None
+            try:
+                profile.enable()
+            except ValueError:
+                # From Python 3.12, cProfile uses sys.monitoring, which
+                # allows a single active profiler for all threads: the calls
+                # of this thread are then recorded (interleaved with those
+                # of the main thread) by the main thread's profiler, and
+                # only its times are recorded here.
+                profile = None
+            try:
+                run()
+            finally:
+                if profile is not None:
+                    profile.disable()
+                wall_time = default_timer() - wall_start
+                cpu_time = (_thread_time() - cpu_start if _thread_time
+                            else None)
+                graph = CallGraph.from_cprofile(
+                    profile.getstats() if profile is not None else [])
+                if self.calibration is not None:
+                    timers.subtract_overhead(self.calibration, graph)
+                graph = add_root(graph, "<thread {}>".format(thread.name),
+                                 exclude=[PROFILER_DISABLE_KEY])
+                with self._lock:
+                    self.profiles.append(
+                        ThreadProfile(thread.name, graph, wall_time,
+                                      cpu_time))
+        thread.run = profiled_run
+
+    def threads(self, graph, name="Main thread"):
+        """
+        Return a list of ThreadProfiles of the thread which ran the profiled
+        code, with call graph graph, followed by the threads which it
+        started.
+        """
+        with self._lock:
+            profiles = list(self.profiles)
+        return [ThreadProfile(name, graph, self.wall_time,
+                              self.cpu_time)] + profiles
+
+
+def combine_threads(threads):
+    """
+    Return a call graph combining the graphs of a list of ThreadProfiles.
+    """
+    return combine([thread.graph for thread in threads])
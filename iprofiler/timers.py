@@ -0,0 +1,198 @@
+"""
+Timers which the profilers can use instead of their default wall clock
+timers, and calibration of the overhead which profiling adds to timings.
+"""
+from __future__ import absolute_import, division
+
+import cProfile
+import time
+from collections import namedtuple
+from timeit import default_timer
+
+import numpy as np
+
+from .callgraph import label
+
+# Timers which can be selected, by name, and the functions in the time
+# module (Python 3.7+) which return their time in integer nanoseconds:
+# 'wall' is the wall clock time, 'process' the CPU time of the process and
+# 'thread' the CPU time of the calling thread, which excludes time spent
+# waiting for I/O, for locks and for the GIL.
+TIMERS = (('wall', 'perf_counter_ns'),
+          ('process', 'process_time_ns'),
+          ('thread', 'thread_time_ns'))
+_TIMERS = dict(TIMERS)
+
+# The overhead which profiling adds to timings, in seconds: `call` is added
+# to the inline time of a function by each call of it, `caller` to the
+# inline time of a function by each call which it makes, and `line` to the
+# time of each hit of a line by the line profiler.
+Calibration = namedtuple('Calibration', ['call', 'caller', 'line'])
+
+# Calibrations of each timer, which are measured once.
+_calibrations = {}
+
+
+def get_timer(name):
+    """
+    Return the timer called name (see TIMERS) as a pair (function, unit),
+    where function() returns the time as an integer number of units of
+    `unit` seconds.
+    """
+    if name not in _TIMERS:
+        raise ValueError("Unknown timer {!r}, expected one of {}.".format(
+            name, ", ".join(timer for timer, _ in TIMERS)))
+    function = getattr(time, _TIMERS[name], None)
+    if function is None:
+        raise ValueError("The {} timer needs Python 3.7+.".format(name))
+    return function, 1e-9
+
+
+def cprofile(timer=None):
+    """
+    Return a cProfile.Profile using the timer called `timer`, or cProfile's
+    default timer if timer is None.
+    """
+    if timer is None:
+        return cProfile.Profile()
+    return cProfile.Profile(*get_timer(timer))
+
+
+def line_profiler(timer=None, functions=()):
+    """
+    Return a line profiler of functions (or of every function called, if
+    there are none), using the timer called `timer`, or the line profiler's
+    default timer if timer is None.
+    """
+    import iprofiler._line_profiler as _line_profiler
+
+    if timer is None:
+        return _line_profiler.LineProfiler(*functions)
+    function, unit = get_timer(timer)
+    return _line_profiler.LineProfiler(*functions, timer=function,
+                                       timer_unit=unit)
+
+
+def calibrate(timer=None, n=20000, repeat=3):
+    """
+    Return the Calibration of the overhead of profiling with the timer
+    called `timer` on this machine. A loop of n calls of an empty function,
+    and a loop of n iterations, are timed with and without the profilers,
+    and the best of `repeat` runs is used. The result is cached.
+    """
+    try:
+        return _calibrations[timer]
+    except KeyError:
+        pass
+    if timer is None:
+        clock, unit = default_timer, 1.
+    else:
+        clock, unit = get_timer(timer)
+
+    def best(function):
+        times = []
+        for _ in range(repeat):
+            start = clock()
+            function(n)
+            times.append((clock() - start) * unit)
+        return min(times)
+
+    # Calls: the overhead is split between the inline times of the callee,
+    # and of the caller. The caller's is measured against a loop without the
+    # calls, since the unprofiled loop of calls also includes the cost of
+    # the calls themselves, which would hide part of the overhead.
+    plain = best(_loop) / n
+    call = caller = float('inf')
+    for _ in range(repeat):
+        profiler = cprofile(timer)
+        try:
+            profiler.enable()
+        except ValueError:
+            # From Python 3.12 only one cProfile profiler can be active.
+            raise RuntimeError("Can't calibrate the profiler while another "
+                               "profiler is active.")
+        _calls(n)
+        profiler.disable()
+        inline = {entry.code: entry.inlinetime for
+                  entry in profiler.getstats()}
+        call = min(call, inline[_empty.__code__] / n)
+        caller = min(caller, inline[_calls.__code__] / n - plain)
+
+    # Lines: the time of the loop is shared equally between the hits of its
+    # lines.
+    line = 0.
+    try:
+        import iprofiler._line_profiler
+    except ImportError:
+        # The line profiler isn't built.
+        pass
+    else:
+        plain = best(_lines)
+        line = float('inf')
+        for _ in range(repeat):
+            profiler = line_profiler(timer, [_lines])
+            profiler.enable()
+            _lines(n)
+            profiler.disable()
+            stats = profiler.get_stats()
+            rows = [row for timings in stats.timings.values() for
+                    row in timings[:-1]]
+            hits = sum(nhits for _, nhits, _ in rows)
+            total = sum(line_time for _, _, line_time in rows) * stats.unit
+            line = min(line, (total - plain) / max(hits, 1))
+
+    calibration = Calibration(max(call, 0.), max(caller, 0.), max(line, 0.))
+    _calibrations[timer] = calibration
+    return calibration
+
+
+def subtract_overhead(calibration, graph=None, lprofile=None):
+    """
+    Subtract the overhead of profiling, as measured by calibrate, from the
+    inline times of the functions in graph and from the line timings of
+    lprofile (a LineStats object), in place. If both are given then they
+    should be from the same run, in which case the overhead of line
+    profiling is also subtracted from the inline times. Times are clipped at
+    zero. Total times, which also include the overhead of the calls below
+    each function, aren't changed.
+    """
+    if graph is not None:
+        nodes = graph.nodes
+        calls_made = np.bincount(graph.callers(), graph.edges['callcount'],
+                                 minlength=len(graph))
+        overhead = (nodes['callcount'] * calibration.call +
+                    calls_made * calibration.caller)
+        if lprofile is not None:
+            hits = {key: sum(nhits for _, nhits, _ in timings[:-1]) for
+                    key, timings in lprofile.timings.items()}
+            overhead += calibration.line * np.array(
+                [hits.get(label(key), 0) for key in graph.keys],
+                dtype=np.float64)
+        nodes['inlinetime'] = np.maximum(nodes['inlinetime'] - overhead, 0.)
+    if lprofile is not None:
+        line = calibration.line / lprofile.unit
+        for key, timings in lprofile.timings.items():
+            lprofile.timings[key] = (
+                [(lineno, nhits, max(0, int(round(line_time - nhits * line))))
+                 for lineno, nhits, line_time in timings[:-1]] +
+                [timings[-1]])
+
+
+def _empty():
+    pass
+
+
+def _calls(n):
+    for _ in range(n):
+        _empty()
+
+
+def _loop(n):
+    for _ in range(n):
+        pass
+
+
+def _lines(n):
+    i = 0
+    while i < n:
+        i += 1
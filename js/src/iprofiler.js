@@ -1,13 +1,72 @@
 var widgets = require('jupyter-js-widgets');
+var _ = require('underscore');
+
+// Typed array constructors for the dtypes of binary table columns.
+var TYPED_ARRAYS = {
+  '<i4': Int32Array,
+  '<f4': Float32Array,
+  '<f8': Float64Array
+};
+
+// Height in pixels of each row of the flame graph.
+var FLAME_ROW_HEIGHT = 16;
+
+// Decode columns sent as binary buffers into typed arrays.
+function decode_columns(content, buffers) {
+  var data = {};
+  for (var i = 0; i < content.columns.length; i++) {
+    var buffer = buffers[i];
+    // Copy, so that the typed array is correctly aligned.
+    var bytes = buffer.buffer.slice(buffer.byteOffset,
+                                    buffer.byteOffset + buffer.byteLength);
+    data[content.columns[i]] = new TYPED_ARRAYS[content.dtypes[i]](bytes);
+  }
+  return data;
+}
+
+// A colour for a function name, from a warm palette, which is the same
+// every time the function is drawn.
+function flame_colour(name) {
+  var hash = 0;
+  for (var i = 0; i < name.length; i++) {
+    hash = (hash * 31 + name.charCodeAt(i)) | 0;
+  }
+  hash = Math.abs(hash);
+  return 'rgb(' + (205 + hash % 50) + ',' + (80 + (hash >> 8) % 120) + ',' +
+         (40 + (hash >> 16) % 50) + ')';
+}
+
+// Find a model in any of the Bokeh documents on the page.
+function find_bokeh_model(id) {
+  var Bokeh = window.Bokeh;
+  if (!Bokeh || !Bokeh.index) {
+    return null;
+  }
+  for (var key in Bokeh.index) {
+    var doc = Bokeh.index[key].model.document;
+    var model = doc ? doc.get_model_by_id(id) : null;
+    if (model) {
+      return model;
+    }
+  }
+  return null;
+}
 
 var IProfileView = widgets.DOMWidgetView.extend({
   initialize: function(options) {
     this.listenTo(this.model, 'sync change', this.render);
+    this.listenTo(this.model, 'msg:custom', this.on_msg);
     this.model.fetch();
     this.render();
     this.$el.append('<div id="iprofile-nav"></div>');
+    this.$el.append('<div id="iprofile-threads"></div>');
     this.$el.append('<div id="heading"></div>');
+    this.$el.append(this.table_controls_html());
     this.$el.append(this.model.get('bokeh_table_div'));
+    this.$el.append(this.table_pager_html());
+    this.$el.append('<div id="iprofile-callers"></div>');
+    this.$el.append('<div id="iprofile-flame">' +
+                    '<canvas id="iprofile_flame_canvas"></canvas></div>');
     this.$el.append('<div id="lprofile"></div>');
     this.options = options || {};
     this.send("init_complete");
@@ -16,9 +75,22 @@ var IProfileView = widgets.DOMWidgetView.extend({
   // Render the view.
   render: function(){
     this.$('#iprofile-nav').html(this.nav_html());
+    this.render_thread_selector();
     this.$el.children('#heading').html(this.model.get('value_heading'));
-    this.$el.children('#lprofile').html(this.model.get('value_lprofile'));
-    this.generate_events();
+    this.$el.children('#iprofile-callers').html(
+      this.model.get('value_callers'));
+    var lprofile = this.model.get('value_lprofile');
+    this.$el.children('#lprofile').html(lprofile);
+    if (lprofile !== this.lprofile_html) {
+      // Scroll to the highlighted line (e.g. the end of a hot path) when a
+      // new line profile is shown.
+      this.lprofile_html = lprofile;
+      var line = this.$('#lprofile-highlight');
+      if (line.length) {
+        line[0].scrollIntoView({block: 'center'});
+      }
+    }
+    this.render_table_controls();
     return this;
   },
 
@@ -48,29 +120,279 @@ var IProfileView = widgets.DOMWidgetView.extend({
     return (html_home + html_back + html_forward);
   },
 
-  gen_function_message: function(index) {
-    return function() {this.send("function" + index);};
+  // Selector for the thread to display, shown if several threads were
+  // profiled.
+  render_thread_selector: function(){
+    var names = this.model.get('thread_names');
+    var container = this.$('#iprofile-threads');
+    if (names.length < 2) {
+      container.empty();
+      return;
+    }
+    if (this.rendered_thread_names !== names) {
+      var html = 'Thread <select id="iprofile_thread">' +
+                 '<option value="-1">All threads</option>';
+      for (var i = 0; i < names.length; i++) {
+        html += '<option value="' + i + '">' + _.escape(names[i]) +
+                '</option>';
+      }
+      container.html(html + '</select>');
+      this.rendered_thread_names = names;
+    }
+    this.$('#iprofile_thread').val(String(this.model.get('thread')));
+  },
+
+  // The sort and filter controls, and the pager, are created once so that
+  // the filter box keeps its focus while the table updates.
+  table_controls_html: function(){
+    var html = ('<div id="iprofile-table-controls">' +
+                'Sort by <select id="iprofile_sort">');
+    var options = this.model.get('table_sort_options');
+    for (var i = 0; i < options.length; i++) {
+      html += ('<option value="' + options[i][0] + '">' +
+               _.escape(options[i][1]) + '</option>');
+    }
+    return (html + '</select> ' +
+            'Filter <input id="iprofile_filter" type="text"> ' +
+            'Show <select id="iprofile_time_mode">' +
+            '<option value="time">Times</option>' +
+            '<option value="per_call">Times per call</option>' +
+            '<option value="percent_total">% of total</option>' +
+            '<option value="percent_parent">% of parent</option>' +
+            '</select> ' +
+            'in <select id="iprofile_time_unit">' +
+            '<option value="s">s</option>' +
+            '<option value="ms">ms</option>' +
+            '<option value="us">&micro;s</option>' +
+            '<option value="ns">ns</option>' +
+            '</select>' +
+            '</div>');
+  },
+
+  table_pager_html: function(){
+    return ('<div id="iprofile-table-pager">' +
+            '<a id="iprofile_prev_page" style="cursor: pointer;">&lt;</a> ' +
+            '<span id="iprofile_page"></span> ' +
+            '<a id="iprofile_next_page" style="cursor: pointer;">&gt;</a>' +
+            '</div>');
+  },
+
+  render_table_controls: function(){
+    var page = this.model.get('table_page');
+    var n_pages = this.model.get('table_n_pages');
+    this.$('#iprofile_sort').val(this.model.get('table_sort'));
+    this.$('#iprofile_time_mode').val(this.model.get('time_mode'));
+    this.$('#iprofile_time_unit').val(this.model.get('time_unit'));
+    var filter = this.$('#iprofile_filter');
+    if (!filter.is(':focus')) {
+      filter.val(this.model.get('table_filter'));
+    }
+    this.$('#iprofile_page').text('Page ' + (page + 1) + ' of ' + n_pages +
+                                  ' (' + this.model.get('n_table_elements') +
+                                  ' functions)');
+    this.$('#iprofile_prev_page').toggle(page > 0);
+    this.$('#iprofile_next_page').toggle(page + 1 < n_pages);
+    this.$('#iprofile-table-pager').toggle(n_pages > 1);
+  },
+
+  on_msg: function(content, buffers) {
+    if (content.type === 'table') {
+      this.update_table(content, buffers);
+    } else if (content.type === 'flame') {
+      this.update_flame(content, buffers);
+    } else if (content.type === 'names') {
+      // Names of the functions added to a live profile. Every view gets
+      // the message, so the names are placed rather than appended.
+      var names = this.model.get('function_names').slice(0, content.start);
+      this.model.set('function_names', names.concat(content.names));
+    }
+  },
+
+  // Put a page of table data, sent as binary buffers, into the Bokeh
+  // ColumnDataSource.
+  update_table: function(content, buffers) {
+    var data = decode_columns(content, buffers);
+    var function_names = this.model.get('function_names');
+    data.names = Array.prototype.map.call(data.ids, function(id) {
+      return function_names[id];
+    });
+
+    var source = find_bokeh_model(this.model.get('table_source_id'));
+    if (source === null) {
+      return;
+    }
+    if (source.set) {
+      source.set('data', data);
+    } else {
+      source.data = data;
+    }
+  },
+
+  // Draw the frames of a flame graph (as an icicle, with the displayed
+  // function at the top) on the canvas. Frames are grouped by depth, so
+  // that the frame under the mouse can be found quickly.
+  update_flame: function(content, buffers) {
+    var frames = decode_columns(content, buffers);
+    var n_frames = frames.ids.length;
+    var n_rows = 0;
+    for (var i = 0; i < n_frames; i++) {
+      n_rows = Math.max(n_rows, frames.depths[i] + 1);
+    }
+    var rows = [];
+    for (var depth = 0; depth < n_rows; depth++) {
+      rows.push([]);
+    }
+    for (var i = 0; i < n_frames; i++) {
+      rows[frames.depths[i]].push(i);
+    }
+    this.flame = {frames: frames, rows: rows};
+    this.draw_flame();
+  },
+
+  draw_flame: function() {
+    var canvas = this.$('#iprofile_flame_canvas')[0];
+    if (!canvas || !this.flame) {
+      return;
+    }
+    var frames = this.flame.frames;
+    var function_names = this.model.get('function_names');
+    var width = this.$el.width() || 620;
+    canvas.width = width;
+    canvas.height = this.flame.rows.length * FLAME_ROW_HEIGHT;
+
+    var context = canvas.getContext('2d');
+    context.font = '11px sans-serif';
+    context.textBaseline = 'middle';
+    for (var i = 0; i < frames.ids.length; i++) {
+      var x = frames.starts[i] * width;
+      var w = frames.widths[i] * width;
+      if (w < 0.5) {
+        // Too narrow to see.
+        continue;
+      }
+      var y = frames.depths[i] * FLAME_ROW_HEIGHT;
+      var name = function_names[frames.ids[i]];
+      context.fillStyle = flame_colour(name);
+      context.fillRect(x, y, Math.max(w - 1, 0.5), FLAME_ROW_HEIGHT - 1);
+      if (w > 30) {
+        context.save();
+        context.beginPath();
+        context.rect(x, y, w - 1, FLAME_ROW_HEIGHT);
+        context.clip();
+        context.fillStyle = 'black';
+        context.fillText(name, x + 3, y + FLAME_ROW_HEIGHT / 2);
+        context.restore();
+      }
+    }
+  },
+
+  // Return the index of the flame graph frame at the position of a mouse
+  // event, or -1.
+  flame_frame_at: function(event) {
+    if (!this.flame) {
+      return -1;
+    }
+    var canvas = event.currentTarget;
+    var rect = canvas.getBoundingClientRect();
+    var fraction = (event.clientX - rect.left) / canvas.width;
+    var row = this.flame.rows[Math.floor((event.clientY - rect.top) /
+                                         FLAME_ROW_HEIGHT)];
+    if (!row) {
+      return -1;
+    }
+    var frames = this.flame.frames;
+    for (var i = 0; i < row.length; i++) {
+      var frame = row[i];
+      if (frames.starts[frame] <= fraction &&
+          fraction < frames.starts[frame] + frames.widths[frame]) {
+        return frame;
+      }
+    }
+    return -1;
+  },
+
+  flame_clicked: function(event) {
+    var frame = this.flame_frame_at(event);
+    if (frame >= 0) {
+      this.send('function' + this.flame.frames.ids[frame]);
+    }
+  },
+
+  flame_hovered: function(event) {
+    var frame = this.flame_frame_at(event);
+    var title = '';
+    if (frame >= 0) {
+      var frames = this.flame.frames;
+      title = (this.model.get('function_names')[frames.ids[frame]] + ' (' +
+               (100 * frames.widths[frame]).toFixed(1) + '%)');
+    }
+    event.currentTarget.title = title;
+    event.currentTarget.style.cursor = frame >= 0 ? 'pointer' : 'default';
   },
 
   gen_nav_message: function(message) {
     return function() {this.send(message);};
   },
 
-  generate_events: function(){
-    // Generate click events for function table.
-    var events = {};
-    events["click #iprofile_home"] = this.gen_nav_message("home");
-    events["click #iprofile_back"] = this.gen_nav_message("back");
-    events["click #iprofile_forward"] = this.gen_nav_message("forward");
+  // A single delegated handler for the function links in the table, so that
+  // the cost of handling events doesn't grow with the size of the table.
+  function_clicked: function(event) {
+    this.send(event.currentTarget.id);
+  },
 
-    for (var index = 0;  index < this.model.get('n_table_elements'); index++) {
-        events["click #function" + index] = this.gen_function_message(index);
-    }
-    this.events = events;
-    this.delegateEvents();
+  thread_changed: function(event) {
+    this.send({thread: parseInt(event.currentTarget.value, 10)});
+  },
+
+  sort_changed: function(event) {
+    this.send({sort: event.currentTarget.value});
+  },
+
+  time_mode_changed: function(event) {
+    this.send({mode: event.currentTarget.value});
+  },
+
+  time_unit_changed: function(event) {
+    this.send({unit: event.currentTarget.value});
+  },
+
+  filter_changed: function(event) {
+    // Wait for the user to stop typing before filtering.
+    var value = event.currentTarget.value;
+    var that = this;
+    clearTimeout(this.filter_timeout);
+    this.filter_timeout = setTimeout(function() {
+      if (value !== that.model.get('table_filter')) {
+        that.send({filter: value});
+      }
+    }, 300);
+  },
+
+  prev_page: function() {
+    this.send({page: this.model.get('table_page') - 1});
+  },
+
+  next_page: function() {
+    this.send({page: this.model.get('table_page') + 1});
   },
 
-  events: {},
+  events: function() {
+    return {
+      "click #iprofile_home": this.gen_nav_message("home"),
+      "click #iprofile_back": this.gen_nav_message("back"),
+      "click #iprofile_forward": this.gen_nav_message("forward"),
+      "click a[id^='function']": "function_clicked",
+      "change #iprofile_thread": "thread_changed",
+      "change #iprofile_sort": "sort_changed",
+      "change #iprofile_time_mode": "time_mode_changed",
+      "change #iprofile_time_unit": "time_unit_changed",
+      "keyup #iprofile_filter": "filter_changed",
+      "click #iprofile_flame_canvas": "flame_clicked",
+      "mousemove #iprofile_flame_canvas": "flame_hovered",
+      "click #iprofile_prev_page": "prev_page",
+      "click #iprofile_next_page": "next_page"
+    };
+  },
 
   value_changed: function() {
       this.render();
@@ -130,7 +130,8 @@ setup_args = {
     ],
     'install_requires': [
         'ipywidgets>=5.1.3',
-        'bokeh'
+        'bokeh',
+        'numpy'
     ],
     'ext_modules': [
         Extension('iprofiler._line_profiler',
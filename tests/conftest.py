@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+
+import pytest
+
+from iprofiler.callgraph import CallGraph
+
+
+def graph_from(functions, calls=()):
+    """
+    Build a CallGraph from a dict mapping each function's key to its
+    (callcount, totaltime, inlinetime), and a list of (caller, callee,
+    callcount, totaltime) calls. Functions are numbered in sorted order.
+    """
+    keys = sorted(functions, key=str)
+    ids = {key: i for i, key in enumerate(keys)}
+    node_rows = [(functions[key][0], 0, functions[key][1], functions[key][2])
+                 for key in keys]
+    return CallGraph.from_edges(
+        keys, range(len(keys)), node_rows,
+        [ids[caller] for caller, _, _, _ in calls],
+        [ids[callee] for _, callee, _, _ in calls],
+        [(count, 0, time, time) for _, _, count, time in calls])
+
+
+@pytest.fixture
+def diamond():
+    """
+    main calls a once and b twice, which both call leaf, where most of the
+    time is spent.
+    """
+    return graph_from(
+        {'main': (1, 10., 1.), 'a': (1, 6., 1.), 'b': (2, 3., 1.),
+         'leaf': (6, 7., 7.)},
+        [('main', 'a', 1, 6.), ('main', 'b', 2, 3.),
+         ('a', 'leaf', 4, 5.), ('b', 'leaf', 2, 2.)])
@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+
+import numpy as np
+import pytest
+
+from iprofiler.aggregate import ProfileAggregator, RunningStats
+from iprofiler.callgraph import CodeKey, label
+
+from conftest import graph_from
+
+
+def test_running_stats():
+    runs = np.random.RandomState(0).normal(size=(5, 4))
+    stats = RunningStats()
+    for values in runs:
+        stats.add(values)
+    assert stats.n == 5
+    np.testing.assert_allclose(stats.mean, runs.mean(axis=0))
+    np.testing.assert_allclose(stats.min, runs.min(axis=0))
+    np.testing.assert_allclose(stats.std(), runs.std(axis=0, ddof=1))
+
+
+def test_running_stats_growing():
+    """Entries which are new in a run were zero in the earlier runs."""
+    stats = RunningStats()
+    stats.add([1.])
+    assert stats.std().tolist() == [0.]
+    stats.add([3., 2.])
+    stats.add([2., 4., 6.])
+    runs = np.array([[1., 0., 0.], [3., 2., 0.], [2., 4., 6.]])
+    np.testing.assert_allclose(stats.mean, runs.mean(axis=0))
+    np.testing.assert_allclose(stats.min, runs.min(axis=0))
+    np.testing.assert_allclose(stats.std(), runs.std(axis=0, ddof=1))
+
+
+def cell_function(n, name='f'):
+    return CodeKey('<ipython-input-{}-abc>'.format(n), 1, name)
+
+
+def test_profile_aggregator():
+    aggregator = ProfileAggregator()
+    # The function is redefined by running its cell again.
+    for n, (time, extra) in enumerate([(2., False), (4., True)]):
+        f = cell_function(n)
+        functions = {'main': (1, time + 1., 1.), f: (2, time, time)}
+        calls = [('main', f, 2, time)]
+        if extra:
+            functions['g'] = (1, 1., 1.)
+            calls.append(('main', 'g', 1, 1.))
+        ltimings = {label(f): [(2, 2, int(time * 1e6)), 'cell']}
+        aggregator.add(graph_from(functions, calls), ltimings, 1e-6)
+
+    graph = aggregator.graph()
+    assert aggregator.n_runs == 2
+    assert len(graph) == 3
+    f = graph.index(cell_function(0))
+    g = graph.index('g')
+    main = graph.index('main')
+    assert graph.nodes['totaltime'][f] == pytest.approx(3.)
+    assert graph.nodes['min_totaltime'][f] == pytest.approx(2.)
+    assert graph.nodes['std_totaltime'][f] == pytest.approx(np.sqrt(2.))
+    # g is missing from the first run.
+    assert graph.nodes['callcount'][g] == pytest.approx(.5)
+    assert graph.nodes['min_callcount'][g] == 0
+    assert sorted(graph.children(main).tolist()) == sorted([f, g])
+    assert graph.edges['totaltime'][graph.indptr[main]:
+                                    graph.indptr[main + 1]].sum() == \
+        pytest.approx(3.5)
+
+    lprofile = aggregator.line_stats()
+    assert lprofile.timings == {label(cell_function(0)): [
+        (2, 2, 3000000), 'cell']}
+    minimum, std = aggregator.line_spread(cell_function(5))
+    assert minimum == {2: 2e6}
+    assert std[2] == pytest.approx(np.sqrt(2.) * 1e6)
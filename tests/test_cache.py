@@ -0,0 +1,31 @@
+from __future__ import absolute_import
+
+from iprofiler.cache import LRUCache
+
+
+def test_least_recently_used_is_evicted():
+    evicted = []
+    cache = LRUCache(2, on_evict=evicted.append)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    # b is the least recently used, as a was used since.
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert evicted == [2]
+    assert cache.get('b', 'missing') == 'missing'
+
+    # Replacing an item doesn't evict anything.
+    cache['a'] = 4
+    assert len(cache) == 2 and evicted == [2]
+    cache.clear()
+    assert len(cache) == 0 and sorted(evicted) == [2, 3, 4]
+
+
+def test_without_on_evict():
+    cache = LRUCache(1)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert len(cache) == 1 and cache.get('b') == 2
+    cache.clear()
+    assert 'b' not in cache
@@ -0,0 +1,219 @@
+from __future__ import absolute_import
+
+import cProfile
+
+import numpy as np
+import pytest
+
+from iprofiler.callgraph import (CallGraph, CodeKey, MergedCode, combine, diff,
+                                 join_label, prune_top_level)
+
+from conftest import graph_from
+
+
+def ids(graph, *names):
+    return [graph.index(name) for name in names]
+
+
+def test_from_cprofile():
+    def leaf():
+        return sum(range(100))
+
+    def main():
+        return [leaf() for _ in range(3)]
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    main()
+    profiler.disable()
+    graph = CallGraph.from_cprofile(profiler.getstats())
+
+    i, j = graph.index(main.__code__), graph.index(leaf.__code__)
+    assert graph.nodes['callcount'][j] == 3
+    # Through the list comprehension, which has its own code object on
+    # some versions.
+    assert graph.reachable([i])[j]
+    assert np.all(np.diff(graph.indptr) >= 0)
+    assert graph.indptr[-1] == len(graph.indices)
+
+
+def test_reachable(diamond):
+    reachable = diamond.reachable(ids(diamond, 'b'))
+    assert sorted(diamond.keys[i] for i in np.flatnonzero(reachable)) == [
+        'b', 'leaf']
+    assert diamond.reachable(ids(diamond, 'main')).all()
+
+
+@pytest.mark.parametrize('n', [10, 1000])
+def test_reachable_chain_and_fan_out(n):
+    """Deep chains use the worklist, and wide levels the array operations."""
+    functions = {i: (1, 1., 1.) for i in range(2 * n + 1)}
+    chain = [(i, i + 1, 1, 1.) for i in range(n)]
+    fan_out = [(n, i, 1, 1.) for i in range(n + 1, 2 * n + 1)]
+    graph = graph_from(functions, chain + fan_out + [(2 * n, 0, 1, 1.)])
+    assert graph.reachable([graph.index(0)]).all()
+    reachable = graph.reachable([graph.index(n + 1)])
+    assert reachable.sum() == 1
+
+
+def test_roots(diamond):
+    assert diamond.roots().tolist() == ids(diamond, 'main')
+    cycle = graph_from({'a': (1, 1., 1.), 'b': (1, 2., 1.)},
+                       [('a', 'b', 1, 1.), ('b', 'a', 1, 1.)])
+    assert cycle.roots().tolist() == ids(cycle, 'b')
+
+
+def test_parents(diamond):
+    leaf = diamond.index('leaf')
+    callers, calls = diamond.parents(leaf)
+    assert sorted(diamond.keys[i] for i in callers) == ['a', 'b']
+    assert sorted(diamond.edges['callcount'][calls].tolist()) == [2, 4]
+    assert (diamond.indices[calls] == leaf).all()
+    assert len(diamond.parents(diamond.index('main'))[0]) == 0
+
+
+def test_flame(diamond):
+    flame = diamond.flame(diamond.roots())
+    names = [diamond.keys[i] for i in flame['ids']]
+    assert names == ['main', 'a', 'b', 'leaf', 'leaf']
+    assert flame['depths'].tolist() == [0, 1, 1, 2, 2]
+    assert flame['parents'].tolist() == [-1, 0, 0, 1, 2]
+    np.testing.assert_allclose(flame['widths'], [1., .6, .3, .5, .2])
+    np.testing.assert_allclose(flame['starts'], [0., 0., .6, 0., .6])
+
+    # Children are within their parents.
+    parents = flame['parents'][1:]
+    starts, widths = flame['starts'], flame['widths']
+    assert np.all(starts[1:] >= starts[parents])
+    assert np.all(starts[1:] + widths[1:] <=
+                  starts[parents] + widths[parents] + 1e-12)
+
+    narrow = diamond.flame(diamond.roots(), min_width=.4)
+    assert [diamond.keys[i] for i in narrow['ids']] == ['main', 'a', 'leaf']
+    shallow = diamond.flame(diamond.roots(), max_depth=1)
+    assert shallow['depths'].tolist() == [0]
+
+
+def test_flame_skips_direct_recursion():
+    graph = graph_from({'f': (5, 4., 4.)}, [('f', 'f', 4, 3.)])
+    assert graph.flame([0])['ids'].tolist() == [0]
+
+
+def test_hot_paths(diamond):
+    paths = diamond.hot_paths(diamond.roots(), k=3)
+    assert [[diamond.keys[i] for i in path.ids] for path in paths] == [
+        ['main', 'a', 'leaf'], ['main', 'b', 'leaf'], ['main']]
+    first, second, third = paths
+    assert first.inline == pytest.approx(.5)
+    assert first.widths == pytest.approx([1., .6, .5])
+    assert second.inline == pytest.approx(.2)
+    assert third.inline == pytest.approx(.1)
+    # leaf is called 6 times, 4 of them through a.
+    assert first.counts == pytest.approx([1, 1, 4])
+    assert second.counts == pytest.approx([1, 2, 2])
+
+
+def test_hot_paths_skip_cycles():
+    graph = graph_from({'a': (1, 2., 1.), 'b': (1, 1., 1.)},
+                       [('a', 'b', 1, 1.), ('b', 'a', 1, 1.)])
+    paths = graph.hot_paths(ids(graph, 'a'))
+    assert sorted([graph.keys[i] for i in path.ids] for path in paths) == [
+        ['a'], ['a', 'b']]
+
+
+def test_merge_and_subgraph(diamond):
+    merged = diamond.merge(ids(diamond, 'a', 'b'), 'ab')
+    ab = merged.index('ab')
+    assert merged.nodes['callcount'][ab] == 3
+    assert merged.nodes['totaltime'][ab] == pytest.approx(9.)
+    assert sorted(merged.keys[i] for i in merged.children(ab)) == ['leaf']
+
+    sub = diamond.subgraph(ids(diamond, 'b', 'leaf'))
+    assert sub.keys == ['b', 'leaf']
+    assert sub.children(0).tolist() == [1]
+    assert sub.edges['callcount'].tolist() == [2]
+
+
+def cell_key(n, firstlineno):
+    return CodeKey('<ipython-input-{}-0123abcd>'.format(n), firstlineno,
+                   '<module>')
+
+
+def test_prune_top_level_merges_cell():
+    """
+    IPython compiles a cell line by line, into several <module> code
+    objects, which are merged into one root.
+    """
+    first, second = cell_key(3, 1), cell_key(3, 4)
+    graph = graph_from(
+        {'run_code': (2, 5., .5), first: (1, 2., .5), second: (1, 2.5, .5),
+         'f': (1, 1.5, 1.5), 'g': (1, 2., 2.), 'ipython': (1, .1, .1)},
+        [('run_code', first, 1, 2.), ('run_code', second, 1, 2.5),
+         ('run_code', 'ipython', 1, .1), (first, 'f', 1, 1.5),
+         (second, 'g', 1, 2.)])
+
+    pruned = prune_top_level(graph, "CELL_MAGIC")
+    roots = pruned.roots()
+    assert len(roots) == 1
+    cell = pruned.keys[roots[0]]
+    assert isinstance(cell, MergedCode)
+    assert cell.co_name == "<cell>"
+    assert cell.co_firstlineno == 1
+    assert set(cell.codes) == {first, second}
+    assert pruned.nodes['totaltime'][roots[0]] == pytest.approx(4.5)
+    assert sorted(pruned.keys[i] for i in pruned.children(roots[0])) == [
+        'f', 'g']
+    assert 'run_code' not in pruned and 'ipython' not in pruned
+
+
+def test_prune_top_level_line_magic():
+    module = CodeKey('<string>', 1, '<module>')
+    graph = graph_from(
+        {'run_code': (1, 3., .5), module: (1, 2.5, .5), 'f': (1, 2., 2.)},
+        [('run_code', module, 1, 2.5), (module, 'f', 1, 2.)])
+    assert prune_top_level(graph, "LINE_MAGIC").keys == ['f']
+    assert prune_top_level(graph) is graph
+
+
+def test_diff():
+    before = graph_from({'main': (1, 3., 1.), 'f': (1, 2., 2.)},
+                        [('main', 'f', 1, 2.)])
+    after = graph_from({'main': (1, 4., 1.), 'g': (2, 3., 3.)},
+                       [('main', 'g', 2, 3.)])
+    graph, a_ids, b_ids = diff(before, after)
+    assert sorted(graph.keys) == ['f', 'g', 'main']
+    assert [graph.keys[i] for i in a_ids] == before.keys
+    assert [graph.keys[i] for i in b_ids] == after.keys
+
+    main, f, g = graph.index('main'), graph.index('f'), graph.index('g')
+    assert graph.nodes['totaltime'][[main, f, g]].tolist() == [1., -2., 3.]
+    assert graph.nodes['before_totaltime'][[main, f, g]].tolist() == [
+        3., 2., 0.]
+    assert graph.nodes['after_totaltime'][[main, f, g]].tolist() == [
+        4., 0., 3.]
+    calls = dict(zip(graph.children(main).tolist(),
+                     graph.edges['callcount'][graph.indptr[main]:
+                                              graph.indptr[main + 1]]))
+    assert calls == {f: -1, g: 2}
+
+
+def test_combine():
+    first = graph_from({'main': (1, 3., 1.), 'f': (1, 2., 2.)},
+                       [('main', 'f', 1, 2.)])
+    second = graph_from({'main': (1, 4., 1.), 'f': (2, 1., 1.),
+                         'g': (1, 2., 2.)},
+                        [('main', 'f', 2, 1.), ('main', 'g', 1, 2.)])
+    graph = combine([first, second])
+    main, f, g = graph.index('main'), graph.index('f'), graph.index('g')
+    assert graph.nodes['totaltime'][[main, f, g]].tolist() == [7., 3., 2.]
+    assert graph.nodes['callcount'][[main, f, g]].tolist() == [2, 3, 1]
+    assert sorted(graph.children(main).tolist()) == sorted([f, g])
+    assert graph.edges['callcount'].sum() == 4
+
+
+def test_join_label_ignores_execution_count():
+    assert (join_label(CodeKey('<ipython-input-1-abc>', 2, 'f')) ==
+            join_label(CodeKey('<ipython-input-25-abc>', 2, 'f')))
+    assert (join_label(CodeKey('<ipython-input-1-abc>', 2, 'f')) !=
+            join_label(CodeKey('<ipython-input-1-abd>', 2, 'f')))
+    assert join_label(CodeKey('/a.py', 1, 'f')) != join_label('f')
@@ -0,0 +1,120 @@
+from __future__ import absolute_import
+
+import cProfile
+import sys
+
+import pytest
+
+from iprofiler import store
+from iprofiler.__main__ import main
+
+from test_export import check_chrome, check_speedscope
+
+SCRIPT = u"""
+import sys
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+def work():
+    return [fib(i) for i in range(15)]
+
+with open(sys.argv[1], 'w') as f:
+    f.write(' '.join(sys.argv[2:]))
+work()
+"""
+
+
+@pytest.fixture
+def script(tmp_path, monkeypatch):
+    # The script is run with its own argv and path.
+    monkeypatch.setattr(sys, 'argv', list(sys.argv))
+    monkeypatch.setattr(sys, 'path', list(sys.path))
+    path = tmp_path / 'script.py'
+    path.write_text(SCRIPT)
+    return str(path)
+
+
+def names(graph):
+    return {graph.name(i) for i in range(len(graph))}
+
+
+def test_profile_script(tmp_path, script, capsys):
+    args = str(tmp_path / 'args.txt')
+    assert main([script, args, '-x', 'y']) == 0
+    with open(args) as f:
+        assert f.read() == '-x y'
+    assert "Profile written to {}.iprofile".format(script) in \
+        capsys.readouterr().err
+
+    graph, lprofile = store.load_profile(script + '.iprofile')
+    assert {'fib', 'work'} <= names(graph)
+    # The profile is of the script only, not of the command line interface
+    # running it.
+    assert len(graph.roots()) == 1
+    assert 'main' not in names(graph)
+
+
+def test_sampled(tmp_path, script):
+    output = str(tmp_path / 'sampled.iprofile')
+    assert main(['--sample', '-i', '0.001', '-o', output, script,
+                 str(tmp_path / 'args.txt')]) == 0
+    graph, _ = store.load_profile(output)
+    assert 'main' not in names(graph)
+
+
+@pytest.mark.parametrize('extension', ['.speedscope.json', '.trace.json'])
+def test_export(tmp_path, script, extension):
+    output = str(tmp_path / ('profile' + extension))
+    assert main(['-o', output, script, str(tmp_path / 'args.txt')]) == 0
+    if extension == '.speedscope.json':
+        _, _, frames = check_speedscope(output, 2)
+        assert 'fib' in {frame['name'] for frame in frames}
+    else:
+        _, calls = check_chrome(output)
+        assert 'fib' in calls
+
+
+def test_html_report(tmp_path, script):
+    output = str(tmp_path / 'report.html')
+    assert main(['-o', output, script, str(tmp_path / 'args.txt')]) == 0
+    with open(output) as f:
+        assert 'fib' in f.read()
+
+
+def test_exit_status(tmp_path, script):
+    failing = tmp_path / 'failing.py'
+    failing.write_text(u"def f():\n    raise ValueError()\nf()\n")
+    assert main([str(failing)]) == 1
+    # The profile is still written.
+    graph, _ = store.load_profile(str(failing) + '.iprofile')
+    assert 'f' in names(graph)
+
+    exiting = tmp_path / 'exiting.py'
+    exiting.write_text(u"import sys\nsys.exit(3)\n")
+    assert main([str(exiting)]) == 3
+
+
+def test_convert(tmp_path, script):
+    main([script, str(tmp_path / 'args.txt')])
+    assert main([script + '.iprofile']) == 0
+    with open(script + '.iprofile.html') as f:
+        assert 'fib' in f.read()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    sorted(range(10))
+    profiler.disable()
+    pstats = str(tmp_path / 'stats.pstats')
+    profiler.dump_stats(pstats)
+    output = str(tmp_path / 'stats.speedscope.json')
+    assert main(['-o', output, pstats]) == 0
+    check_speedscope(output, 1)
+
+
+def test_invalid_options(script, capsys):
+    with pytest.raises(SystemExit):
+        main(['--sample', '-l', script])
+    with pytest.raises(SystemExit):
+        main(['--sample', '--calibrate', script])
+    assert "--sample can't be combined" in capsys.readouterr().err
@@ -0,0 +1,145 @@
+from __future__ import absolute_import
+
+import json
+
+import numpy as np
+import pytest
+
+from iprofiler import export
+from iprofiler.callgraph import CodeKey
+
+from conftest import graph_from
+
+F = CodeKey('/src/module.py', 10, 'f')
+
+
+@pytest.fixture
+def graph():
+    return graph_from(
+        {'main': (1, 10., 1.), 'a': (1, 6., 1.), F: (3, 8., 6.),
+         'leaf': (6, 1.5, 1.5)},
+        [('main', 'a', 1, 6.), ('main', F, 2, 3.), ('a', F, 1, 5.),
+         ('a', 'leaf', 4, .5), (F, 'leaf', 2, 1.), (F, F, 1, 2.)])
+
+
+def get_ltimings(key):
+    if key == F:
+        return [(11, 3, 4000000), (12, 3, 2000000), '/src/module.py']
+    return None
+
+
+def check_speedscope(path, n_functions):
+    with open(path) as f:
+        document = json.load(f)
+    events = document['profiles'][0]['events']
+    stack = []
+    time = 0.
+    for event in events:
+        assert event['at'] >= time
+        time = event['at']
+        if event['type'] == 'O':
+            stack.append(event['frame'])
+        else:
+            assert event['type'] == 'C'
+            assert stack.pop() == event['frame']
+    assert not stack
+    frames = document['shared']['frames']
+    assert len(frames) >= n_functions
+    return document, events, frames
+
+
+def check_chrome(path):
+    with open(path) as f:
+        document = json.load(f)
+    stack = []
+    time = 0.
+    calls = []
+    for event in document['traceEvents']:
+        if event['ph'] == 'M' or event['tid'] != 0:
+            continue
+        assert event['ts'] >= time
+        time = event['ts']
+        if event['ph'] == 'B':
+            stack.append(event)
+            calls.append(event['name'])
+        else:
+            assert event['ph'] == 'E'
+            stack.pop()
+    assert not stack
+    return document, calls
+
+
+def test_format_for_path():
+    assert export.format_for_path('a.speedscope.json') == 'speedscope'
+    assert export.format_for_path('a.trace.json') == 'chrome'
+    assert export.format_for_path('a.json') is None
+    with pytest.raises(ValueError):
+        export.write_profile('a.json', None)
+    with pytest.raises(ValueError):
+        export.write_profile('a.json', None, format='svg')
+
+
+def test_speedscope(tmp_path, graph):
+    path = str(tmp_path / 'profile.speedscope.json')
+    export.write_profile(path, graph, get_ltimings)
+    document, events, frames = check_speedscope(path, len(graph))
+
+    evented, sampled = document['profiles']
+    assert evented['endValue'] == pytest.approx(10.)
+    names = [frames[event['frame']]['name'] for event in events if
+             event['type'] == 'O']
+    assert names[:2] == ['main', 'a']
+    assert names.count('f') == 2
+    assert frames[graph.index(F)] == {'name': 'f', 'file': '/src/module.py',
+                                      'line': 10}
+
+    assert sampled['weights'] == [4., 2.]
+    assert sampled['endValue'] == pytest.approx(6.)
+    line_frames = [frames[stack[-1]] for stack in sampled['samples']]
+    assert [frame['line'] for frame in line_frames] == [11, 12]
+    assert all(stack[0] == graph.index(F) for stack in sampled['samples'])
+
+
+def test_chrome(tmp_path, graph):
+    path = str(tmp_path / 'profile.trace.json')
+    export.write_profile(path, graph, get_ltimings, name="test")
+    document, calls = check_chrome(path)
+    assert document['otherData']['name'] == "test"
+    assert calls[:2] == ['main', 'a']
+    lines = [event for event in document['traceEvents'] if
+             event.get('cat') == 'line']
+    assert [event['dur'] for event in lines] == [4e6, 2e6]
+    assert [event['args']['hits'] for event in lines] == [3, 3]
+
+
+@pytest.mark.parametrize('format', export.FORMATS)
+def test_nesting_of_random_graphs(tmp_path, format):
+    """Calls are nested however the times of the calls were rounded."""
+    random = np.random.RandomState(1)
+    n = 200
+    functions = {}
+    calls = []
+    for i in range(n):
+        callees = random.choice(np.arange(i + 1, n + 1), min(4, n - i),
+                                replace=False) if i < n - 1 else []
+        total = random.uniform(.1, 1.) * 10 ** random.uniform(-9, 3)
+        times = random.dirichlet(np.ones(len(callees) + 1)) * total
+        functions['f{}'.format(i)] = (1, total, times[-1])
+        calls.extend(('f{}'.format(i), 'f{}'.format(j), 1, time) for
+                     j, time in zip(callees, times[:-1]) if j < n)
+    graph = graph_from(functions, calls)
+    path = str(tmp_path / 'profile.json')
+    export.write_profile(path, graph, format=format, min_width=0,
+                         max_frames=20000)
+    if format == 'speedscope':
+        check_speedscope(path, n)
+    else:
+        check_chrome(path)
+
+
+def test_empty_graph(tmp_path):
+    graph = graph_from({})
+    path = str(tmp_path / 'empty.speedscope.json')
+    export.write_profile(path, graph)
+    _, events, frames = check_speedscope(path, 0)
+    assert events == [] and frames == []
@@ -0,0 +1,40 @@
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_after(code):
+    """Return the modules imported by running code in a new interpreter."""
+    script = code + "\nimport sys\nprint(' '.join(sys.modules))\n"
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=ROOT)
+    return set(output.decode().split())
+
+
+def test_import():
+    modules = imported_after("import iprofiler")
+    assert not {'numpy', 'ipywidgets', 'bokeh', 'iprofiler.iprofiler'} & \
+        modules
+
+
+def test_load_extension():
+    pytest.importorskip('IPython')
+    modules = imported_after(
+        "from IPython.core.interactiveshell import InteractiveShell\n"
+        "InteractiveShell.instance().extension_manager.load_extension("
+        "'iprofiler')")
+    assert 'iprofiler.magics' in modules
+    assert not {'numpy', 'ipywidgets', 'bokeh', 'iprofiler.iprofiler'} & \
+        modules
+
+
+def test_submodules():
+    modules = imported_after("from iprofiler import store")
+    assert 'iprofiler.store' in modules
+    assert 'iprofiler.iprofiler' not in modules
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+
+import threading
+import time
+
+import pytest
+
+from iprofiler import live
+from iprofiler.live import LiveProfiler, _Refresher
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(1000))
+
+
+def names(graph):
+    return [graph.name(i) for i in range(len(graph))]
+
+
+def test_snapshots_extend_each_other():
+    profiler = LiveProfiler(interval=0.001, window=0.05, n_windows=2)
+    profiler.start()
+    try:
+        busy(0.1)
+        first, _, _ = profiler.snapshot()
+        busy(0.1)
+        second, lprofile, duration = profiler.snapshot()
+    finally:
+        profiler.stop()
+    assert 'busy' in names(first)
+    # The functions of a snapshot are the first functions of the next one.
+    assert names(second)[:len(first)] == names(first)
+    assert lprofile.timings
+    # Only the last n_windows windows are kept.
+    assert len(profiler.windows) == 2
+    assert duration < 0.2
+
+
+class Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Widget(object):
+    def __init__(self, fail=False):
+        self.comm = object()
+        self.fail = fail
+        self.refreshed = threading.Event()
+
+    def refresh(self):
+        self.refreshed.set()
+        if self.fail:
+            raise ValueError("refresh failed")
+
+
+def test_refresher_drops_failing_and_closed_widgets(capsys):
+    refresher = _Refresher(refresh=0.01, max_overhead=1.)
+    widget, failing, closed = Widget(), Widget(fail=True), Widget()
+    closed.comm = None
+    refresher.widgets.extend([failing, closed, widget])
+    try:
+        assert failing.refreshed.wait(5)
+        widget.refreshed.clear()
+        # The other widgets are still refreshed.
+        assert widget.refreshed.wait(5)
+    finally:
+        refresher.stop()
+    assert refresher.widgets == [widget]
+    assert not closed.refreshed.is_set()
+    assert "refresh failed" in capsys.readouterr().err
+
+
+def test_start_and_stop():
+    profiler = live.start(interval=0.001)
+    try:
+        with pytest.raises(RuntimeError):
+            live.start()
+    finally:
+        live.stop()
+    assert profiler._thread is None
+
+
+def test_pages_are_held_until_front_end_ready(monkeypatch):
+    pytest.importorskip('ipywidgets')
+    pytest.importorskip('bokeh')
+    from iprofiler import iprofiler
+
+    profiler = LiveProfiler(interval=0.001)
+    profiler.start()
+    try:
+        busy(0.05)
+        widget = iprofiler.IProfileLive(profiler)
+        sent = []
+        monkeypatch.setattr(widget, 'send_table_page',
+                            lambda fun: sent.append(fun))
+        busy(0.05)
+        widget.refresh()
+        assert sent == []
+        # The front end's comms need a kernel.
+        monkeypatch.setattr(widget, 'send', lambda *args, **kwargs: None)
+        document = Namespace(to_json=lambda: {})
+        monkeypatch.setattr(iprofiler, 'bokeh_io', Namespace(
+            _CommsHandle=lambda *args: None, _state=Namespace(),
+            curstate=lambda: Namespace(document=document)))
+        monkeypatch.setattr(iprofiler, 'bokeh_util', Namespace(
+            notebook=Namespace(get_comms=lambda target: None)))
+        widget.handle_on_msg(None, "init_complete", [])
+        # The current page is sent once the front end is ready.
+        assert sent == [None]
+        busy(0.05)
+        widget.refresh()
+        assert sent == [None, None]
+    finally:
+        profiler.stop()
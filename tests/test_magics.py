@@ -0,0 +1,264 @@
+from __future__ import absolute_import
+
+import json
+import multiprocessing
+
+import pytest
+
+pytest.importorskip('IPython')
+
+from IPython.core.error import UsageError
+from IPython.core.interactiveshell import InteractiveShell
+
+from iprofiler import timers
+
+try:
+    import iprofiler._line_profiler
+    line_profiler_built = True
+except ImportError:
+    line_profiler_built = False
+
+needs_line_profiler = pytest.mark.skipif(not line_profiler_built,
+                                         reason="needs the line profiler")
+
+SOURCE = u"""
+import asyncio
+import math
+import time
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+def work():
+    global result
+    result = [fib(i) for i in range(15)]
+
+def spin(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        fib(10)
+"""
+
+
+@pytest.fixture
+def shell():
+    shell = InteractiveShell.instance()
+    shell.extension_manager.load_extension('iprofiler')
+    shell.run_cell(SOURCE)
+    shell.user_ns.pop('result', None)
+    return shell
+
+
+@pytest.fixture
+def export_path(tmp_path):
+    return str(tmp_path / 'profile.speedscope.json')
+
+
+def graph_names(widget):
+    graph = widget.cprofile_tree
+    return sorted(graph.name(i) for i in range(len(graph)))
+
+
+def exported(path):
+    """Return the names of the frames, and the profiles, exported to path."""
+    with open(path) as f:
+        document = json.load(f)
+    names = {frame['name'] for frame in document['shared']['frames']}
+    return names, document['profiles']
+
+
+def test_export(shell, export_path, capsys):
+    shell.run_line_magic('iprofile', '--export={} work()'.format(
+        export_path))
+    assert shell.user_ns['result'][-1] == 377
+    assert "Profile exported to" in capsys.readouterr().out
+    names, profiles = exported(export_path)
+    assert {'work', 'fib'} <= names
+    # Only the statement is profiled, not the magic running it.
+    assert 'run_line_magic' not in names and 'iprofile' not in names
+    # Lines aren't profiled unless asked to.
+    assert len(profiles) == 1
+
+
+def test_cell_export(shell, export_path):
+    shell.run_cell_magic('iprofile', '--export={}'.format(export_path),
+                         u"x = 1\nwork()\n")
+    assert shell.user_ns['result'][-1] == 377
+    names, _ = exported(export_path)
+    assert 'work' in names
+
+
+@pytest.mark.parametrize('options', [
+    '-t 0', '-t x',
+])
+def test_invalid_options(shell, options):
+    with pytest.raises(UsageError):
+        shell.run_line_magic('iprofile', options + ' work()')
+    assert 'result' not in shell.user_ns
+
+
+@needs_line_profiler
+@pytest.mark.parametrize('options', ['-l', '-f fib', '-t 1'])
+def test_line_profiling(shell, export_path, options):
+    shell.run_line_magic('iprofile', '{} --export={} work()'.format(
+        options, export_path))
+    _, profiles = exported(export_path)
+    assert len(profiles) == 2
+
+
+@needs_line_profiler
+def test_unknown_function(shell):
+    with pytest.raises(UsageError, match="Could not find function"):
+        shell.run_line_magic('iprofile', '-f nonexistent work()')
+
+
+def test_sample(shell, export_path):
+    shell.run_line_magic('iprofile', '--sample -i 0.001 --export={} '
+                         'spin(0.2)'.format(export_path))
+    names, profiles = exported(export_path)
+    assert {'spin', 'fib'} <= names
+    # Line timings are sampled along with the calls.
+    assert len(profiles) == 2
+
+
+@pytest.mark.parametrize('options', [
+    '--sample -l', '--sample -f fib', '--sample --timer=wall',
+    '--sample --calibrate', '--sample -i x',
+])
+def test_invalid_sample_options(shell, options):
+    with pytest.raises(UsageError):
+        shell.run_line_magic('iprofile', options + ' work()')
+
+
+def test_runs(shell, export_path):
+    shell.user_ns['runs'] = []
+    shell.run_line_magic('iprofile', '-n 3 --export={} runs.append(work())'
+                         .format(export_path))
+    assert len(shell.user_ns['runs']) == 3
+    names, _ = exported(export_path)
+    assert {'work', 'fib'} <= names
+
+
+@pytest.mark.parametrize('options', ['-n 0', '-n x'])
+def test_invalid_runs(shell, options):
+    with pytest.raises(UsageError, match="-n expects"):
+        shell.run_line_magic('iprofile', options + ' work()')
+
+
+def test_await_options(shell):
+    with pytest.raises(UsageError, match="only be combined with the "
+                       "--compare option"):
+        shell.run_line_magic('iprofile', '--sample await asyncio.sleep(0)')
+
+
+def test_await(shell):
+    pytest.importorskip('ipywidgets')
+    pytest.importorskip('bokeh')
+    shell.run_line_magic('iprofile', 'await asyncio.sleep(0.01)')
+    graph = shell.user_ns['_IPROFILE'].cprofile_tree
+    assert graph.nodes['totaltime'][graph.roots()].max() >= 0.01
+
+
+def test_memory(shell, export_path):
+    shell.run_line_magic('iprofile', '--memory --export={} work()'.format(
+        export_path))
+    assert shell.user_ns['result'][-1] == 377
+    with pytest.raises(UsageError, match="--memory can't be combined"):
+        shell.run_line_magic('iprofile', '--memory -n 2 work()')
+
+
+def test_memory_columns(shell):
+    pytest.importorskip('ipywidgets')
+    pytest.importorskip('bokeh')
+    shell.run_line_magic('iprofile', '--memory work()')
+    widget = shell.user_ns['_IPROFILE']
+    assert 'mem_peak' in widget.cprofile_tree.nodes
+    assert 'mem_peak' in [column for column, _ in widget.table_sort_options]
+    # The table has a column of each function's peak, in KiB.
+    assert 'mem_peaks' in widget.table_page_data
+    assert ('mem_peaks', '<f8') in widget.table_binary_columns
+
+
+def test_timer(shell, export_path, monkeypatch):
+    # Calibrate quickly, ahead of the magic.
+    monkeypatch.setattr(timers, '_calibrations', {})
+    timers.calibrate('thread', n=2000)
+    shell.run_line_magic('iprofile', '--timer=thread --calibrate '
+                         '--export={} work()'.format(export_path))
+    names, _ = exported(export_path)
+    assert {'work', 'fib'} <= names
+    with pytest.raises(UsageError, match="Unknown timer"):
+        shell.run_line_magic('iprofile', '--timer=gpu work()')
+
+
+def test_processes(shell, export_path):
+    """The workers of a pool created before the statement are profiled."""
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip("needs the fork start method")
+    shell.user_ns['pool'] = multiprocessing.get_context('fork').Pool(2)
+    try:
+        shell.run_line_magic('iprofile', '--processes --export={} '
+                             'pool.map(math.factorial, range(8))'
+                             .format(export_path))
+    finally:
+        shell.user_ns.pop('pool').terminate()
+    names, _ = exported(export_path)
+    assert any(name.startswith('<worker ') for name in names)
+
+
+def test_threads(shell, export_path):
+    shell.run_cell_magic('iprofile', '--threads --export={}'.format(
+        export_path), u"""
+import threading
+thread = threading.Thread(target=work, name='worker')
+thread.start()
+thread.join()
+""")
+    assert shell.user_ns['result'][-1] == 377
+    names, _ = exported(export_path)
+    assert '<thread worker>' in names
+
+
+@pytest.mark.parametrize('options, message', [
+    ('--compare=missing', "Could not find profile"),
+    ('--compare=1', "expects an IProfile or a path"),
+])
+def test_invalid_compare(shell, options, message):
+    pytest.importorskip('ipywidgets')
+    pytest.importorskip('bokeh')
+    with pytest.raises(UsageError, match=message):
+        shell.run_line_magic('iprofile', options + ' work()')
+
+
+def test_compare(shell, tmp_path):
+    pytest.importorskip('ipywidgets')
+    pytest.importorskip('bokeh')
+    shell.run_line_magic('iprofile', 'work()')
+    first = shell.user_ns['_IPROFILE']
+    path = str(tmp_path / 'first.iprofile')
+    first.save(path)
+    for reference in ('first', repr(path)):
+        shell.user_ns['first'] = first
+        shell.run_line_magic('iprofile', '--compare={} work()'.format(
+            reference))
+        before, after = shell.user_ns['_IPROFILE'].profiles
+        assert graph_names(before) == graph_names(first)
+        assert graph_names(after) == graph_names(first)
+
+
+def test_chrome_export(shell, tmp_path):
+    path = str(tmp_path / 'profile.trace.json')
+    shell.run_line_magic('iprofile', '--export={} work()'.format(path))
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    assert 'work' in {event.get('name') for event in events}
+
+
+@pytest.mark.parametrize('options, message', [
+    ('--export=profile.json', "expects a path ending with"),
+    ('--export=profile.trace.json --compare=first', "can't be combined"),
+])
+def test_invalid_export(shell, options, message):
+    with pytest.raises(UsageError, match=message):
+        shell.run_line_magic('iprofile', options + ' work()')
+    assert 'result' not in shell.user_ns
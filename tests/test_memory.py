@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+
+import cProfile
+import time
+
+import pytest
+
+tracemalloc = pytest.importorskip('tracemalloc')
+
+from iprofiler.callgraph import CallGraph, label
+from iprofiler.memory import MEMORY_COLUMNS, MemoryProfiler
+
+SIZE = 10 ** 6
+
+
+def allocate():
+    kept = bytearray(SIZE)
+    freed = bytearray(2 * SIZE)
+    del freed
+    return kept
+
+
+def profile(func, interval=0.1):
+    profiler = cProfile.Profile()
+    memory = MemoryProfiler(interval)
+    memory.enable()
+    profiler.enable()
+    result = func()
+    profiler.disable()
+    memory.disable()
+    return CallGraph.from_cprofile(profiler.getstats()), memory, result
+
+
+def test_retained_memory():
+    graph, memory, kept = profile(allocate)
+    memory.add_columns(graph)
+    assert set(MEMORY_COLUMNS) <= set(graph.nodes)
+    i = graph.index(allocate.__code__)
+    # The memory still held at the end, and its peak (as the freed memory
+    # was allocated and freed between snapshots).
+    assert graph.nodes['mem_size'][i] == pytest.approx(SIZE, rel=0.01)
+    assert graph.nodes['mem_peak'][i] == pytest.approx(SIZE, rel=0.01)
+    assert graph.nodes['mem_count'][i] >= 1
+    # tracemalloc's peak includes the freed memory.
+    assert memory.peak >= 3 * SIZE
+
+    lines = memory.functions[label(allocate.__code__)]
+    first = allocate.__code__.co_firstlineno
+    assert lines[first + 1][1] == pytest.approx(SIZE, rel=0.01)
+    assert first + 2 not in lines or lines[first + 2][1] <= 0
+    assert not tracemalloc.is_tracing()
+    del kept
+
+
+def hold():
+    held = bytearray(SIZE)
+    # Long enough for snapshots to be taken.
+    time.sleep(0.2)
+    del held
+
+
+def test_sampled_peaks():
+    """Memory held at a snapshot counts towards the line's peak."""
+    graph, memory, _ = profile(hold, interval=0.01)
+    memory.add_columns(graph)
+    lines = memory.functions[label(hold.__code__)]
+    peak, size, _ = lines[hold.__code__.co_firstlineno + 1]
+    assert peak == pytest.approx(SIZE, rel=0.01)
+    # Nothing is held at the end.
+    assert size <= 0
+
+
+def test_tracing_started_elsewhere_is_left_on():
+    tracemalloc.start()
+    try:
+        memory = MemoryProfiler()
+        memory.enable()
+        memory.disable()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
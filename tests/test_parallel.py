@@ -0,0 +1,107 @@
+from __future__ import absolute_import
+
+import multiprocessing
+import multiprocessing.pool
+import os
+
+import pytest
+
+from iprofiler.parallel import ProcessProfiler
+
+from conftest import graph_from
+
+try:
+    import concurrent.futures
+except ImportError:
+    # Python 2
+    concurrent = None
+
+pytestmark = pytest.mark.skipif(
+    'fork' not in multiprocessing.get_all_start_methods(),
+    reason="needs the fork start method")
+
+
+def square(x):
+    return x * x
+
+
+@pytest.fixture
+def context():
+    return multiprocessing.get_context('fork')
+
+
+def task_calls(profiler):
+    """Return the number of calls of square in all workers."""
+    calls = 0
+    for _, graph in profiler.worker_graphs:
+        for i in range(len(graph)):
+            if graph.name(i) == 'square':
+                calls += graph.nodes['callcount'][i]
+    return calls
+
+
+def test_pool(context):
+    profiler = ProcessProfiler()
+    profiler.enable()
+    with context.Pool(2) as pool:
+        assert pool.map(square, range(8)) == [x * x for x in range(8)]
+        assert pool.apply(square, (3,)) == 9
+    profiler.disable()
+    assert task_calls(profiler) == 9
+    assert not os.path.exists(profiler.directory or '')
+
+
+def test_pool_outliving_statement(context):
+    """
+    The tasks of a pool which was created before enable(), and is still
+    running after disable(), are profiled.
+    """
+    pool = context.Pool(2)
+    try:
+        profiler = ProcessProfiler()
+        profiler.enable()
+        pool.map(square, range(8))
+        profiler.disable()
+        assert task_calls(profiler) == 8
+        # Tasks after disable() are neither profiled nor broken.
+        assert pool.map(square, range(4)) == [0, 1, 4, 9]
+    finally:
+        pool.close()
+        pool.join()
+
+
+def test_add_workers(context):
+    profiler = ProcessProfiler()
+    profiler.enable()
+    with context.Pool(2) as pool:
+        pool.map(square, range(8), chunksize=1)
+    profiler.disable()
+    graph = profiler.add_workers(graph_from({'main': (1, 1., 1.)}))
+    roots = sorted(graph.name(i) for i in graph.roots())
+    assert roots[-1] == 'main'
+    assert all(name.startswith('<worker ') for name in roots[:-1])
+    assert len(roots) == len(profiler.worker_graphs) + 1
+    # The tasks are the callees of the worker roots.
+    assert {graph.name(j) for i in graph.roots() for j in graph.children(i)
+            } == {'square'}
+
+
+@pytest.mark.skipif(concurrent is None, reason="needs concurrent.futures")
+def test_executor(context):
+    profiler = ProcessProfiler()
+    profiler.enable()
+    with concurrent.futures.ProcessPoolExecutor(
+            2, mp_context=context) as executor:
+        assert list(executor.map(square, range(8))) == [
+            x * x for x in range(8)]
+    profiler.disable()
+    assert task_calls(profiler) == 8
+
+
+def test_thread_pool_is_not_wrapped():
+    profiler = ProcessProfiler()
+    profiler.enable()
+    with multiprocessing.pool.ThreadPool(2) as pool:
+        pool.map(square, range(8))
+    profiler.disable()
+    assert profiler.worker_graphs == []
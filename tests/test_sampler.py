@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+
+import sys
+import time
+
+import pytest
+
+from iprofiler.callgraph import CallGraph
+from iprofiler.sampler import Sampler
+
+
+def sampler_at(frame):
+    """A Sampler recording the frames above frame, without its thread."""
+    sampler = Sampler()
+    sampler._base_frame = frame
+    sampler._last_stack = []
+    return sampler
+
+
+def test_calls_are_counted_once():
+    sampler = sampler_at(sys._getframe())
+
+    def leaf(n_samples):
+        for _ in range(n_samples):
+            sampler._sample(sys._getframe(), 1.)
+
+    def outer():
+        leaf(2)
+        leaf(1)
+
+    outer()
+    graph = CallGraph.from_cprofile(sampler.getstats())
+    i, j = graph.index(outer.__code__), graph.index(leaf.__code__)
+    # The first call of leaf is seen by two samples.
+    assert graph.nodes['callcount'][[i, j]].tolist() == [1, 2]
+    assert graph.nodes['totaltime'][[i, j]].tolist() == [3., 3.]
+    assert graph.nodes['inlinetime'][[i, j]].tolist() == [0., 3.]
+    assert graph.children(i).tolist() == [j]
+    assert graph.edges['callcount'].tolist() == [2]
+
+
+def test_recursion():
+    sampler = sampler_at(sys._getframe())
+
+    def recurse(n):
+        if n:
+            recurse(n - 1)
+        else:
+            sampler._sample(sys._getframe(), 1.)
+
+    recurse(2)
+    (code, callcount, reccallcount, totaltime, inlinetime,
+     calls), = sampler.getstats()
+    assert code is recurse.__code__
+    assert (callcount, reccallcount) == (3, 2)
+    # The time of the sample is counted once, not once per frame.
+    assert (totaltime, inlinetime) == (1., 1.)
+    assert [call[1:] for call in calls] == [(2, 2, 1., 1.)]
+
+
+def test_line_timings():
+    sampler = sampler_at(sys._getframe())
+
+    def f():
+        sampler._sample(sys._getframe(), 1.)
+        sampler._sample(sys._getframe(), 2.)
+
+    f()
+    timings = sampler.get_stats().timings
+    key = (f.__code__.co_filename, f.__code__.co_firstlineno, 'f')
+    first = f.__code__.co_firstlineno
+    assert timings[key] == [(first + 1, 1, 1000000), (first + 2, 1, 2000000),
+                            __file__]
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(1000))
+
+
+def test_enable_and_disable():
+    sampler = Sampler(interval=0.001)
+    sampler.enable()
+    busy(0.1)
+    sampler.disable()
+    graph = CallGraph.from_cprofile(sampler.getstats())
+    names = {graph.name(i) for i in range(len(graph))}
+    assert 'busy' in names
+    # Only the frames above the caller of enable() are recorded.
+    assert 'test_enable_and_disable' not in names
+    assert sum(graph.nodes['totaltime'][graph.roots()]) == pytest.approx(
+        0.1, rel=0.5)
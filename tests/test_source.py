@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+
+import os
+import zipfile
+
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import PythonLexer
+
+from iprofiler.formatter import format_lprofile
+from iprofiler.source import SourceCache
+
+SOURCE = u'''"""
+Module docstring, with def f(): in it.
+"""
+
+
+@decorator
+def f(x):
+    """Docstring."""
+    return x + 1
+
+
+def g():
+    return """a
+string"""
+'''
+
+
+def whole_file_lines(source):
+    html = highlight(source, PythonLexer(stripnl=False),
+                     HtmlFormatter(nowrap=True, noclasses=True))
+    return [line + "\n" for line in html.split("\n")][:-1]
+
+
+def test_highlighted_span(tmp_path):
+    path = tmp_path / 'module.py'
+    path.write_text(SOURCE)
+    cache = SourceCache()
+    expected = whole_file_lines(SOURCE)
+    assert cache.highlighted_lines(str(path)) == expected
+    # The lines of a function are highlighted as in the whole file.
+    assert cache.highlighted_lines(str(path), 6, 9) == expected[5:9]
+    assert cache.highlighted_lines(str(path), 12, 14) == expected[11:14]
+
+
+def test_spans_are_cached(tmp_path):
+    path = tmp_path / 'module.py'
+    path.write_text(SOURCE)
+    cache = SourceCache()
+    lines = cache.highlighted_lines(str(path), 7, 9)
+    assert cache.highlighted_lines(str(path), 7, 9) is lines
+
+    # Files are highlighted again when they change.
+    path.write_text(SOURCE.replace('x + 1', 'x + 2'))
+    mtime = os.path.getmtime(str(path)) + 10
+    os.utime(str(path), (mtime, mtime))
+    changed = cache.highlighted_lines(str(path), 7, 9)
+    assert changed is not lines
+    assert '2' in changed[-1]
+
+    cache.clear()
+    assert cache.highlighted_lines(str(path), 7, 9) is not changed
+
+
+def test_zipped_egg(tmp_path):
+    egg = str(tmp_path / 'package.egg')
+    with zipfile.ZipFile(egg, 'w') as zipped_file:
+        zipped_file.writestr('package/module.py',
+                             u'# -*- coding: latin-1 -*-\ns = "\xe9"\n'
+                             .encode('latin-1'))
+    cache = SourceCache(max_open_zips=1)
+    filename = egg + '/package/module.py'
+    assert cache.getlines(filename) == [u'# -*- coding: latin-1 -*-\n',
+                                        u's = "\xe9"\n']
+    assert len(cache.highlighted_lines(filename)) == 2
+    cache.clear()
+
+
+def test_format_lprofile(tmp_path):
+    path = tmp_path / 'module.py'
+    path.write_text(SOURCE)
+    ltimings = [(8, 1, 2000000), (9, 1, 1000000), str(path)]
+    html = format_lprofile(7, ltimings)
+    assert 'Docstring' in html and '2.000000' in html
+    assert 'def g' not in html
@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+
+import cProfile
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from iprofiler import store
+from iprofiler.callgraph import CodeKey, MergedCode, label
+from iprofiler.sampler import LineStats
+
+from conftest import graph_from
+
+
+def test_save_and_load_profile(tmp_path):
+    f = CodeKey('/src/module.py', 10, 'f')
+    graph = graph_from({'main': (1, 3., 1.), f: (2, 2., 2.)},
+                       [('main', f, 2, 2.)])
+    ltimings = {label(f): [(11, 2, 150), (12, 2, 50), '/src/module.py']}
+    path = str(tmp_path / 'profile.iprofile')
+    store.save_profile(path, graph, ltimings, unit=1e-7)
+
+    assert store.is_profile(path)
+    loaded, lprofile = store.load_profile(path)
+    assert loaded.keys == graph.keys
+    for column in graph.nodes:
+        np.testing.assert_array_equal(loaded.nodes[column],
+                                      graph.nodes[column])
+    for column in graph.edges:
+        np.testing.assert_array_equal(loaded.edges[column],
+                                      graph.edges[column])
+    np.testing.assert_array_equal(loaded.indptr, graph.indptr)
+    np.testing.assert_array_equal(loaded.indices, graph.indices)
+    assert lprofile.unit == 1e-7
+    assert dict(lprofile.timings) == ltimings
+
+
+def test_save_without_line_timings(tmp_path, diamond):
+    path = str(tmp_path / 'profile.iprofile')
+    store.save_profile(path, diamond)
+    loaded, lprofile = store.load_profile(path)
+    assert loaded.keys == diamond.keys
+    assert len(lprofile.timings) == 0
+
+
+def test_load_profile_errors(tmp_path, diamond):
+    path = tmp_path / 'other'
+    path.write_bytes(b'not a profile')
+    assert not store.is_profile(str(path))
+    with pytest.raises(ValueError):
+        store.load_profile(str(path))
+
+    # A profile from a newer version.
+    newer = str(tmp_path / 'newer.iprofile')
+    store.save_profile(newer, diamond)
+    with open(newer, 'rb') as f:
+        data = f.read()
+    start = len(store.MAGIC) + 8
+    length, = struct.unpack('<Q', data[len(store.MAGIC):start])
+    header = json.loads(data[start:start + length].decode('utf-8'))
+    header['version'] = store.VERSION + 1
+    text = json.dumps(header).encode('utf-8').ljust(length)
+    with open(newer, 'wb') as f:
+        f.write(data[:start] + text + data[start + length:])
+    with pytest.raises(ValueError):
+        store.load_profile(newer)
+
+
+def test_load_pstats(tmp_path):
+    def leaf():
+        return sorted(range(100))
+
+    def main():
+        for _ in range(3):
+            leaf()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    main()
+    profiler.disable()
+    path = str(tmp_path / 'stats.pstats')
+    profiler.dump_stats(path)
+
+    graph = store.load_pstats(path)
+    main_key = CodeKey(*label(main.__code__))
+    leaf_key = CodeKey(*label(leaf.__code__))
+    i, j = graph.index(main_key), graph.index(leaf_key)
+    assert graph.nodes['callcount'][j] == 3
+    assert graph.children(i).tolist() == [j]
+    assert graph.edges['callcount'][graph.indptr[i]] == 3
+    assert "<built-in method builtins.sorted>" in graph
+
+
+def test_merged_ltimings():
+    first = CodeKey('<ipython-input-1-abc>', 1, '<module>')
+    second = CodeKey('<ipython-input-1-abc>', 3, '<module>')
+    cell = MergedCode(first.co_filename, 1, '<cell>', (first, second))
+    lprofile = LineStats({
+        label(first): [(1, 1, 10), (2, 2, 20), 'cell'],
+        label(second): [(2, 1, 5), (3, 1, 30), 'cell']}, 1e-6)
+
+    assert store.merged_ltimings(lprofile, cell) == [
+        (1, 1, 10), (2, 3, 25), (3, 1, 30), 'cell']
+    assert store.merged_ltimings(lprofile, first) == [
+        (1, 1, 10), (2, 2, 20), 'cell']
+    assert store.merged_ltimings(lprofile, 'len') is None
+    assert store.merged_ltimings(None, first) is None
+
+    graph = graph_from({cell: (1, 1., 1.), 'len': (1, 1., 1.)})
+    assert store.ltimings_by_label(graph, lprofile) == {
+        label(cell): [(1, 1, 10), (2, 3, 25), (3, 1, 30), 'cell']}
+    assert store.timer_unit(lprofile) == 1e-6
+    assert store.timer_unit(None) == 1e-6
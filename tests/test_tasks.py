@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+
+import asyncio
+
+import pytest
+
+from iprofiler import tasks
+
+
+async def work():
+    await asyncio.sleep(0.05)
+    return sum(range(10 ** 4))
+
+
+async def main():
+    return await asyncio.gather(*[work() for _ in range(3)])
+
+
+async def fail():
+    raise ValueError("failed")
+
+
+def test_task_graph():
+    graph = tasks.profile_coroutine(main())
+    roots = graph.roots()
+    assert [graph.name(i) for i in roots] == ['main']
+    i = graph.index(work.__code__)
+    assert graph.children(roots[0]).tolist() == [i]
+    assert graph.nodes['callcount'][i] == 3
+    # Tasks are timed from creation to completion, but only their steps
+    # count as inline time.
+    assert graph.nodes['totaltime'][i] >= 3 * 0.05
+    assert graph.nodes['inlinetime'][i] < graph.nodes['totaltime'][i] / 2
+    assert graph.nodes['totaltime'][roots[0]] >= 0.05
+
+
+def test_running_loop():
+    """In a running event loop, the coroutine is run in another thread."""
+    async def profile():
+        return tasks.profile_coroutine(main())
+
+    loop = asyncio.new_event_loop()
+    try:
+        graph = loop.run_until_complete(profile())
+    finally:
+        loop.close()
+    assert graph.nodes['callcount'][graph.index(work.__code__)] == 3
+
+    async def profile_failing():
+        return tasks.profile_coroutine(fail())
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(ValueError):
+            loop.run_until_complete(profile_failing())
+    finally:
+        loop.close()
+
+
+async def wait():
+    await asyncio.sleep(10)
+
+
+def test_task_profiler():
+    loop = asyncio.new_event_loop()
+    try:
+        profiler = tasks.TaskProfiler(loop)
+        profiler.enable()
+        loop.run_until_complete(main())
+        # main and the tasks it created.
+        assert len(profiler.records) == 4
+
+        waiting = loop.create_task(wait())
+        loop.run_until_complete(asyncio.sleep(0.05))
+        profiler.disable()
+        assert loop.get_task_factory() is None
+        # Tasks which haven't finished are timed up to now.
+        graph = profiler.getstats()
+        assert graph.nodes['totaltime'][graph.index(wait.__code__)] >= 0.05
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            loop.run_until_complete(waiting)
+    finally:
+        loop.close()
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+import sys
+import threading
+import time
+
+import pytest
+
+from iprofiler.threads import ThreadProfiler, combine_threads
+
+from conftest import graph_from
+
+# From Python 3.12 the calls of threads are only recorded by the profiler of
+# the main thread, if any.
+separate_profiles = sys.version_info < (3, 12)
+
+
+def spin():
+    return sum(range(10 ** 5))
+
+
+def sleep():
+    time.sleep(0.1)
+
+
+def run_threads(profiler, *targets):
+    profiler.enable()
+    threads = [threading.Thread(target=target, name=target.__name__) for
+               target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiler.disable()
+
+
+def test_threads_are_profiled():
+    start = threading.Thread.start
+    profiler = ThreadProfiler()
+    run_threads(profiler, spin, sleep)
+    assert threading.Thread.start is start
+
+    main = graph_from({'main': (1, 1., 1.)})
+    threads = profiler.threads(main)
+    assert threads[0].name == "Main thread" and threads[0].graph is main
+    assert threads[0].wall_time >= 0.1
+    by_name = {thread.name: thread for thread in threads[1:]}
+    assert sorted(by_name) == ['sleep', 'spin']
+
+    sleeping = by_name['sleep']
+    assert sleeping.wall_time >= 0.1
+    if sleeping.cpu_time is not None:
+        # Waiting doesn't take CPU time.
+        assert sleeping.cpu_time < sleeping.wall_time / 2
+
+    for name, thread in by_name.items():
+        graph = thread.graph
+        roots = [graph.name(i) for i in graph.roots()]
+        assert roots == ["<thread {}>".format(name)]
+        if separate_profiles:
+            reachable = graph.reachable(graph.roots())
+            assert name in {graph.name(i) for i in range(len(graph)) if
+                            reachable[i]}
+
+
+def test_threads_started_before_enable_are_ignored():
+    started = threading.Event()
+    stop = threading.Event()
+
+    def wait():
+        started.set()
+        stop.wait()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    started.wait()
+    profiler = ThreadProfiler()
+    run_threads(profiler, spin)
+    stop.set()
+    thread.join()
+    assert [profile.name for profile in profiler.profiles] == ['spin']
+
+
+@pytest.mark.skipif(not separate_profiles,
+                    reason="threads share the main thread's profiler")
+def test_combine_threads():
+    profiler = ThreadProfiler()
+    run_threads(profiler, spin, spin)
+    main = graph_from({'main': (1, 1., 1.)})
+    graph = combine_threads(profiler.threads(main))
+    names = sorted(graph.name(i) for i in graph.roots())
+    assert names == ['<thread spin>', 'main']
+    # The calls of both threads are merged.
+    spin_id = [i for i in range(len(graph)) if graph.name(i) == 'spin'][0]
+    assert graph.nodes['callcount'][spin_id] == 2
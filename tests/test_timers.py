@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+
+import time
+
+import pytest
+
+from iprofiler import timers
+from iprofiler.callgraph import CallGraph, CodeKey, label
+from iprofiler.sampler import LineStats
+from iprofiler.timers import Calibration
+
+from conftest import graph_from
+
+
+def test_get_timer():
+    for name, _ in timers.TIMERS:
+        function, unit = timers.get_timer(name)
+        assert isinstance(function(), int) and unit == 1e-9
+    with pytest.raises(ValueError, match="Unknown timer"):
+        timers.get_timer('gpu')
+
+
+def sleep():
+    time.sleep(0.05)
+
+
+@pytest.mark.parametrize('timer', ['wall', 'thread'])
+def test_cprofile_timer(timer):
+    profiler = timers.cprofile(timer)
+    profiler.enable()
+    sleep()
+    profiler.disable()
+    graph = CallGraph.from_cprofile(profiler.getstats())
+    totaltime = graph.nodes['totaltime'][graph.index(sleep.__code__)]
+    # Times are in seconds, and sleeping doesn't take CPU time.
+    if timer == 'wall':
+        assert totaltime >= 0.05
+    else:
+        assert totaltime < 0.01
+
+
+def test_calibrate(monkeypatch):
+    monkeypatch.setattr(timers, '_calibrations', {})
+    calibration = timers.calibrate('wall', n=2000)
+    assert all(0 <= overhead < 1e-4 for overhead in calibration)
+    # cProfile adds some overhead to each call.
+    assert calibration.call > 0
+    assert timers.calibrate('wall') is calibration
+
+
+def test_subtract_overhead(diamond):
+    timers.subtract_overhead(Calibration(.1, .05, 0.), diamond)
+    inline = {key: diamond.nodes['inlinetime'][i] for
+              i, key in enumerate(diamond.keys)}
+    # main is called once and makes 3 calls, a is called once and makes 4,
+    # b is called twice and makes 2, and leaf is called 6 times.
+    assert inline == pytest.approx({'main': .75, 'a': .7, 'b': .7,
+                                    'leaf': 6.4})
+    # Total times are unchanged.
+    assert diamond.nodes['totaltime'].tolist() == [6., 3., 7., 10.]
+
+    timers.subtract_overhead(Calibration(10., 0., 0.), diamond)
+    assert diamond.nodes['inlinetime'].tolist() == [0.] * 4
+
+
+def test_subtract_line_overhead():
+    f = CodeKey('/src/module.py', 1, 'f')
+    graph = graph_from({f: (1, 2., 2.)})
+    lprofile = LineStats({label(f): [(2, 10, 500000), (3, 1, 5),
+                                     '/src/module.py']}, 1e-6)
+    timers.subtract_overhead(Calibration(0., 0., 1e-5), graph, lprofile)
+    # 10 microseconds per hit, clipped at zero.
+    assert lprofile.timings[label(f)] == [(2, 10, 499900), (3, 1, 0),
+                                          '/src/module.py']
+    assert graph.nodes['inlinetime'][0] == pytest.approx(2. - 11e-5)
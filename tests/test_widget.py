@@ -0,0 +1,158 @@
+from __future__ import absolute_import
+
+import numpy as np
+import pytest
+
+pytest.importorskip('ipywidgets')
+pytest.importorskip('bokeh')
+
+from iprofiler.iprofiler import IProfile
+
+from conftest import graph_from
+
+
+def click(widget, fun):
+    widget.handle_on_msg(None, "function{}".format(
+        widget.cprofile_tree.index(fun)), [])
+
+
+def test_pages_are_cached(diamond, monkeypatch):
+    widget = IProfile(diamond, prefetch=1)
+    generated = []
+    generate_page = widget.generate_page
+
+    def record(fun):
+        generated.append(fun)
+        return generate_page(fun)
+    monkeypatch.setattr(widget, 'generate_page', record)
+
+    click(widget, 'main')
+    # The page of the slowest callee, a, is rendered ahead of a click.
+    assert generated == ['main', 'a']
+    click(widget, 'a')
+    assert generated == ['main', 'a', 'leaf']
+    widget.handle_on_msg(None, "back", [])
+    widget.handle_on_msg(None, "home", [])
+    assert generated == ['main', 'a', 'leaf']
+    assert widget.value_heading == generate_page(None).heading
+
+    # Pages are rendered again with new line timings.
+    widget.lprofile = None
+    click(widget, 'main')
+    assert generated[-2:] == ['main', 'a']
+
+
+def test_cache_size(diamond):
+    widget = IProfile(diamond, cache_size=2)
+    for fun in ['main', 'a', 'b', 'leaf']:
+        click(widget, fun)
+    assert len(widget.page_cache) == 2
+    assert 'leaf' in widget.page_cache and 'main' not in widget.page_cache
+
+
+@pytest.fixture
+def wide():
+    """main calls f0 to f44, where f<i> takes i + 1 seconds."""
+    functions = {'f{}'.format(i): (1, i + 1., i + 1.) for i in range(45)}
+    functions['main'] = (1, 1100., 65.)
+    return graph_from(functions, [('main', 'f{}'.format(i), 1, i + 1.) for
+                                  i in range(45)])
+
+
+def names(widget):
+    return [widget.cprofile_tree.name(i) for
+            i in widget.table_page_data['ids']]
+
+
+def test_table_pages(wide):
+    widget = IProfile(wide)
+    assert widget.n_table_elements == 46
+    assert widget.table_n_pages == 3
+    assert names(widget)[:3] == ['main', 'f44', 'f43']
+    assert len(names(widget)) == widget.table_page_size
+
+    widget.handle_on_msg(None, {'page': 2}, [])
+    assert names(widget) == ['f{}'.format(i) for i in range(5, -1, -1)]
+    # Pages past the end show the last page.
+    widget.handle_on_msg(None, {'page': 5}, [])
+    assert widget.table_page == 2
+
+
+def test_table_sort_and_filter(wide):
+    widget = IProfile(wide)
+    widget.handle_on_msg(None, {'page': 1}, [])
+    widget.handle_on_msg(None, {'sort': 'name', 'filter': 'F1'}, [])
+    # Changing the sort or filter goes back to the first page.
+    assert widget.table_page == 0
+    assert names(widget) == ['f1'] + ['f1{}'.format(i) for i in range(10)]
+    assert widget.n_table_elements == 11
+
+    widget.handle_on_msg(None, {'sort': 'callcount', 'filter': ''}, [])
+    assert widget.table_sort == 'callcount'
+    # Unknown columns are ignored.
+    widget.handle_on_msg(None, {'sort': 'nonsense'}, [])
+    assert widget.table_sort == 'callcount'
+
+    # The table of a function lists its callees.
+    widget.handle_on_msg(None, {'sort': 'totaltime'}, [])
+    click(widget, 'main')
+    assert widget.n_table_elements == 45
+    assert names(widget)[0] == 'f44'
+
+
+def test_table_binary_columns(wide, monkeypatch):
+    widget = IProfile(wide)
+    sent = []
+    monkeypatch.setattr(widget, 'send', lambda content, buffers=None:
+                        sent.append((content, buffers)))
+    widget.send_table(widget.table_page_data)
+    (content, buffers), = sent
+    assert content['type'] == 'table'
+    assert len(buffers) == len(content['columns']) == len(content['dtypes'])
+    for column, dtype, buffer in zip(content['columns'], content['dtypes'],
+                                     buffers):
+        np.testing.assert_allclose(
+            np.frombuffer(buffer, dtype=dtype),
+            widget.table_page_data[column], rtol=1e-6)
+    # Names are synced once, and looked up from the ids.
+    assert 'names' not in content['columns']
+    assert widget.function_names == [wide.name(i) for i in range(len(wide))]
+
+
+def test_callers(diamond):
+    widget = IProfile(diamond)
+    click(widget, 'leaf')
+    callers = widget.value_callers
+    # Slowest first, with the share of leaf's time.
+    assert callers.index('>a<') < callers.index('>b<')
+    assert '71.4%' in callers and '28.6%' in callers
+    assert 'function{}'.format(diamond.index('a')) in callers
+    click(widget, 'main')
+    assert widget.value_callers == ""
+
+
+def table_times(widget):
+    return dict(zip(names(widget), widget.table_page_data['times']))
+
+
+def test_time_display(diamond):
+    widget = IProfile(diamond)
+    widget.handle_on_msg(None, {'unit': 'ms'}, [])
+    assert table_times(widget) == pytest.approx(
+        {'main': 10000., 'leaf': 7000., 'a': 6000., 'b': 3000.})
+    assert widget.time_title("Time") == "Time (ms)"
+
+    widget.handle_on_msg(None, {'unit': 's', 'mode': 'per_call'}, [])
+    assert table_times(widget)['b'] == pytest.approx(1.5)
+    assert widget.time_title("Time") == "Time per call (s)"
+
+    widget.handle_on_msg(None, {'mode': 'percent_total'}, [])
+    assert table_times(widget)['leaf'] == pytest.approx(70.)
+
+    widget.handle_on_msg(None, {'mode': 'percent_parent'}, [])
+    click(widget, 'main')
+    assert table_times(widget) == pytest.approx({'a': 60., 'b': 30.})
+
+    # Unknown units and modes are ignored.
+    widget.handle_on_msg(None, {'unit': 'h', 'mode': 'nonsense'}, [])
+    assert (widget.time_unit, widget.time_mode) == ('s', 'percent_parent')